@@ -0,0 +1 @@
+# Benchmarks for the data and callback hot paths (run with `python -m benchmarks.<module>`)
@@ -0,0 +1,81 @@
+"""Filter-change latency: apply_global_filters vs the bitmap FilterIndex.
+
+    python -m benchmarks.bench_filter_index --rows 100000 10000000
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.reference import apply_global_filters
+from src import data_processing
+from src.filter_index import FilterIndex
+
+# Filter states a user steps through, from broad to narrow
+FILTER_STATES = [
+    ('All', 'All', 'All', 'All', 'All', 'All'),
+    ('Ontario', 'All', 'All', 'All', 'All', 'All'),
+    ('All', '35-49', 'Female', 'All', 'All', 'All'),
+    ('Quebec', 'All', 'Male', '$40,000 to $59,999', 'All', 'All'),
+    ('British Columbia', '20-34', 'Female', 'All', 'Yes', 'No'),
+    ('Nunavut', '65+', 'Male', 'Less than $20,000', 'No', 'Yes'),
+]
+
+
+def synthetic_filter_frame(n_rows, seed=0):
+    """Decoded frame with just the filtered columns, label dtype as load_data returns"""
+    rng = np.random.default_rng(seed)
+
+    def labels(mapping):
+        values = np.array(list(mapping.values()), dtype=object)
+        return pd.Series(values[rng.integers(0, len(values), n_rows)], dtype='str')
+
+    return pd.DataFrame({
+        'Province': labels(data_processing.PROVINCE_MAP),
+        'Age': rng.integers(12, 81, n_rows),
+        'Gender': labels(data_processing.GENDER_MAP),
+        'Total_income': labels(data_processing.INCOME_MAP),
+        'Immigrant': labels(data_processing.IMMIGRANT_MAP),
+        'Aboriginal_identity': labels(data_processing.ABORIGINAL_MAP),
+    })
+
+
+def median_ms(fn, repeat):
+    """Median wall time of ``fn`` in milliseconds"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def run(n_rows, repeat):
+    df = synthetic_filter_frame(n_rows)
+
+    start = time.perf_counter()
+    index = FilterIndex(df)
+    build_ms = (time.perf_counter() - start) * 1000
+    print(f"\n{n_rows:,} rows  (index build {build_ms:,.0f} ms, {index.nbytes / 1e6:,.1f} MB)")
+    print(f"{'filter state':<60} {'current ms':>11} {'index ms':>9} {'speedup':>8}")
+
+    for state in FILTER_STATES:
+        expected = apply_global_filters(df, *state)
+        assert index.take(df, *state).index.equals(expected.index)
+
+        current = median_ms(lambda: apply_global_filters(df, *state), repeat)
+        indexed = median_ms(lambda: index.take(df, *state), repeat)
+        label = ' | '.join(state)
+        print(f"{label:<60} {current:>11.2f} {indexed:>9.2f} {current / indexed:>7.1f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[100_000, 10_000_000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    for n in args.rows:
+        run(n, args.repeat)
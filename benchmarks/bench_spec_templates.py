@@ -0,0 +1,64 @@
+"""Chart rendering cost: Altair construction + to_dict()/to_html() vs spec templates.
+
+Both paths render the same aggregated data, taken from the running app's
+data functions, so the difference is purely the spec-building step.
+
+    python -m benchmarks.bench_spec_templates
+"""
+import argparse
+import statistics
+import time
+
+from src import app, data_processing, spec_templates
+from src.plots import behavior_outcome_scatter, food_security_mental_health_bars, outcome_income_bars
+
+STATES = [
+    ('All', 'All', 'All', 'All', 'All', 'All'),
+    ('Ontario', '20-34', 'Female', 'All', 'No', 'All'),
+]
+
+
+def median_ms(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def cases(state):
+    """(label, altair render, template render) for each chart at ``state``"""
+    chart1 = data_processing.materialize_labels(app.chart1_data(*state, 'Gen_health_state'))
+    rows = app.filter_rows(*state).dropna(subset=['Total_physical_act_time', 'Health_utility_index', 'Total_income'])
+    if len(rows) > 5000:
+        rows = rows.sample(5000, random_state=42)
+    chart2 = data_processing.materialize_labels(rows[['Total_physical_act_time', 'Health_utility_index', 'Total_income']])
+    chart3 = data_processing.materialize_labels(app.chart3_data(*state))
+    subtitle = f"Total: {int(chart3['respondent_count'].sum()):,} respondents | Filter: All ages"
+
+    return [
+        ('chart1', lambda: outcome_income_bars(chart1, 'Gen_health_state').to_dict(),
+         lambda: spec_templates.chart1_spec(chart1, 'Gen_health_state')),
+        ('chart2', lambda: behavior_outcome_scatter(chart2).to_dict(),
+         lambda: spec_templates.chart2_spec(chart2)),
+        ('chart3', lambda: food_security_mental_health_bars(chart3, subtitle).to_html(),
+         lambda: spec_templates.chart3_spec(chart3, subtitle)),
+    ]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'state':<45} {'chart':<7} {'altair ms':>10} {'template ms':>12} {'callback ms':>12}")
+    callbacks = {
+        'chart1': lambda s: app.update_chart1(*s, 'Gen_health_state'),
+        'chart2': lambda s: app.update_chart2(*s),
+        'chart3': lambda s: app.update_chart3(*s),
+    }
+    for state in STATES:
+        for name, altair_path, template_path in cases(state):
+            print(f"{' | '.join(state):<45} {name:<7} {median_ms(altair_path, args.repeat):>10.2f} "
+                  f"{median_ms(template_path, args.repeat):>12.2f} {median_ms(lambda: callbacks[name](state), args.repeat):>12.2f}")
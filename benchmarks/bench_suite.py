@@ -0,0 +1,275 @@
+"""Timing and peak-memory suite for the data and callback hot paths, checked against stored baselines.
+
+Each dataset size runs in its own process against a synthetic CCHS-shaped
+dataset (``benchmarks/synthetic.py``, cached under ``benchmarks/.data``),
+with the app pointed at it through HEALTH_DASH_DATA_DIR. Every case is
+timed ``--repeat`` times (median) and then run once more under
+``tracemalloc`` for its peak allocation. Cases slower or hungrier than
+``benchmarks/baselines.json`` by more than the tolerance are reported
+and the run exits non-zero.
+
+    python -m benchmarks.bench_suite                      # run and check against the baselines
+    python -m benchmarks.bench_suite --rows 10000000 --no-check
+    python -m benchmarks.bench_suite --update-baselines   # after an intended change
+
+Timings depend on the machine; record baselines on the machine that checks them.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_ROOT = os.path.join(ROOT, 'benchmarks', '.data')
+BASELINES_PATH = os.path.join(ROOT, 'benchmarks', 'baselines.json')
+
+DEFAULT_ROWS = [100_000, 1_000_000]
+
+# Filter mixes from the landing view down to a narrow segment
+FILTER_MIXES = {
+    'all': ('All', 'All', 'All', 'All', 'All', 'All'),
+    'province': ('Ontario', 'All', 'All', 'All', 'All', 'All'),
+    'age_gender': ('All', '35-49', 'Female', 'All', 'All', 'All'),
+    'province_gender_income': ('Quebec', 'All', 'Male', '$40,000 to $59,999', 'All', 'All'),
+    'narrow': ('British Columbia', '20-34', 'Female', 'All', 'Yes', 'No'),
+}
+
+# Chart 2 brushes as quantile bounds on both axes, from a small rectangle to half of each range
+BRUSHES = {
+    'small': (0.45, 0.55),
+    'medium': (0.25, 0.75),
+}
+
+# Ignore differences below these, which are noise rather than regressions
+MIN_REGRESSION_MS = 2.0
+MIN_REGRESSION_MB = 1.0
+
+
+def measure(fn, repeat, setup=None):
+    """``{'ms': median wall time, 'peak_mb': tracemalloc peak}`` of ``fn()``, calling ``setup()`` before each run"""
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+
+    if setup:
+        setup()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'ms': round(statistics.median(times), 3), 'peak_mb': round(peak / 1e6, 3)}
+
+
+def _rendered(spec):
+    """Fail the run if a callback fell back to a text message instead of a chart"""
+    values = spec.get('data', {}).get('values') or [{}]
+    if 'text' in values[0]:
+        raise AssertionError(f"callback rendered a message instead of a chart: {values[0]['text']!r}")
+    return spec
+
+
+def run_cases(repeat):
+    """Measure every case in this process; data comes from HEALTH_DASH_DATA_DIR"""
+    from src import data_processing
+
+    results = {}
+    shutil.rmtree(data_processing.CACHE_ROOT, ignore_errors=True)
+    results['load_data/cold'] = measure(
+        data_processing.load_data, 1, setup=lambda: shutil.rmtree(data_processing.CACHE_ROOT, ignore_errors=True)
+    )
+    results['load_data/cached'] = measure(data_processing.load_data, repeat)
+    results['load_data/compact'] = measure(lambda: data_processing.load_data(compact=True), repeat)
+
+    # The app loads the (now cached) data at import
+    from src import app
+    from benchmarks.reference import apply_global_filters
+    from src.plots import behavior_outcome_scatter
+    from src.conditions import ConditionMatrix
+    from src.segments import SegmentEngine
+
+    if not app.data_loaded:
+        raise RuntimeError(app.data_status)
+    df = app.df
+    results['get_filter_options'] = measure(lambda: data_processing.get_filter_options(df), repeat)
+    results['segments/build'] = measure(lambda: SegmentEngine.build(df), repeat)
+    segments = SegmentEngine.build(df)
+    results['conditions/build'] = measure(lambda: ConditionMatrix.build(df), repeat)
+    conditions = ConditionMatrix.build(df)
+
+    for mix, state in FILTER_MIXES.items():
+        results[f'apply_global_filters/{mix}'] = measure(lambda: apply_global_filters(df, *state), repeat)
+        # Clearing the result cache before each run times the computation, not a cache hit
+        clear = app.result_cache.clear
+        results[f'update_chart1/{mix}'] = measure(
+            lambda: _rendered(app.update_chart1(*state, 'Gen_health_state')), repeat, setup=clear)
+        results[f'update_chart2/{mix}'] = measure(lambda: _rendered(app.update_chart2(*state)), repeat, setup=clear)
+        results[f'update_chart3/{mix}'] = measure(lambda: _rendered(app.update_chart3(*state)), repeat, setup=clear)
+        results[f'segments/rank/{mix}'] = measure(lambda: segments.rank(*state), repeat, setup=segments._cache.clear)
+        positions = app.filter_index.positions(*state)
+        results[f'conditions/prevalence/{mix}'] = measure(lambda: conditions.prevalence('Total_income', positions), repeat)
+        results[f'conditions/comorbidity/{mix}'] = measure(lambda: conditions.comorbidity(positions), repeat)
+
+        rows = apply_global_filters(df, *state).dropna(
+            subset=['Total_physical_act_time', 'Health_utility_index', 'Total_income'])
+        sample = rows.sample(min(len(rows), 5000), random_state=42)
+        results[f'behavior_outcome_scatter/{mix}'] = measure(lambda: behavior_outcome_scatter(sample).to_dict(), repeat)
+
+    # Brushing Chart 2: a grid-index query against a scan of the two columns, and Chart 3 over the brushed rows
+    import numpy as np
+    from src.spatial_index import BrushIndex
+
+    behavior_var = 'Total_physical_act_time'
+    results['brush/build'] = measure(lambda: BrushIndex(df).grid(behavior_var), repeat)
+    brush_index = BrushIndex(df)
+    x = df[behavior_var].to_numpy(dtype=float, na_value=np.nan)
+    y = df['Health_utility_index'].to_numpy(dtype=float, na_value=np.nan)
+    for name, bounds in BRUSHES.items():
+        (x_low, x_high), (y_low, y_high) = np.nanquantile(x, bounds), np.nanquantile(y, bounds)
+        brush = (behavior_var, x_low, x_high, y_low, y_high)
+        results[f'brush/index/{name}'] = measure(lambda: brush_index.positions(brush), repeat)
+        results[f'brush/scan/{name}'] = measure(
+            lambda: np.flatnonzero((x >= x_low) & (x <= x_high) & (y >= y_low) & (y <= y_high)), repeat)
+        results[f'update_chart3/brush_{name}'] = measure(
+            lambda: _rendered(app.update_chart3(*FILTER_MIXES['all'], list(brush))), repeat, setup=app.result_cache.clear)
+
+    # Approximate mode: drawing and timing the stratified samples, and the estimates behind brushed Charts 1 and 3
+    from src.sampling import StratifiedSample
+
+    results['sampling/build'] = measure(lambda: StratifiedSample(df).calibrate(), repeat)
+    level = StratifiedSample(df).calibrate().level_for(0.05)
+    for name, bounds in BRUSHES.items():
+        (x_low, x_high), (y_low, y_high) = np.nanquantile(x, bounds), np.nanquantile(y, bounds)
+        brush = (behavior_var, x_low, x_high, y_low, y_high)
+        results[f'sampling/chart1/brush_{name}'] = measure(
+            lambda: level.chart1(FILTER_MIXES['all'], 'Gen_health_state', brush), repeat)
+        results[f'sampling/chart3/brush_{name}'] = measure(lambda: level.chart3(FILTER_MIXES['all'], brush), repeat)
+
+    # Bulk export: the outcome distribution by income for every province, one grouped pass against one
+    # filter + groupby per province
+    from src.export import Batch
+
+    group_by = ['Total_income', 'Gen_health_state']
+    provinces = df['Province'].dropna().unique()
+    results['export/batch/provinces'] = measure(
+        lambda: ''.join(Batch(df, [{'province': '*'}], group_by, index=app.filter_index).csv()), repeat)
+    results['export/per_state/provinces'] = measure(
+        lambda: [apply_global_filters(df, province, *FILTER_MIXES['all'][1:]).groupby(group_by, observed=True).size()
+                 for province in provinces], repeat)
+
+    return results
+
+
+def dataset_dir(n_rows, seed):
+    """Data dir holding ``raw/health_dataset.csv`` with ``n_rows`` synthetic rows, generated on first use"""
+    from benchmarks import synthetic
+
+    path = os.path.join(DATA_ROOT, f'{n_rows}-seed{seed}')
+    csv_path = os.path.join(path, 'raw', 'health_dataset.csv')
+    if not os.path.exists(csv_path):
+        print(f"Generating {n_rows:,} synthetic rows ...", flush=True)
+        synthetic.write_csv(csv_path, n_rows, seed)
+    return path
+
+
+def run_size(n_rows, seed, repeat):
+    """Run the cases for one dataset size in a fresh process and return its results"""
+    # Measure the default configuration whatever the caller's shell has switched on
+    env = {k: v for k, v in os.environ.items() if not k.startswith('HEALTH_DASH_')}
+    env.update(HEALTH_DASH_DATA_DIR=dataset_dir(n_rows, seed), PYTHONPATH=ROOT)
+    out = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.bench_suite', '--worker', '--repeat', str(repeat)],
+        cwd=ROOT, env=env, check=True, stdout=subprocess.PIPE, text=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def compare(n_rows, results, baseline, tolerance):
+    """Print the results next to the baseline; returns the list of regressions"""
+    regressions = []
+    print(f"\n{n_rows:,} rows")
+    print(f"{'case':<46} {'ms':>10} {'base ms':>10} {'peak MB':>9} {'base MB':>9}")
+    for case, result in results.items():
+        base = baseline.get(case)
+        flags = []
+        if base:
+            if result['ms'] > base['ms'] * (1 + tolerance) and result['ms'] - base['ms'] > MIN_REGRESSION_MS:
+                flags.append('TIME')
+            if (result['peak_mb'] > base['peak_mb'] * (1 + tolerance)
+                    and result['peak_mb'] - base['peak_mb'] > MIN_REGRESSION_MB):
+                flags.append('MEMORY')
+        base_ms = f"{base['ms']:.2f}" if base else '-'
+        base_mb = f"{base['peak_mb']:.1f}" if base else '-'
+        line = f"{case:<46} {result['ms']:>10.2f} {base_ms:>10} {result['peak_mb']:>9.1f} {base_mb:>9}"
+        if flags:
+            line += '  REGRESSION (' + ', '.join(flags) + ')'
+            regressions.append((n_rows, case, flags))
+        print(line)
+
+    missing = sorted(set(baseline) - set(results))
+    for case in missing:
+        print(f"{case:<46} missing from this run (in baseline)")
+    return regressions
+
+
+def load_baselines(path=BASELINES_PATH):
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return {'results': {}}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tolerance', type=float, default=0.3,
+                        help='allowed slowdown / memory growth over the baseline (default 0.3 = 30%%)')
+    parser.add_argument('--update-baselines', action='store_true', help='store this run as the new baselines')
+    parser.add_argument('--no-check', action='store_true', help='report only, never fail')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        print(json.dumps(run_cases(args.repeat)))
+        return 0
+
+    baselines = load_baselines()
+    regressions = []
+    for n_rows in args.rows:
+        results = run_size(n_rows, args.seed, args.repeat)
+        regressions += compare(n_rows, results, baselines['results'].get(str(n_rows), {}), args.tolerance)
+        baselines['results'][str(n_rows)] = results
+
+    if args.update_baselines:
+        baselines.update(machine=f"{platform.machine()} {platform.system()} Python {platform.python_version()}",
+                         seed=args.seed, repeat=args.repeat)
+        with open(BASELINES_PATH, 'w') as fh:
+            json.dump(baselines, fh, indent=2, sort_keys=True)
+            fh.write('\n')
+        print(f"\nBaselines written to {BASELINES_PATH}")
+        return 0
+
+    if regressions and not args.no_check:
+        print(f"\nFAILED: {len(regressions)} regression(s) beyond {args.tolerance:.0%} of the baseline:")
+        for n_rows, case, flags in regressions:
+            print(f"  {n_rows:,} rows  {case}  ({', '.join(flags)})")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,562 @@
+"""Concurrent-user load test of the real Dash endpoints under gunicorn.
+
+For each ``WORKERSxTHREADS`` configuration, boots ``gunicorn src.app:server``
+against the synthetic CCHS-shaped dataset of ``bench_suite`` and has
+simulated users browse it at the same time. A user opens the page (the
+layout, then the initial callbacks), then changes dropdowns, toggles the
+outcome and behaviour variables and hits reset, with think time in
+between, before opening a new page. Every step is sent as the
+``POST /_dash-update-component`` requests the Dash renderer would make,
+built from ``/_dash-dependencies``: callbacks triggered together run
+concurrently, and callbacks triggered by a response (a reset updating
+every dropdown) follow it.
+
+Each configuration reports throughput, p50/p95/p99 latency and errors per
+callback, and the peak memory of every gunicorn worker. The whole run is
+written as JSON, so results can be compared across releases:
+
+    python -m benchmarks.loadtest                                    # 1x1 and 2x4, 10 users, 30 s each
+    python -m benchmarks.loadtest --configs 1x1 2x1 4x1 2x4 --users 50 --rows 1000000
+    python -m benchmarks.loadtest --env HEALTH_DASH_HTTP_CACHE_MB=64 --output cache-on.json
+    python -m benchmarks.loadtest --compare before.json after.json
+
+Latencies are measured on the client, so they include queueing in
+gunicorn; run the load generator on an otherwise idle machine.
+"""
+import argparse
+import concurrent.futures
+import gzip
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.bench_suite import ROOT, dataset_dir
+from src.memory import process_memory
+
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', '.loadtest')
+UPDATE_ROUTE = '/_dash-update-component'
+
+DEFAULT_CONFIGS = ['1x1', '2x4']
+DEFAULT_USERS = 10
+DEFAULT_DURATION = 30
+DEFAULT_THINK_MS = 1000
+READY_TIMEOUT = 300
+REQUEST_TIMEOUT = 60
+# Concurrent requests per user, like a browser's connections per host
+BROWSER_CONNECTIONS = 6
+
+# What a user does next, with relative weights; a session is a page load and then this many actions
+ACTIONS = {'filter': 6, 'outcome': 2, 'behavior': 1, 'reset': 1}
+SESSION_ACTIONS = (5, 15)
+FILTER_IDS = ['province-filter', 'age-filter', 'gender-filter', 'income-filter', 'immigrant-filter',
+              'aboriginal-filter']
+
+
+def parse_config(text):
+    """``(workers, threads)`` of a ``WORKERSxTHREADS`` string such as ``2x4``"""
+    workers, _, threads = text.lower().partition('x')
+    try:
+        return int(workers), int(threads or 1)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected WORKERSxTHREADS (e.g. 2x4), got {text!r}")
+
+
+def percentile(values, q):
+    """Nearest-rank ``q``-th percentile of ``values`` (None when empty)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))]
+
+
+class Client:
+    """Plain HTTP/1.1 to the server under test; one connection per request"""
+
+    def __init__(self, port, host='127.0.0.1'):
+        self.host = host
+        self.port = port
+
+    def request(self, method, path, body=None):
+        """``(status, decoded body, ms)``; status 0 when the request failed outright"""
+        start = time.perf_counter()
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=REQUEST_TIMEOUT)
+        try:
+            connection.request(method, path, body=None if body is None else json.dumps(body),
+                               headers={'Content-Type': 'application/json', 'Accept-Encoding': 'gzip'})
+            response = connection.getresponse()
+            data = response.read()
+            if response.getheader('Content-Encoding') == 'gzip':
+                data = gzip.decompress(data)
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            status, data = 0, b''
+        finally:
+            connection.close()
+        return status, data, (time.perf_counter() - start) * 1000
+
+
+class Recorder:
+    """Every request of a run: ``(name, status, ms)``, plus action and session counts"""
+
+    def __init__(self):
+        self.requests = []
+        self.actions = {}
+        self.sessions = 0
+        self._lock = threading.Lock()
+
+    def record(self, name, status, ms):
+        with self._lock:
+            self.requests.append((name, status, ms))
+
+    def count(self, action):
+        with self._lock:
+            if action == 'page_load':
+                self.sessions += 1
+            self.actions[action] = self.actions.get(action, 0) + 1
+
+
+def _is_error(status):
+    return status == 0 or status >= 400
+
+
+def summarize(recorder, elapsed):
+    """Throughput, error rate and latency percentiles per callback"""
+    by_name = {}
+    for name, status, ms in recorder.requests:
+        by_name.setdefault(name, []).append((status, ms))
+
+    callbacks = {}
+    for name, calls in sorted(by_name.items()):
+        latencies = [ms for status, ms in calls if not _is_error(status)]
+        errors = sum(_is_error(status) for status, _ in calls)
+        callbacks[name] = {
+            'requests': len(calls),
+            'errors': errors,
+            'error_rate': round(errors / len(calls), 4),
+            # PreventUpdate: the callback ran but changed nothing
+            'no_update': sum(status == 204 for status, _ in calls),
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'mean_ms': round(sum(latencies) / len(latencies), 3) if latencies else None,
+            'max_ms': max(latencies) if latencies else None,
+        }
+        for key in ('p50_ms', 'p95_ms', 'p99_ms', 'max_ms'):
+            if callbacks[name][key] is not None:
+                callbacks[name][key] = round(callbacks[name][key], 3)
+
+    total = len(recorder.requests)
+    errors = sum(_is_error(status) for _, status, _ in recorder.requests)
+    return {
+        'elapsed_s': round(elapsed, 3),
+        'requests': total,
+        'errors': errors,
+        'error_rate': round(errors / total, 4) if total else 0.0,
+        'throughput_rps': round(total / elapsed, 3) if elapsed else 0.0,
+        'sessions': recorder.sessions,
+        'actions': dict(sorted(recorder.actions.items())),
+        'callbacks': callbacks,
+    }
+
+
+def _layout_values(node, values, ids):
+    """Collect ``(id, property) -> value`` of every component with an id in a ``/_dash-layout`` tree"""
+    if isinstance(node, list):
+        for child in node:
+            _layout_values(child, values, ids)
+    elif isinstance(node, dict) and 'props' in node:
+        props = node['props']
+        component_id = props.get('id')
+        if isinstance(component_id, str):
+            ids.add(component_id)
+            for prop, value in props.items():
+                if prop not in ('id', 'children'):
+                    values[(component_id, prop)] = value
+        _layout_values(props.get('children'), values, ids)
+
+
+def _outputs(dependency):
+    """``[(id, property)]`` of a dependency's ``output`` (``"a.b"``, or ``"..a.b...c.d.."`` for several)"""
+    output = dependency['output']
+    parts = output[2:-2].split('...') if output.startswith('..') else [output]
+    return [tuple(part.rsplit('.', 1)) for part in parts]
+
+
+class App:
+    """Server-side callbacks of the app under test, from ``/_dash-dependencies``"""
+
+    def __init__(self, dependencies):
+        # Clientside callbacks run in the browser and never reach the server
+        self.dependencies = [d for d in dependencies if not d.get('clientside_function')]
+        self.outputs = [_outputs(d) for d in self.dependencies]
+        self.inputs = [{(i['id'], i['property']) for i in d['inputs']} for d in self.dependencies]
+
+    def name(self, index):
+        """Report name of a callback: its output, or its first output and how many more"""
+        outputs = self.outputs[index]
+        first = '.'.join(outputs[0])
+        return first if len(outputs) == 1 else f'{first}+{len(outputs) - 1}'
+
+    def triggered_by(self, changed):
+        """``{callback index: its inputs among changed}`` of the callbacks ``changed`` props fire"""
+        triggers = {}
+        for index, inputs in enumerate(self.inputs):
+            hit = inputs & changed
+            if hit:
+                triggers[index] = hit
+        return triggers
+
+
+class Session:
+    """One simulated browser tab: component values, and the callback requests the renderer would send"""
+
+    def __init__(self, app, client, recorder, pool):
+        self.app = app
+        self.client = client
+        self.recorder = recorder
+        self.pool = pool
+        self.values = {}
+        self.ids = set()
+
+    def open(self):
+        """Load the page: the layout, then every initial callback (and what they trigger)"""
+        self.recorder.count('page_load')
+        status, data, ms = self.client.request('GET', '/_dash-layout')
+        self.recorder.record('_dash-layout', status, ms)
+        if status != 200:
+            return False
+        self.values, self.ids = {}, set()
+        _layout_values(json.loads(data), self.values, self.ids)
+        self.run({
+            index: set()
+            for index, dependency in enumerate(self.app.dependencies)
+            if not dependency.get('prevent_initial_call') and all(i['id'] in self.ids for i in dependency['inputs'])
+        })
+        return True
+
+    def _choose(self, component_id, rng):
+        """A dropdown value other than the current one (None when there is no other)"""
+        current = self.values.get((component_id, 'value'))
+        options = [o['value'] if isinstance(o, dict) else o for o in self.values.get((component_id, 'options')) or []]
+        others = [value for value in options if value != current]
+        return rng.choice(others) if others else None
+
+    def act(self, rng):
+        """One user action; returns its name"""
+        action = rng.choices(list(ACTIONS), weights=list(ACTIONS.values()))[0]
+        if action == 'reset':
+            prop = ('reset-button', 'n_clicks')
+            value = (self.values.get(prop) or 0) + 1
+        else:
+            component_id = {'filter': rng.choice(FILTER_IDS), 'outcome': 'outcome-var',
+                            'behavior': 'behavior-var'}[action]
+            prop = (component_id, 'value')
+            value = self._choose(component_id, rng)
+            if value is None:
+                return None
+        self.recorder.count(action)
+        self.values[prop] = value
+        self.run(self.app.triggered_by({prop}))
+        return action
+
+    def _call(self, index, triggered):
+        """Send one callback request; returns the props it updated"""
+        dependency = self.app.dependencies[index]
+        outputs = [{'id': i, 'property': p} for i, p in self.app.outputs[index]]
+        body = {
+            'output': dependency['output'],
+            'outputs': outputs if dependency['output'].startswith('..') else outputs[0],
+            'inputs': [dict(i, value=self.values.get((i['id'], i['property']))) for i in dependency['inputs']],
+            'changedPropIds': sorted(f'{i}.{p}' for i, p in triggered),
+        }
+        if dependency.get('state'):
+            body['state'] = [dict(s, value=self.values.get((s['id'], s['property']))) for s in dependency['state']]
+
+        status, data, ms = self.client.request('POST', UPDATE_ROUTE, body)
+        self.recorder.record(self.app.name(index), status, ms)
+        if status != 200:
+            return {}
+        response = json.loads(data).get('response', {})
+        return {(component_id, prop): value for component_id, props in response.items() for prop, value in props.items()}
+
+    def run(self, triggers):
+        """Send ``triggers`` (``{callback index: changed inputs}``) wave by wave, like the renderer.
+
+        A callback whose inputs another triggered callback is about to set waits for it; the
+        props each wave updates trigger the next.
+        """
+        while triggers:
+            produced = {output for index in triggers for output in self.app.outputs[index]}
+            ready = {index: changed for index, changed in triggers.items()
+                     if not self.app.inputs[index] & (produced - set(self.app.outputs[index]))}
+            ready = ready or triggers
+            waiting = {index: changed for index, changed in triggers.items() if index not in ready}
+
+            updated = {}
+            for result in self.pool.map(lambda item: self._call(*item), ready.items()):
+                updated.update(result)
+            self.values.update(updated)
+
+            triggers = waiting
+            for index, changed in self.app.triggered_by(set(updated)).items():
+                triggers.setdefault(index, set()).update(changed)
+
+
+def simulate_user(app, client, recorder, deadline, think_ms, seed):
+    """Browse until ``deadline``: page loads, each followed by a few actions with think time between"""
+    rng = random.Random(seed)
+    # Users arrive spread over one think time rather than all at once
+    time.sleep(rng.uniform(0, think_ms / 1000))
+    with concurrent.futures.ThreadPoolExecutor(BROWSER_CONNECTIONS) as pool:
+        while time.monotonic() < deadline:
+            session = Session(app, client, recorder, pool)
+            if not session.open():
+                time.sleep(think_ms / 1000)
+                continue
+            for _ in range(rng.randint(*SESSION_ACTIONS)):
+                time.sleep(rng.expovariate(1000 / think_ms) if think_ms > 0 else 0)
+                if time.monotonic() >= deadline:
+                    break
+                session.act(rng)
+
+
+def _children(pid):
+    """Pids of the live child processes of ``pid`` (empty where /proc is unavailable)"""
+    children = []
+    try:
+        entries = os.listdir('/proc')
+    except OSError:
+        return children
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as fh:
+                # The parent pid follows the state, after the parenthesised command name
+                fields = fh.read().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(entry))
+    return children
+
+
+class MemoryMonitor:
+    """Samples the memory of the gunicorn master and its workers, keeping each process's peak"""
+
+    FIELDS = ('rss', 'pss', 'shared', 'private')
+
+    def __init__(self, master_pid, interval=1.0):
+        self.master_pid = master_pid
+        self.interval = interval
+        self.peaks = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='loadtest-memory', daemon=True)
+
+    def sample(self):
+        for pid in [self.master_pid] + _children(self.master_pid):
+            report = process_memory(pid)
+            peak = self.peaks.setdefault(pid, {'role': 'master' if pid == self.master_pid else 'worker'})
+            for field in self.FIELDS:
+                if field in report:
+                    peak[field] = max(peak.get(field, 0), report[field])
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+    def report(self):
+        """Peak MiB per process, workers as a list"""
+        mib = {pid: {k: round(v / (1024 * 1024), 1) if k in self.FIELDS else v for k, v in peak.items()}
+               for pid, peak in self.peaks.items()}
+        return {
+            'master': mib.get(self.master_pid, {}),
+            'workers': [dict(peak, pid=pid) for pid, peak in sorted(mib.items()) if pid != self.master_pid],
+        }
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def server_env(data_dir, extra):
+    """Environment of the server under test: the caller's, minus its HEALTH_DASH_* switches, plus ``extra``"""
+    env = {k: v for k, v in os.environ.items() if not k.startswith('HEALTH_DASH_')}
+    env.update(extra, HEALTH_DASH_DATA_DIR=data_dir, PYTHONPATH=ROOT)
+    return env
+
+
+def wait_ready(client, process, workers, timeout=READY_TIMEOUT):
+    """Block until every worker answers with the data loaded; raises if the server dies or times out"""
+    deadline = time.monotonic() + timeout
+    seen = set()
+    with concurrent.futures.ThreadPoolExecutor(2 * workers) as pool:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"gunicorn exited with status {process.returncode}")
+            # Workers only accept connections once the app (and its data) is loaded; /readyz covers FAST_BOOT
+            for status, data, _ in pool.map(lambda _: client.request('GET', '/memory'), range(2 * workers)):
+                if status == 200:
+                    seen.add(json.loads(data)['pid'])
+            if len(seen) >= workers and client.request('GET', '/readyz')[0] == 200:
+                return
+            time.sleep(0.5)
+    raise TimeoutError(f"{len(seen)} of {workers} workers ready after {timeout} s")
+
+
+def run_config(workers, threads, args, env):
+    """Boot gunicorn with this configuration, run the users against it and return its summary"""
+    port = _free_port()
+    command = [sys.executable, '-m', 'gunicorn', 'src.app:server', '--bind', f'127.0.0.1:{port}',
+               '--workers', str(workers), '--threads', str(threads)]
+    client = Client(port)
+    with tempfile.TemporaryFile(mode='w+') as log:
+        process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            try:
+                wait_ready(client, process, workers)
+            except (RuntimeError, TimeoutError):
+                log.seek(0)
+                sys.stderr.write(log.read()[-4000:])
+                raise
+
+            status, data, _ = client.request('GET', '/_dash-dependencies')
+            if status != 200:
+                raise RuntimeError(f"/_dash-dependencies answered {status}")
+            app = App(json.loads(data))
+            recorder = Recorder()
+
+            with MemoryMonitor(process.pid) as memory:
+                start = time.monotonic()
+                deadline = start + args.duration
+                users = [
+                    threading.Thread(target=simulate_user, name=f'loadtest-user-{i}',
+                                     args=(app, client, recorder, deadline, args.think_ms, args.seed * 100_003 + i))
+                    for i in range(args.users)
+                ]
+                for user in users:
+                    user.start()
+                for user in users:
+                    user.join()
+                elapsed = time.monotonic() - start
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+    return dict(summarize(recorder, elapsed), workers=workers, threads=threads, memory=memory.report())
+
+
+def print_summary(result):
+    print(f"\n{result['workers']} worker(s) x {result['threads']} thread(s): {result['requests']:,} requests "
+          f"in {result['elapsed_s']:.1f} s ({result['throughput_rps']:.1f} req/s), {result['sessions']:,} page loads, "
+          f"{result['errors']:,} errors ({result['error_rate']:.2%})")
+    print(f"{'callback':<34} {'requests':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for name, stats in result['callbacks'].items():
+        cells = [f"{stats[key]:>9.1f}" if stats[key] is not None else f"{'-':>9}" for key in ('p50_ms', 'p95_ms', 'p99_ms')]
+        print(f"{name:<34} {stats['requests']:>9,} {' '.join(cells)} {stats['errors']:>7,}")
+    for worker in result['memory']['workers']:
+        print(f"worker {worker['pid']}: peak " + ' '.join(
+            f"{field}={worker[field]:.1f}MiB" for field in MemoryMonitor.FIELDS if field in worker))
+
+
+def compare(before, after):
+    """Print throughput and p95 per callback of two result files side by side"""
+    def by_config(run):
+        return {(r['workers'], r['threads']): r for r in run['results']}
+
+    old, new = by_config(before), by_config(after)
+    for config in sorted(set(old) & set(new)):
+        a, b = old[config], new[config]
+        change = (b['throughput_rps'] / a['throughput_rps'] - 1) if a['throughput_rps'] else 0.0
+        print(f"\n{config[0]}x{config[1]}: {a['throughput_rps']:.1f} -> {b['throughput_rps']:.1f} req/s ({change:+.0%}), "
+              f"errors {a['error_rate']:.2%} -> {b['error_rate']:.2%}")
+        print(f"{'callback':<34} {'p95 ms':>9} {'-> p95 ms':>10} {'p99 ms':>9} {'-> p99 ms':>10}")
+        for name in sorted(set(a['callbacks']) | set(b['callbacks'])):
+            cells = []
+            for key in ('p95_ms', 'p99_ms'):
+                for stats, width in ((a['callbacks'].get(name), 9), (b['callbacks'].get(name), 10)):
+                    value = (stats or {}).get(key)
+                    cells.append(f"{value:>{width}.1f}" if value is not None else f"{'-':>{width}}")
+            print(f"{name:<34} {' '.join(cells)}")
+    for config in sorted(set(old) ^ set(new)):
+        print(f"\n{config[0]}x{config[1]}: only in {'the first' if config in old else 'the second'} file")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--configs', type=parse_config, nargs='+', default=[parse_config(c) for c in DEFAULT_CONFIGS],
+                        metavar='WORKERSxTHREADS', help=f"gunicorn configurations (default {' '.join(DEFAULT_CONFIGS)})")
+    parser.add_argument('--users', type=int, default=DEFAULT_USERS, help='concurrent simulated users')
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION, help='seconds of load per configuration')
+    parser.add_argument('--think-ms', type=float, default=DEFAULT_THINK_MS,
+                        help='mean pause between a user\'s actions (exponential; 0 = none)')
+    parser.add_argument('--rows', type=int, default=100_000, help='rows of the synthetic dataset')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE',
+                        help='HEALTH_DASH_* setting for the server under test (repeatable)')
+    parser.add_argument('--output', help='result file (default benchmarks/.loadtest/<time>.json)')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two result files and exit')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as a, open(args.compare[1]) as b:
+            compare(json.load(a), json.load(b))
+        return 0
+
+    extra = dict(item.split('=', 1) for item in args.env)
+    env = server_env(dataset_dir(args.rows, args.seed), extra)
+    # Build the data cache and cube once up front, so workers boot from them instead of racing to write them
+    subprocess.run([sys.executable, '-c', 'import src.app'], cwd=ROOT, env=env, check=True)
+
+    results = []
+    for workers, threads in args.configs:
+        print(f"Running {args.users} users against {workers} worker(s) x {threads} thread(s) "
+              f"for {args.duration:g} s ...", flush=True)
+        result = run_config(workers, threads, args, env)
+        print_summary(result)
+        results.append(result)
+
+    run = {
+        'machine': f"{platform.machine()} {platform.system()} Python {platform.python_version()}",
+        'cpus': os.cpu_count(),
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'settings': {'users': args.users, 'duration_s': args.duration, 'think_ms': args.think_ms,
+                     'rows': args.rows, 'seed': args.seed, 'env': extra},
+        'results': results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as fh:
+        json.dump(run, fh, indent=2)
+        fh.write('\n')
+    print(f"\nResults written to {output}")
+    return 1 if any(result['errors'] for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,44 @@
+"""Plain pandas versions of the indexed hot paths.
+
+The app answers filter states from the bitmap ``FilterIndex``, the
+aggregate cube and the brush grids. The functions here do the same work
+the straightforward way, chaining boolean masks over the whole frame.
+The benchmarks time the indexed paths against them, and the tests check
+that both give the same rows.
+"""
+import pandas as pd
+
+from src import data_processing
+
+
+def apply_global_filters(
+    df_in: pd.DataFrame,
+    province: str,
+    age_group: str,
+    gender: str,
+    income: str,
+    immigrant: str,
+    aboriginal: str,
+) -> pd.DataFrame:
+    """Rows of ``df_in`` matching the sidebar filters; "All", empty values and unknown age buckets filter nothing"""
+    filtered_df = df_in.copy()
+
+    if province and province != 'All':
+        filtered_df = filtered_df[filtered_df['Province'] == province]
+
+    if age_group and age_group in data_processing.AGE_GROUPS:
+        filtered_df = filtered_df[data_processing.age_group_mask(filtered_df['Age'], age_group)]
+
+    if gender and gender != 'All':
+        filtered_df = filtered_df[filtered_df['Gender'] == gender]
+
+    if income and income != 'All':
+        filtered_df = filtered_df[filtered_df['Total_income'] == income]
+
+    if immigrant and immigrant != 'All':
+        filtered_df = filtered_df[filtered_df['Immigrant'] == immigrant]
+
+    if aboriginal and aboriginal != 'All':
+        filtered_df = filtered_df[filtered_df['Aboriginal_identity'] == aboriginal]
+
+    return filtered_df
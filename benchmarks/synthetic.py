@@ -0,0 +1,165 @@
+"""Synthetic CCHS-shaped survey data for the benchmarks.
+
+Columns come from ``data/raw/Data_dictionary.txt`` in file order. Coded
+columns draw from the keys of their ``data_processing`` map plus a small
+share of CCHS non-response codes (which decode to missing); the remaining
+columns get plausible ordinal codes or measurements. Rows are generated
+in fixed-size chunks from per-chunk seeds, so any size from 100k to 10M+
+rows is reproducible and written without holding it all in memory.
+
+    python -m benchmarks.synthetic --rows 1000000 --out /tmp/bench/raw/health_dataset.csv
+"""
+import argparse
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from src import data_processing
+
+DICTIONARY_PATH = os.path.join(os.path.dirname(data_processing.__file__), '..', 'data', 'raw', 'Data_dictionary.txt')
+
+CHUNK_ROWS = 500_000
+
+# Don't know / refusal / not stated
+NON_RESPONSE_CODES = (7, 8, 9)
+NON_RESPONSE_RATE = 0.02
+# decode_raw drops rows missing these, so keep their non-response rare
+REQUIRED_NON_RESPONSE_RATE = 0.005
+
+# Rough share of the Canadian population by province code
+PROVINCE_WEIGHTS = {
+    10: 1.4, 11: 0.4, 12: 2.7, 13: 2.1, 24: 22.0, 35: 39.0, 46: 3.6,
+    47: 3.0, 48: 11.6, 59: 13.6, 60: 0.1, 61: 0.1, 62: 0.1,
+}
+
+# Share of each code for maps whose first answer dominates (e.g. 'Food secure', 'No')
+SKEWED_WEIGHTS = {
+    'Immigrant': {1: 0.25, 2: 0.75},
+    'Aboriginal_identity': {1: 0.05, 2: 0.95},
+    'Food_security': {1: 0.85, 2: 0.10, 3: 0.05},
+}
+YES_SHARE = 0.15
+
+# Number of answer codes of the ordinal columns the app does not decode
+ORDINAL_LEVELS = {
+    'Health_region_grouped': 10,
+    'Marital_status': 6,
+    'Household': 6,
+    'Worked_job_business': 2,
+    'Edu_level': 4,
+    'Life_satisfaction': 11,
+    'Weight_state': 4,
+    'Pain_status': 4,
+    'Act_improve_health': 2,
+    'Smoked': 3,
+    'Tobacco_use': 4,
+    'Weekly_alcohol': 6,
+    'Cannabis_use': 2,
+    'Drug_use': 2,
+    'Total_active_time': 5,
+    'Working_status': 5,
+    'Birth_country': 2,
+    'Insurance_cover': 2,
+    'Income_source': 5,
+}
+
+
+def dictionary_columns(path=DICTIONARY_PATH):
+    """Column names listed in the data dictionary table, in order"""
+    columns = []
+    with open(path, encoding='utf-8') as fh:
+        for line in fh:
+            match = re.match(r'\|\s*([A-Za-z][A-Za-z0-9_]*)\s*\|', line)
+            if match and match.group(1) != 'Column':
+                columns.append(match.group(1))
+    return columns
+
+
+def _codes(rng, n, weights, non_response_rate=NON_RESPONSE_RATE):
+    """Draw codes by ``{code: weight}``, with some replaced by non-response codes"""
+    keys = np.array(list(weights))
+    p = np.array(list(weights.values()), dtype=float)
+    values = rng.choice(keys, n, p=p / p.sum())
+    missing = rng.random(n) < non_response_rate
+    values[missing] = rng.choice(NON_RESPONSE_CODES, int(missing.sum()))
+    return values
+
+
+def _column(name, rng, n, start, age):
+    """Raw values of one column for a chunk of ``n`` rows"""
+    if name == 'ADM_RNO1':
+        return np.arange(start, start + n)
+    if name == 'Age':
+        return age
+    if name == 'Province':
+        return _codes(rng, n, PROVINCE_WEIGHTS, REQUIRED_NON_RESPONSE_RATE)
+    if name in SKEWED_WEIGHTS:
+        return _codes(rng, n, SKEWED_WEIGHTS[name])
+    if name in data_processing.YES_NO_FIELDS:
+        return _codes(rng, n, {1: YES_SHARE, 2: 1 - YES_SHARE})
+    if name in data_processing.CODE_MAPS:
+        required = name in ('Gender', 'Gen_health_state')
+        weights = {code: 1.0 for code in data_processing.CODE_MAPS[name]}
+        return _codes(rng, n, weights, REQUIRED_NON_RESPONSE_RATE if required else NON_RESPONSE_RATE)
+
+    if name == 'Health_utility_index':
+        # HUI3 runs from -0.36 (worse than death) to 1 (perfect health), mostly near the top
+        return np.round(1.36 * rng.beta(6, 1.2, n) - 0.36, 3)
+    if name == 'BMI_12_17':
+        return np.where(age < 18, np.round(np.clip(rng.normal(21, 3.5, n), 12, 45), 1), np.nan)
+    if name == 'BMI_18_above':
+        return np.where(age >= 18, np.round(np.clip(rng.normal(27, 5, n), 14, 60), 1), np.nan)
+    if name == 'Fruit_veg_con':
+        return np.round(rng.gamma(3, 1.5, n), 1)
+    if name == 'Total_physical_act_time':
+        return np.round(rng.gamma(1.6, 180, n))
+    if name in ('Physical_vigorous_act_time', 'Other_physical_act_time'):
+        return np.round(rng.gamma(1, 60, n))
+    if name == 'Work_hours':
+        return np.where(rng.random(n) < 0.35, 0, np.clip(np.round(rng.normal(38, 10, n)), 1, 90)).astype(np.int64)
+
+    return _codes(rng, n, {code: 1.0 for code in range(1, ORDINAL_LEVELS.get(name, 5) + 1)})
+
+
+def generate_chunk(n_rows, seed=0, chunk=0, columns=None):
+    """Raw-coded frame for rows ``chunk * CHUNK_ROWS`` onwards, as ``health_dataset.csv`` stores them"""
+    columns = columns or dictionary_columns()
+    rng = np.random.default_rng([seed, chunk])
+    age = rng.integers(12, 81, n_rows)
+    start = chunk * CHUNK_ROWS
+    return pd.DataFrame({name: _column(name, rng, n_rows, start, age) for name in columns})
+
+
+def iter_chunks(n_rows, seed=0):
+    """``generate_chunk`` frames adding up to ``n_rows`` rows"""
+    columns = dictionary_columns()
+    for chunk, start in enumerate(range(0, n_rows, CHUNK_ROWS)):
+        yield generate_chunk(min(CHUNK_ROWS, n_rows - start), seed, chunk, columns)
+
+
+def generate(n_rows, seed=0):
+    """Whole raw-coded frame of ``n_rows`` rows"""
+    return pd.concat(iter_chunks(n_rows, seed), ignore_index=True)
+
+
+def write_csv(path, n_rows, seed=0):
+    """Write a raw CSV of ``n_rows`` rows chunk by chunk; returns ``path``"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    for i, frame in enumerate(iter_chunks(n_rows, seed)):
+        frame.to_csv(tmp_path, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', required=True, help='CSV path, e.g. <data dir>/raw/health_dataset.csv')
+    args = parser.parse_args()
+
+    write_csv(args.out, args.rows, args.seed)
+    print(f"Wrote {args.rows:,} rows to {args.out}")
@@ -0,0 +1,32 @@
+"""Gunicorn settings, picked up automatically by ``gunicorn src.app:server`` from the repo root.
+
+With HEALTH_DASH_SHARED_DATA=1 the app is loaded once in the master and
+workers are forked from it, so the memory-mapped data, the filter index
+and the aggregate cube are shared instead of loaded per worker.
+"""
+import gc
+import os
+
+from src.memory import format_memory, process_memory
+
+preload_app = os.environ.get("HEALTH_DASH_SHARED_DATA", "0") == "1"
+
+
+def when_ready(server):
+    if preload_app:
+        # Move everything loaded so far out of the collector's reach: a collection in
+        # a worker would otherwise write to every object header and un-share the pages
+        gc.freeze()
+    server.log.info("master memory: %s", format_memory(process_memory()))
+
+
+def post_fork(server, worker):
+    workers = int(os.environ.get("HEALTH_DASH_BOOTSTRAP_WORKERS", "0"))
+    if preload_app and workers > 1:
+        # The preloaded app leaves the bootstrap pool to each worker: fork it before the worker starts its threads
+        from src import uncertainty
+        uncertainty.start_pool(workers)
+
+
+def post_worker_init(worker):
+    worker.log.info("worker memory: %s", format_memory(process_memory()))
@@ -1,28 +1,250 @@
-from dash import Dash, html, dcc, Input, Output
+import os
+import threading
+import time
+import uuid
+
+from dash import Dash, html, dcc, Input, Output, State, ctx, no_update
+from dash.exceptions import MissingCallbackContextException, PreventUpdate
+from flask import g, jsonify, request
+import numpy as np
 import pandas as pd
 import dash_vega_components as dvc
 # Import local modules (works both as script and module)
 try:
-    from .plots import behavior_outcome_scatter
-    from . import data_processing
+    from . import (coalesce, data_processing, density, export, http_cache, metrics, prefetch, prerender, sampling,
+                   spec_templates, uncertainty)
+    from .filter_index import FilterIndex, normalize_filters
+    from .cube import AggregateCube
+    from .result_cache import DiskBackend, ResultCache
+    from .clientside import ClientsideData
+    from .memory import process_memory
+    from .partitions import PartitionedTable
+    from .spatial_index import BrushIndex
 except ImportError:
-    from plots import behavior_outcome_scatter
+    import coalesce
     import data_processing
+    import density
+    import export
+    import http_cache
+    import metrics
+    import prefetch
+    import prerender
+    import sampling
+    import spec_templates
+    import uncertainty
+    from filter_index import FilterIndex, normalize_filters
+    from cube import AggregateCube
+    from result_cache import DiskBackend, ResultCache
+    from clientside import ClientsideData
+    from memory import process_memory
+    from partitions import PartitionedTable
+    from spatial_index import BrushIndex
 
 app = Dash(__name__)
 server = app.server
 
-# Load data
-try:
-    df = data_processing.load_data()
-    filter_options = data_processing.get_filter_options(df)
-    data_status = f"✅ Data loaded successfully! {len(df):,} records from {len(df.columns)} variables"
-    data_loaded = True
-except Exception as e:
-    data_status = f"❌ Data loading failed: {str(e)}"
-    filter_options = {}
-    data_loaded = False
-    df = pd.DataFrame()
+# Set HEALTH_DASH_COMPACT=1 to keep coded columns as categoricals (much smaller per worker)
+COMPACT_MODE = os.environ.get("HEALTH_DASH_COMPACT", "0") == "1"
+
+# HEALTH_DASH_SHARED_DATA=1 memory-maps the read-only data cache so all gunicorn workers share one copy (implies compact)
+SHARED_DATA = os.environ.get("HEALTH_DASH_SHARED_DATA", "0") == "1"
+
+# In-process result cache size; HEALTH_DASH_SHARED_RESULTS=1 also shares results on disk between workers
+RESULT_CACHE_MB = int(os.environ.get("HEALTH_DASH_RESULT_CACHE_MB", "64"))
+SHARED_RESULTS = os.environ.get("HEALTH_DASH_SHARED_RESULTS", "0") == "1"
+
+# HEALTH_DASH_CHART2_MODE=density bins every matching respondent server-side instead of sampling 5,000 points
+CHART2_MODE = os.environ.get("HEALTH_DASH_CHART2_MODE", "sample")
+
+# HEALTH_DASH_CLIENTSIDE=1 ships the survey to the browser once and filters/aggregates there
+CLIENTSIDE_MODE = os.environ.get("HEALTH_DASH_CLIENTSIDE", "0") == "1"
+
+# HEALTH_DASH_PARTITIONS=<dir> loads a Province-partitioned table (python -m src.ingest --partition-by Province);
+# with HEALTH_DASH_PROVINCE=<name> only that province's partitions are ever read
+PARTITIONS_PATH = os.environ.get("HEALTH_DASH_PARTITIONS")
+PROVINCE = os.environ.get("HEALTH_DASH_PROVINCE")
+
+# Bootstrap replicates behind the 95% intervals in the Chart 1 / Chart 3 tooltips (0 turns them off; every interval
+# uses exactly this many, so it does not depend on load) and the process-pool size (0 computes inline)
+BOOTSTRAP_REPLICATES = int(os.environ.get("HEALTH_DASH_BOOTSTRAP_REPLICATES", str(uncertainty.DEFAULT_REPLICATES)))
+BOOTSTRAP_WORKERS = int(os.environ.get("HEALTH_DASH_BOOTSTRAP_WORKERS", "0"))
+
+# HEALTH_DASH_PREFETCH=<n> precomputes up to n states one dropdown away from each Chart 1 request (0 turns it off),
+# on HEALTH_DASH_PREFETCH_WORKERS background threads that only run while no request is in flight
+PREFETCH = int(os.environ.get("HEALTH_DASH_PREFETCH", "0"))
+PREFETCH_WORKERS = int(os.environ.get("HEALTH_DASH_PREFETCH_WORKERS", str(prefetch.DEFAULT_WORKERS)))
+
+# HEALTH_DASH_HTTP_CACHE_MB=<n> keeps up to n MB of compressed chart responses and answers repeats from them,
+# with ETag / Cache-Control headers (0 turns it off)
+HTTP_CACHE_MB = int(os.environ.get("HEALTH_DASH_HTTP_CACHE_MB", "0"))
+
+# Identical chart requests in flight share one computation, and requests a newer state from the same tab has
+# superseded are dropped (HEALTH_DASH_COALESCE=0 turns this off)
+COALESCE = os.environ.get("HEALTH_DASH_COALESCE", "1") == "1"
+
+# HEALTH_DASH_FAST_BOOT=1 serves the layout, /healthz and /readyz at once and loads the data in a background
+# thread; charts show a warming-up message until it is ready (ignored with SHARED_DATA or CLIENTSIDE, which need
+# the data at import)
+FAST_BOOT = os.environ.get("HEALTH_DASH_FAST_BOOT", "0") == "1" and not SHARED_DATA and not CLIENTSIDE_MODE
+
+# Shift-dragging a rectangle on Chart 2 filters Charts 1 and 3 to the respondents inside it
+# (served from a grid index, see spatial_index.py); not available in clientside mode
+BRUSHING = not CLIENTSIDE_MODE
+
+# HEALTH_DASH_APPROXIMATE=1 answers Charts 1 and 3 from stratified samples first when the exact answer needs a scan
+# of the rows, using the largest sample that fits HEALTH_DASH_APPROX_BUDGET_MS; the exact result replaces the
+# estimate once it is computed in the background (see sampling.py). Not available in clientside mode
+APPROXIMATE = os.environ.get("HEALTH_DASH_APPROXIMATE", "0") == "1" and not CLIENTSIDE_MODE
+APPROX_BUDGET_MS = float(os.environ.get("HEALTH_DASH_APPROX_BUDGET_MS", "50"))
+# How often a chart showing an estimate asks whether the exact answer is ready
+REFINE_POLL_MS = 500
+
+# HEALTH_DASH_PRERENDERED=<dir> answers chart requests for the states prerendered by `python -m src.prerender <dir>`
+# with the URL of their spec file and renders only the others live; with HEALTH_DASH_PRERENDERED_URL=<base url>
+# browsers fetch the files from a static file server or CDN holding <dir>/specs. Not available in clientside mode
+PRERENDERED_PATH = os.environ.get("HEALTH_DASH_PRERENDERED") if not CLIENTSIDE_MODE else None
+PRERENDERED_URL = os.environ.get("HEALTH_DASH_PRERENDERED_URL")
+
+# Code and settings that shape the exact chart specs, which prerendered manifests and
+# shared results are checked against
+SPEC_VERSION = http_cache.digest(
+    http_cache.code_version(os.path.dirname(os.path.abspath(__file__))),
+    CHART2_MODE, BOOTSTRAP_REPLICATES)
+# ... and the chart responses (estimates in approximate mode), for HTTP cache keys
+RESPONSE_VERSION = http_cache.digest(SPEC_VERSION, APPROXIMATE, APPROX_BUDGET_MS)
+
+# The bootstrap pool forks its processes now, before any thread starts (and before the data loads, so they stay
+# small). A preloaded gunicorn master must not own it: there each worker starts its own in post_fork
+if BOOTSTRAP_WORKERS > 1 and not SHARED_DATA:
+    uncertainty.start_pool(BOOTSTRAP_WORKERS)
+
+
+# Data and everything derived from it; load_state() fills these in and sets data_loaded last
+df = pd.DataFrame()
+filter_index = None
+partition_pruner = None
+brush_index = None
+cube = None
+sample = None
+filter_options = {}
+# Identifies the loaded table in HTTP cache keys
+data_version = None
+data_loaded = False
+data_status = "⏳ Loading data..."
+result_cache = ResultCache(max_bytes=RESULT_CACHE_MB * 1024 * 1024)
+# Seconds spent in each startup stage, reported by /readyz
+startup_timings = {}
+loader = None
+
+
+def boot_filter_options():
+    """Dropdown options from table metadata alone, for the layout served while the data loads."""
+    try:
+        if PARTITIONS_PATH:
+            return PartitionedTable(PARTITIONS_PATH).filter_options(PROVINCE)
+        return data_processing.stored_filter_options(data_processing.cache_dir()) or {}
+    except (OSError, ValueError):
+        return {}
+
+
+def load_state():
+    """Load the data, filter options, index, templates, cube (and samples), then mark the app ready."""
+    global df, filter_index, partition_pruner, brush_index, cube, sample, filter_options, data_version, data_loaded
+    global data_status
+
+    def timed(stage, fn):
+        start = time.perf_counter()
+        result = fn()
+        startup_timings[stage] = round(time.perf_counter() - start, 3)
+        return result
+
+    try:
+        if PARTITIONS_PATH:
+            partitioned = PartitionedTable(PARTITIONS_PATH)
+            frame, pruner = timed("load_data", lambda: partitioned.load(PROVINCE, compact=COMPACT_MODE, mmap=SHARED_DATA))
+            data_dir = partitioned.cache_dir(PROVINCE)
+            options = timed("filter_options", lambda: partitioned.filter_options(PROVINCE))
+            metadata = partitioned.metadata
+        else:
+            frame = timed("load_data", lambda: data_processing.load_data(compact=COMPACT_MODE, mmap=SHARED_DATA))
+            pruner = None
+            data_dir = data_processing.cache_dir()
+            options = timed("filter_options", lambda: data_processing.table_filter_options(frame, data_dir))
+            metadata = data_processing.table_metadata(data_dir)
+        index = timed("filter_index", lambda: FilterIndex(frame))
+        timed("spec_templates", lambda: spec_templates.warm(BRUSHING, bool(BOOTSTRAP_REPLICATES)))
+        aggregates = timed("cube", lambda: AggregateCube.load_or_build(frame, data_dir))
+        samples = timed("samples", lambda: sampling.StratifiedSample(frame).calibrate()) if APPROXIMATE else None
+        grids = BrushIndex(frame)
+        if BRUSHING:
+            # Every behaviour variable's grid, so no brush waits for one and forked workers share them
+            timed("brush_index", grids.build)
+        version = http_cache.digest(
+            {k: v for k, v in metadata.items() if k != "filter_options"}, data_dir, PROVINCE, len(frame))
+        if SHARED_RESULTS and data_dir:
+            # One directory per data, code and settings version: results outlive restarts, not upgrades
+            result_cache.backend = DiskBackend(os.path.join(
+                data_dir, "results-compact" if COMPACT_MODE or SHARED_DATA else "results", f"{version}-{SPEC_VERSION}"))
+
+        df, partition_pruner, filter_index, cube, sample, filter_options = frame, pruner, index, aggregates, samples, options
+        brush_index = grids
+        data_version = version
+        data_status = f"✅ Data loaded successfully! {len(df):,} records from {len(df.columns)} variables"
+        data_loaded = True
+    except Exception as e:
+        data_status = f"❌ Data loading failed: {str(e)}"
+
+
+def warming_up():
+    """True while the background load of FAST_BOOT is still running."""
+    return loader is not None and loader.is_alive()
+
+
+if FAST_BOOT:
+    filter_options = boot_filter_options()
+    loader = threading.Thread(target=load_state, name="health-dash-loader", daemon=True)
+    loader.start()
+else:
+    load_state()
+
+clientside_data = ClientsideData(df) if CLIENTSIDE_MODE and data_loaded else None
+prerendered = prerender.Prerendered(PRERENDERED_PATH, PRERENDERED_URL) if PRERENDERED_PATH else None
+
+
+@server.route("/healthz")
+def healthz():
+    """Liveness: the server answers, whether or not the data is loaded yet."""
+    return jsonify(status="ok")
+
+
+@server.route("/readyz")
+def readyz():
+    """Readiness: 200 once the data is loaded, 503 while loading or after a failed load."""
+    if data_loaded:
+        extra = {"prerendered": prerendered.status(spec_version())} if prerendered is not None else {}
+        return jsonify(status="ready", startup=startup_timings, **extra)
+    if warming_up():
+        return jsonify(status="loading", startup=startup_timings), 503
+    return jsonify(status="failed", detail=data_status), 503
+
+
+@server.route("/memory")
+def memory_report():
+    """Memory of the worker answering the request, to compare workers with and without shared data."""
+    return jsonify(dict(process_memory(), shared_data=SHARED_DATA, compact=COMPACT_MODE or SHARED_DATA))
+
+
+@server.route(export.ROUTE, methods=["POST"])
+def export_aggregates():
+    """Aggregates of a batch of filter states from one grouped pass, streamed as CSV or Arrow (see export.py)."""
+    if not data_loaded:
+        return jsonify(status="loading" if warming_up() else "failed", detail=data_status), 503
+    try:
+        arguments, fmt = export.parse(request.get_json(silent=True), request.accept_mimetypes)
+        batch = export.Batch(df, index=filter_index, **arguments)
+    except export.ExportError as e:
+        return jsonify(error=str(e)), 400
+    return export.response(batch, fmt)
 
 
 def vega_text(message: str, font_size: int = 16):
@@ -37,195 +259,455 @@ def vega_text(message: str, font_size: int = 16):
     }
 
 
-def apply_global_filters(
-    df_in: pd.DataFrame,
-    province: str,
-    age_group: str,
-    gender: str,
-    income: str,
-    immigrant: str,
-    aboriginal: str,
-) -> pd.DataFrame:
-    """Apply the same filter logic used by Chart 1 so Chart 2 is connected to global filters."""
-    filtered_df = df_in.copy()
+def not_ready_spec():
+    """Chart placeholder until the data is usable: warming up under FAST_BOOT, or failed to load."""
+    if warming_up():
+        return vega_text("⏳ Warming up: the survey data is still loading...")
+    return vega_text("Data not loaded")
 
-    if province and province != "All":
-        filtered_df = filtered_df[filtered_df["Province"] == province]
 
-    # NOTE: your Age appears coded (1-5). Keep Age Group = All for now to avoid filtering to zero.
-    if age_group and age_group != "All":
-        if age_group == "12-19":
-            filtered_df = filtered_df[(filtered_df["Age"] >= 12) & (filtered_df["Age"] <= 19)]
-        elif age_group == "20-34":
-            filtered_df = filtered_df[(filtered_df["Age"] >= 20) & (filtered_df["Age"] <= 34)]
-        elif age_group == "35-49":
-            filtered_df = filtered_df[(filtered_df["Age"] >= 35) & (filtered_df["Age"] <= 49)]
-        elif age_group == "50-64":
-            filtered_df = filtered_df[(filtered_df["Age"] >= 50) & (filtered_df["Age"] <= 64)]
-        elif age_group == "65+":
-            filtered_df = filtered_df[filtered_df["Age"] >= 65]
+def normalize_brush(brush):
+    """``(behavior_var, x_low, x_high, y_low, y_high)`` of the brush store, or None when nothing is brushed."""
+    if not brush or brush[0] not in data_processing.BEHAVIOR_VARS:
+        return None
+    return (brush[0],) + tuple(float(value) for value in brush[1:])
 
-    if gender and gender != "All":
-        filtered_df = filtered_df[filtered_df["Gender"] == gender]
 
-    if income and income != "All":
-        filtered_df = filtered_df[filtered_df["Total_income"] == income]
+def brush_key(brush):
+    """Cache-key suffix of a brush: unbrushed states keep their plain keys (and share them with prefetch)."""
+    return () if brush is None else (brush,)
 
-    if immigrant and immigrant != "All":
-        filtered_df = filtered_df[filtered_df["Immigrant"] == immigrant]
 
-    if aboriginal and aboriginal != "All":
-        filtered_df = filtered_df[filtered_df["Aboriginal_identity"] == aboriginal]
+def brush_rows(rows, brush):
+    """Row positions ``rows`` (None = every row) restricted to the respondents inside ``brush``."""
+    inside = brush_index.positions(brush)
+    return inside if rows is None else np.intersect1d(rows, inside, assume_unique=True)
 
-    return filtered_df
 
+@metrics.stage("filter_rows", rows=len)
+def filter_rows(province, age_group, gender, income, immigrant, aboriginal, brush=None, columns=None):
+    """Rows of the loaded frame matching the sidebar state (and brush), resolved through the bitmap and grid indexes.
 
-# App Layout
-app.layout = html.Div([
-    html.H1(
-        "Healthcare Survey Analysis Dashboard",
-        style={"textAlign": "center", "color": "#2c3e50", "padding": "20px", "margin": "0", "backgroundColor": "#ecf0f1"},
-    ),
-
-    html.Div([
-        html.H3("System Status", style={"margin": "10px 0"}),
-        html.P(data_status, style={"fontSize": "14px", "margin": "5px 0"}),
-        html.P("✅ App infrastructure is running!", style={"color": "green", "margin": "5px 0"}),
-    ], style={"padding": "15px", "border": "2px solid #3498db", "margin": "20px", "backgroundColor": "#ecf0f1", "borderRadius": "5px"}),
-
-    html.Div([
-        # LEFT SIDEBAR
-        html.Div([
-            html.H3("Global Controls", style={"textAlign": "center", "color": "#2c3e50", "marginBottom": "20px"}),
+    ``columns`` limits the gather to the columns the caller aggregates.
+    """
+    key = normalize_filters(province, age_group, gender, income, immigrant, aboriginal)
+    brush = normalize_brush(brush)
+    # A province filter on a partitioned table only looks at that province's rows
+    index = partition_pruner if partition_pruner is not None and key[0] != "All" else filter_index
+    rows = result_cache.get_or_compute(("rows",) + key, lambda: index.positions(*key))
+    if brush is not None:
+        rows = result_cache.get_or_compute(("rows",) + key + (brush,), lambda: brush_rows(rows, brush))
+    frame = df if columns is None else df[columns]
+    return frame if rows is None else frame.take(rows)
 
-            html.H4("Filters", style={"color": "#34495e", "marginBottom": "15px", "borderBottom": "2px solid #95a5a6", "paddingBottom": "5px"}),
 
-            html.Div([
-                html.Label("Province", style={"fontWeight": "bold", "fontSize": "13px", "color": "#555"}),
-                dcc.Dropdown(
-                    id="province-filter",
-                    options=[{"label": p, "value": p} for p in filter_options.get("provinces", ["All"])] if data_loaded else [],
-                    value="All",
-                    style={"marginBottom": "15px", "fontSize": "12px"},
-                ),
-            ]),
+@metrics.stage("chart1_data", rows=len)
+def chart1_data(province, age_group, gender, income, immigrant, aboriginal, outcome_var, brush=None):
+    """Respondent counts by outcome x income for the sidebar state (memoized)."""
+    key = normalize_filters(province, age_group, gender, income, immigrant, aboriginal)
+    brush = normalize_brush(brush)
+    return result_cache.get_or_compute(("chart1", outcome_var) + key + brush_key(brush),
+                                       lambda: _chart1_data(*key, outcome_var, brush))
 
-            html.Div([
-                html.Label("Age Group", style={"fontWeight": "bold", "fontSize": "13px", "color": "#555"}),
-                dcc.Dropdown(
-                    id="age-filter",
-                    options=[
-                        {"label": "All", "value": "All"},
-                        {"label": "12-19 (Youth)", "value": "12-19"},
-                        {"label": "20-34 (Young Adult)", "value": "20-34"},
-                        {"label": "35-49 (Adult)", "value": "35-49"},
-                        {"label": "50-64 (Middle Age)", "value": "50-64"},
-                        {"label": "65+ (Senior)", "value": "65+"},
-                    ],
-                    value="All",
-                    style={"marginBottom": "15px", "fontSize": "12px"},
-                ),
-            ]),
 
-            html.Div([
-                html.Label("Gender", style={"fontWeight": "bold", "fontSize": "13px", "color": "#555"}),
-                dcc.Dropdown(
-                    id="gender-filter",
-                    options=[{"label": g, "value": g} for g in filter_options.get("genders", ["All"])] if data_loaded else [],
-                    value="All",
-                    style={"marginBottom": "15px", "fontSize": "12px"},
-                ),
-            ]),
+@metrics.stage("chart3_data", rows=len)
+def chart3_data(province, age_group, gender, income, immigrant, aboriginal, brush=None):
+    """Average mental-health score and respondent count for the sidebar state (memoized)."""
+    key = normalize_filters(province, age_group, gender, income, immigrant, aboriginal)
+    brush = normalize_brush(brush)
+    return result_cache.get_or_compute(("chart3",) + key + brush_key(brush), lambda: _chart3_data(*key, brush))
 
-            html.Div([
-                html.Label("Total Income", style={"fontWeight": "bold", "fontSize": "13px", "color": "#555"}),
-                dcc.Dropdown(
-                    id="income-filter",
-                    options=[{"label": i, "value": i} for i in filter_options.get("incomes", ["All"])] if data_loaded else [],
-                    value="All",
-                    style={"marginBottom": "15px", "fontSize": "12px"},
-                ),
-            ]),
 
-            html.Div([
-                html.Label("Immigrant Status", style={"fontWeight": "bold", "fontSize": "13px", "color": "#555"}),
-                dcc.Dropdown(
-                    id="immigrant-filter",
-                    options=[{"label": i, "value": i} for i in filter_options.get("immigrant", ["All"])] if data_loaded else [],
-                    value="All",
-                    style={"marginBottom": "15px", "fontSize": "12px"},
-                ),
-            ]),
+@metrics.stage("chart1_intervals")
+def chart1_intervals(province, age_group, gender, income, immigrant, aboriginal, outcome_var, brush=None):
+    """Share of each outcome within its income group, with its 95% bootstrap interval (memoized)."""
+    key = normalize_filters(province, age_group, gender, income, immigrant, aboriginal)
+    brush = normalize_brush(brush)
+    return result_cache.get_or_compute(("chart1_ci", outcome_var) + key + brush_key(brush),
+                                       lambda: _chart1_intervals(*key, outcome_var, brush))
 
-            html.Div([
-                html.Label("Aboriginal Identity", style={"fontWeight": "bold", "fontSize": "13px", "color": "#555"}),
-                dcc.Dropdown(
-                    id="aboriginal-filter",
-                    options=[{"label": a, "value": a} for a in filter_options.get("aboriginal", ["All"])] if data_loaded else [],
-                    value="All",
-                    style={"marginBottom": "20px", "fontSize": "12px"},
-                ),
-            ]),
 
-            html.Hr(style={"margin": "20px 0", "border": "1px solid #95a5a6"}),
+@metrics.stage("chart3_intervals")
+def chart3_intervals(province, age_group, gender, income, immigrant, aboriginal, brush=None):
+    """95% bootstrap interval of the average mental-health score per Chart 3 bar (memoized)."""
+    key = normalize_filters(province, age_group, gender, income, immigrant, aboriginal)
+    brush = normalize_brush(brush)
+    return result_cache.get_or_compute(("chart3_ci",) + key + brush_key(brush), lambda: _chart3_intervals(*key, brush))
 
-            html.H4("Variable Toggles", style={"color": "#34495e", "marginBottom": "15px", "borderBottom": "2px solid #95a5a6", "paddingBottom": "5px"}),
 
-            html.Div([
-                html.Label("Outcome Variable", style={"fontWeight": "bold", "fontSize": "13px", "color": "#555"}),
-                dcc.Dropdown(
-                    id="outcome-var",
-                    options=[{"label": v.replace("_", " ").title(), "value": v} for v in filter_options.get("outcome_vars", [])] if data_loaded else [],
-                    value="Gen_health_state",
-                    style={"marginBottom": "15px", "fontSize": "12px"},
-                ),
-            ]),
+# Columns the row-level Chart 3 aggregations read
+CHART3_COLUMNS = ["Food_security", "Mental_health_state", "Immigrant"]
+
+
+def bootstrap_options():
+    return {"replicates": BOOTSTRAP_REPLICATES, "workers": BOOTSTRAP_WORKERS}
+
+
+def interval_label(low, high, fmt):
+    """Tooltip text of an interval, e.g. "2.41 – 2.57"."""
+    return [f"{lo:{fmt}} – {hi:{fmt}}" if pd.notna(lo) else "" for lo, hi in zip(low, high)]
+
+
+def _chart1_intervals(province, age_group, gender, income, immigrant, aboriginal, outcome_var, brush=None):
+    # Groups are income levels, categories the outcome values
+    table = (
+        chart1_data(province, age_group, gender, income, immigrant, aboriginal, outcome_var, brush)
+        .set_index(["Total_income", outcome_var])["count"]
+        .unstack(fill_value=0)
+    )
+    counts = table.to_numpy()
+    low, high, _ = uncertainty.proportion_ci(counts, **bootstrap_options())
+    groups, categories = np.nonzero(counts)
+    cells = pd.DataFrame({
+        "Total_income": table.index[groups],
+        outcome_var: table.columns[categories],
+        "share": (counts / counts.sum(axis=1, keepdims=True))[groups, categories],
+        "share_low": low[groups, categories],
+        "share_high": high[groups, categories],
+    })
+    cells["share_ci"] = interval_label(cells["share_low"], cells["share_high"], ".1%")
+    return cells
+
+
+def _chart3_intervals(province, age_group, gender, income, immigrant, aboriginal, brush=None):
+    # The cube has no behaviour / outcome dimensions, so brushed states go to the rows
+    if cube is not None and cube.has() and brush is None:
+        scores = cube.chart3_scores(province, age_group, gender, income, immigrant, aboriginal)
+    else:
+        filtered_df = filter_rows(province, age_group, gender, income, immigrant, aboriginal, brush, CHART3_COLUMNS)
+        filtered_df = filtered_df.dropna(subset=CHART3_COLUMNS)
+        scores = (
+            filtered_df.groupby(["Food_security", "Immigrant", "Mental_health_state"], observed=True)
+            .size().reset_index(name="count")
+        )
+
+    # Groups are the Chart 3 bars, categories the mental-health states
+    counts = scores.set_index(["Food_security", "Immigrant", "Mental_health_state"])["count"].unstack(fill_value=0)
+    values = [data_processing.MENTAL_HEALTH_SCORES[state] for state in counts.columns]
+    low, high, _ = uncertainty.mean_ci(counts.to_numpy(), values, **bootstrap_options())
+    cells = counts.index.to_frame(index=False).assign(ci_low=low, ci_high=high)
+    cells["ci_label"] = interval_label(low, high, ".2f")
+    return cells
+
+
+def _chart1_data(province, age_group, gender, income, immigrant, aboriginal, outcome_var, brush=None):
+    """Respondent counts by outcome x income, rolled up from the cube when it covers the outcome (and nothing is brushed)."""
+    if cube is not None and cube.has(outcome_var) and brush is None:
+        return cube.chart1(province, age_group, gender, income, immigrant, aboriginal, outcome_var)
+
+    filtered_df = filter_rows(province, age_group, gender, income, immigrant, aboriginal, brush,
+                              [outcome_var, "Total_income"])
+    filtered_df = filtered_df.dropna(subset=[outcome_var, "Total_income"])
+    return filtered_df.groupby([outcome_var, "Total_income"], observed=True).size().reset_index(name="count")
+
+
+def _chart3_data(province, age_group, gender, income, immigrant, aboriginal, brush=None):
+    """Average mental-health score and respondent count by food security x immigrant status."""
+    if cube is not None and cube.has() and brush is None:
+        return cube.chart3(province, age_group, gender, income, immigrant, aboriginal)
+
+    filtered_df = filter_rows(province, age_group, gender, income, immigrant, aboriginal, brush, CHART3_COLUMNS)
+    filtered_df = filtered_df.dropna(subset=CHART3_COLUMNS)
+    filtered_df = filtered_df.assign(
+        Mental_health_score=filtered_df["Mental_health_state"].map(data_processing.MENTAL_HEALTH_SCORES).astype(float)
+    )
+    return (
+        filtered_df
+        .groupby(["Food_security", "Immigrant"], observed=True)
+        .agg(avg_score=("Mental_health_score", "mean"),
+             respondent_count=("Mental_health_state", "size"))
+        .reset_index()
+    )
+
+
+def chart1_steps(key, outcome_var, brush=None):
+    """``(cache key, compute)`` of each aggregate Chart 1 needs for the normalized filters ``key``."""
+    steps = [(("chart1", outcome_var) + key + brush_key(brush), lambda: chart1_data(*key, outcome_var, brush))]
+    if BOOTSTRAP_REPLICATES:
+        # Like the callback, only non-empty charts get intervals
+        steps.append((("chart1_ci", outcome_var) + key + brush_key(brush),
+                      lambda: len(chart1_data(*key, outcome_var, brush)) and chart1_intervals(*key, outcome_var, brush)))
+    return steps
+
+
+def chart3_steps(key, brush=None):
+    """``(cache key, compute)`` of each aggregate Chart 3 needs for the normalized filters ``key``."""
+    steps = [(("chart3",) + key + brush_key(brush), lambda: chart3_data(*key, brush))]
+    if BOOTSTRAP_REPLICATES:
+        steps.append((("chart3_ci",) + key + brush_key(brush),
+                      lambda: len(chart3_data(*key, brush)) and chart3_intervals(*key, brush)))
+    return steps
+
+
+def cached(steps):
+    return all(cache_key in result_cache for cache_key, _ in steps)
+
+
+def prefetch_steps(state):
+    """``(cache key, compute)`` of each chart-ready aggregate for a prefetch state."""
+    key, outcome_var = state[:6], state[6]
+    return chart1_steps(key, outcome_var) + chart3_steps(key)
+
+
+def prefetch_state(state, interrupted):
+    """Compute the aggregates of ``state`` that are not cached yet, stopping between steps for real requests."""
+    for cache_key, compute in prefetch_steps(state):
+        if interrupted():
+            return False
+        if cache_key not in result_cache:
+            compute()
+    return True
+
+
+def prefetch_cached(state):
+    return cached(prefetch_steps(state))
+
+
+def prefetch_choices():
+    """Dropdown values of each prefetch field."""
+    return {
+        "province": filter_options.get("provinces", []),
+        "age_group": ["All"] + list(data_processing.AGE_GROUPS),
+        "gender": filter_options.get("genders", []),
+        "income": filter_options.get("incomes", []),
+        "immigrant": filter_options.get("immigrant", []),
+        "aboriginal": filter_options.get("aboriginal", []),
+        "outcome_var": filter_options.get("outcome_vars", []),
+    }
+
+
+def prefetch_around(state):
+    """Count a request for ``state`` towards the hit rate and queue its one-step neighbours."""
+    prefetcher.observe(state)
+    prefetcher.start()
+    prefetcher.schedule(prefetch.neighbours(state, prefetch_choices(), PREFETCH))
+
+
+prefetcher = prefetch.Prefetcher(prefetch_state, prefetch_cached, workers=PREFETCH_WORKERS) if PREFETCH > 0 else None
+refiner = sampling.Refiner() if APPROXIMATE else None
+
+metrics.register(server, result_cache, prefetcher=prefetcher)
 
+def spec_version():
+    """Version of the exact chart specs for the loaded data, or None while it is not loaded."""
+    return f"{data_version}-{SPEC_VERSION}" if data_loaded else None
+
+
+def response_version():
+    """Version of the chart responses, or None while they must not be cached (data not loaded)."""
+    return f"{data_version}-{RESPONSE_VERSION}" if data_loaded else None
+
+
+# In prerendered mode the chart callbacks fill each chart's source store instead of its spec (see chart_callback)
+CHART_OUTPUTS = [f"{chart}-source.data" if prerendered is not None else f"{chart}.spec" for chart in prerender.CHARTS]
+
+if prefetcher is not None:
+    # Registered before the HTTP cache, so cached answers pause prefetching too; the flag pairs each resume with
+    # its pause even when an earlier hook answers the request
+    @server.before_request
+    def pause_prefetch():
+        if request.path.endswith("/_dash-update-component"):
+            prefetcher.begin_request()
+            g.prefetch_paused = True
+
+    @server.teardown_request
+    def resume_prefetch(exc):
+        if g.pop("prefetch_paused", False):
+            prefetcher.end_request()
+
+
+if HTTP_CACHE_MB > 0:
+    http_cache.register(server, CHART_OUTPUTS, response_version,
+                        max_bytes=HTTP_CACHE_MB * 1024 * 1024, ignore_state=["session-id"],
+                        ignore_inputs=["refine-chart1", "refine-chart3"])
+
+
+# App Layout
+def serve_layout():
+    """Layout for each page load, so a page opened while FAST_BOOT is warming up reloads into the full app."""
+    options_ready = data_loaded or bool(filter_options)
+    return html.Div([
+        html.Div(clientside_data.stores(app) if clientside_data else []),
+        # Polls while FAST_BOOT is loading, then reloads the page (see poll_warmup)
+        dcc.Interval(id="warmup-poll", interval=1000, disabled=not warming_up()),
+        dcc.Store(id="warmup-done"),
+        # Identifies this tab to the chart callbacks, so its superseded requests can be dropped (see coalesce.py)
+        dcc.Store(id="session-id", data=uuid.uuid4().hex),
+        # Chart 2 selections: the brushed rectangle filtering Charts 1 and 3, and the density-mode zoom
+        dcc.Store(id="brush"),
+        dcc.Store(id="chart2-zoom"),
+        # Approximate mode: each enabled while its chart shows an estimate, to fetch the exact answer
+        html.Div([dcc.Interval(id=f"refine-{chart}", interval=REFINE_POLL_MS, disabled=True)
+                  for chart in ("chart1", "chart3")] if refiner is not None else []),
+        # Prerendered mode: the URL of each chart's prerendered spec, or its live spec (see prerender.py)
+        html.Div([dcc.Store(id=f"{chart}-source") for chart in prerender.CHARTS] if prerendered is not None else []),
+
+        html.H1(
+            "Healthcare Survey Analysis Dashboard",
+            style={"textAlign": "center", "color": "#2c3e50", "padding": "20px", "margin": "0", "backgroundColor": "#ecf0f1"},
+        ),
+
+        html.Div([
+            html.H3("System Status", style={"margin": "10px 0"}),
+            html.P(data_status, style={"fontSize": "14px", "margin": "5px 0"}),
+            html.P("✅ App infrastructure is running!", style={"color": "green", "margin": "5px 0"}),
+        ], style={"padding": "15px", "border": "2px solid #3498db", "margin": "20px", "backgroundColor": "#ecf0f1", "borderRadius": "5px"}),
+
+        html.Div([
+            # LEFT SIDEBAR
             html.Div([
-                html.Label("Behavior Variable", style={"fontWeight": "bold", "fontSize": "13px", "color": "#555"}),
-                dcc.Dropdown(
-                    id="behavior-var",
-                    options=[{"label": v.replace("_", " ").title(), "value": v} for v in filter_options.get("behavior_vars", [])] if data_loaded else [],
-                    value="Total_physical_act_time",
-                    style={"marginBottom": "25px", "fontSize": "12px"},
-                ),
-            ]),
-
-            html.Button("RESET FILTERS", id="reset-button", n_clicks=0, style={
-                "width": "100%", "padding": "12px", "backgroundColor": "#e74c3c", "color": "white",
-                "border": "none", "borderRadius": "5px", "cursor": "pointer", "fontSize": "14px", "fontWeight": "bold"
-            }),
-        ], style={"width": "23%", "float": "left", "padding": "20px", "backgroundColor": "#c8e6c9", "minHeight": "800px"}),
-
-        # MAIN CHART AREA
+                html.H3("Global Controls", style={"textAlign": "center", "color": "#2c3e50", "marginBottom": "20px"}),
+
+                html.H4("Filters", style={"color": "#34495e", "marginBottom": "15px", "borderBottom": "2px solid #95a5a6", "paddingBottom": "5px"}),
+
+                html.Div([
+                    html.Label("Province", style={"fontWeight": "bold", "fontSize": "13px", "color": "#555"}),
+                    dcc.Dropdown(
+                        id="province-filter",
+                        options=[{"label": p, "value": p} for p in filter_options.get("provinces", ["All"])] if options_ready else [],
+                        value="All",
+                        style={"marginBottom": "15px", "fontSize": "12px"},
+                    ),
+                ]),
+
+                html.Div([
+                    html.Label("Age Group", style={"fontWeight": "bold", "fontSize": "13px", "color": "#555"}),
+                    dcc.Dropdown(
+                        id="age-filter",
+                        options=[
+                            {"label": "All", "value": "All"},
+                            {"label": "12-19 (Youth)", "value": "12-19"},
+                            {"label": "20-34 (Young Adult)", "value": "20-34"},
+                            {"label": "35-49 (Adult)", "value": "35-49"},
+                            {"label": "50-64 (Middle Age)", "value": "50-64"},
+                            {"label": "65+ (Senior)", "value": "65+"},
+                        ],
+                        value="All",
+                        style={"marginBottom": "15px", "fontSize": "12px"},
+                    ),
+                ]),
+
+                html.Div([
+                    html.Label("Gender", style={"fontWeight": "bold", "fontSize": "13px", "color": "#555"}),
+                    dcc.Dropdown(
+                        id="gender-filter",
+                        options=[{"label": g, "value": g} for g in filter_options.get("genders", ["All"])] if options_ready else [],
+                        value="All",
+                        style={"marginBottom": "15px", "fontSize": "12px"},
+                    ),
+                ]),
+
+                html.Div([
+                    html.Label("Total Income", style={"fontWeight": "bold", "fontSize": "13px", "color": "#555"}),
+                    dcc.Dropdown(
+                        id="income-filter",
+                        options=[{"label": i, "value": i} for i in filter_options.get("incomes", ["All"])] if options_ready else [],
+                        value="All",
+                        style={"marginBottom": "15px", "fontSize": "12px"},
+                    ),
+                ]),
+
+                html.Div([
+                    html.Label("Immigrant Status", style={"fontWeight": "bold", "fontSize": "13px", "color": "#555"}),
+                    dcc.Dropdown(
+                        id="immigrant-filter",
+                        options=[{"label": i, "value": i} for i in filter_options.get("immigrant", ["All"])] if options_ready else [],
+                        value="All",
+                        style={"marginBottom": "15px", "fontSize": "12px"},
+                    ),
+                ]),
+
+                html.Div([
+                    html.Label("Aboriginal Identity", style={"fontWeight": "bold", "fontSize": "13px", "color": "#555"}),
+                    dcc.Dropdown(
+                        id="aboriginal-filter",
+                        options=[{"label": a, "value": a} for a in filter_options.get("aboriginal", ["All"])] if options_ready else [],
+                        value="All",
+                        style={"marginBottom": "20px", "fontSize": "12px"},
+                    ),
+                ]),
+
+                html.Hr(style={"margin": "20px 0", "border": "1px solid #95a5a6"}),
+
+                html.H4("Variable Toggles", style={"color": "#34495e", "marginBottom": "15px", "borderBottom": "2px solid #95a5a6", "paddingBottom": "5px"}),
+
+                html.Div([
+                    html.Label("Outcome Variable", style={"fontWeight": "bold", "fontSize": "13px", "color": "#555"}),
+                    dcc.Dropdown(
+                        id="outcome-var",
+                        options=[{"label": v.replace("_", " ").title(), "value": v} for v in filter_options.get("outcome_vars", [])] if options_ready else [],
+                        value="Gen_health_state",
+                        style={"marginBottom": "15px", "fontSize": "12px"},
+                    ),
+                ]),
+
+                html.Div([
+                    html.Label("Behavior Variable", style={"fontWeight": "bold", "fontSize": "13px", "color": "#555"}),
+                    dcc.Dropdown(
+                        id="behavior-var",
+                        options=[{"label": v.replace("_", " ").title(), "value": v} for v in filter_options.get("behavior_vars", [])] if options_ready else [],
+                        value="Total_physical_act_time",
+                        style={"marginBottom": "25px", "fontSize": "12px"},
+                    ),
+                ]),
+
+                html.Button("RESET FILTERS", id="reset-button", n_clicks=0, style={
+                    "width": "100%", "padding": "12px", "backgroundColor": "#e74c3c", "color": "white",
+                    "border": "none", "borderRadius": "5px", "cursor": "pointer", "fontSize": "14px", "fontWeight": "bold"
+                }),
+            ], style={"width": "23%", "float": "left", "padding": "20px", "backgroundColor": "#c8e6c9", "minHeight": "800px"}),
+
+            # MAIN CHART AREA
+            html.Div([
+                html.H3("Visualization Area", style={"textAlign": "center", "marginBottom": "20px", "color": "#2c3e50"}),
+
+                html.Div([dvc.Vega(id="chart1", spec={}, style={"width": "100%"})],
+                         style={"backgroundColor": "white", "padding": "20px", "margin": "10px", "borderRadius": "5px", "minHeight": "520px"}),
+
+                html.Div([dvc.Vega(id="chart2", spec={}, style={"width": "100%"},
+                                   signalsToObserve=(["brush"] if BRUSHING else []) + (["zoom"] if CHART2_MODE == "density" else []),
+                                   debounceWait=300)],
+                         style={"backgroundColor": "white", "padding": "20px", "margin": "10px", "borderRadius": "5px", "minHeight": "520px"}),
+
+                html.Div([
+                    html.H4("Chart 3: Social Determinants — Food Security × Mental Health (Immigrant status)",
+                             style={"marginBottom": "10px", "color": "#2c3e50", "textAlign": "left"}),
+                    dvc.Vega(id="chart3", spec={}, style={"width": "100%"}),
+                    html.P("Y-axis shows the average mental health score (1 = Excellent, 5 = Poor) for each food security category, grouped by immigrant status.",
+                           style={"fontSize": "12px", "color": "#7f8c8d", "marginTop": "8px"}),
+                ], style={"backgroundColor": "white", "padding": "20px", "margin": "10px",
+                          "borderRadius": "5px", "minHeight": "520px"}),
+
+            ], style={"width": "75%", "float": "right", "padding": "20px"})
+        ], style={"display": "flex", "minHeight": "800px"}),
+
         html.Div([
-            html.H3("Visualization Area", style={"textAlign": "center", "marginBottom": "20px", "color": "#2c3e50"}),
+            html.P(
+                f"📊 Data Dictionary: {len(df.columns) if data_loaded else 0} variables available | Records: {len(df):,} after filtering" if data_loaded else "",
+                style={"textAlign": "center", "color": "#7f8c8d", "marginTop": "20px", "fontSize": "12px"},
+            )
+        ], style={"clear": "both"}),
+    ])
 
-            html.Div([dvc.Vega(id="chart1", spec={}, style={"width": "100%"})],
-                     style={"backgroundColor": "white", "padding": "20px", "margin": "10px", "borderRadius": "5px", "minHeight": "520px"}),
 
-            html.Div([dvc.Vega(id="chart2", spec={}, style={"width": "100%"})],
-                     style={"backgroundColor": "white", "padding": "20px", "margin": "10px", "borderRadius": "5px", "minHeight": "520px"}),
+app.layout = serve_layout
 
-            html.Div([
-                html.H4("Chart 3: Social Determinants — Food Security × Mental Health (Immigrant status)",
-                         style={"marginBottom": "10px", "color": "#2c3e50", "textAlign": "left"}),
-                html.Iframe(id="chart3", style={"width": "100%", "height": "520px", "border": "none"}),
-                html.P("Y-axis shows the average mental health score (1 = Excellent, 5 = Poor) for each food security category, grouped by immigrant status.",
-                       style={"fontSize": "12px", "color": "#7f8c8d", "marginTop": "8px"}),
-            ], style={"backgroundColor": "white", "padding": "20px", "margin": "10px",
-                      "borderRadius": "5px", "minHeight": "520px"}),
-
-        ], style={"width": "75%", "float": "right", "padding": "20px"})
-    ], style={"display": "flex", "minHeight": "800px"}),
-
-    html.Div([
-        html.P(
-            f"📊 Data Dictionary: {len(df.columns) if data_loaded else 0} variables available | Records: {len(df):,} after filtering" if data_loaded else "",
-            style={"textAlign": "center", "color": "#7f8c8d", "marginTop": "20px", "fontSize": "12px"},
-        )
-    ], style={"clear": "both"}),
-])
+
+@app.callback(Output("warmup-done", "data"), Input("warmup-poll", "n_intervals"), prevent_initial_call=True)
+def poll_warmup(n_intervals):
+    """Report once the background load has finished, successfully or not."""
+    if warming_up():
+        raise PreventUpdate
+    return True
+
+
+# Reload the page once the data is in, so the sidebar and charts are rebuilt from it
+app.clientside_callback(
+    "function (done) { if (done) { window.location.reload(); } return true; }",
+    Output("warmup-poll", "disabled"),
+    Input("warmup-done", "data"),
+    prevent_initial_call=True,
+)
 
 
 @app.callback(
@@ -243,7 +725,84 @@ def reset_filters(n_clicks):
     return "All", "All", "All", "All", "All", "All", "Gen_health_state", "Total_physical_act_time"
 
 
-@app.callback(
+coalescer = coalesce.Coalescer() if COALESCE else None
+
+
+def chart_callback(output, inputs, state=()):
+    """``app.callback`` for the chart outputs; in clientside mode the browser renders them instead.
+
+    With coalescing, Dash also passes the tab's session id, which the ``Coalescer`` strips, so the
+    decorated function keeps its signature. In prerendered mode the callback fills the chart's source
+    store, with the URL of a prerendered spec the function returned or with the spec it rendered.
+    """
+    if clientside_data is not None:
+        return lambda fn: fn
+
+    def register(fn):
+        callback, target = fn, output
+        if prerendered is not None:
+            target = Output(f"{output.component_id}-source", "data")
+
+            def callback(*args):
+                return prerender.source(fn(*args))
+        if coalescer is None:
+            app.callback(target, inputs, list(state))(callback)
+        else:
+            app.callback(target, inputs, list(state) + [State("session-id", "data")])(coalescer.wrap(fn.__name__, callback))
+        return fn
+    return register
+
+
+def prerendered_spec(chart, values):
+    """``SpecFile`` of ``chart`` in the state ``values`` when it is prerendered for this data and code, else None."""
+    if prerendered is None:
+        return None
+    return prerendered.lookup(chart, values, spec_version(), app.config.requests_pathname_prefix.rstrip("/"))
+
+
+def refine_inputs(chart):
+    """Input of the interval polling for ``chart``'s exact answer, in approximate mode."""
+    return [Input(f"refine-{chart}", "n_intervals")] if refiner is not None else []
+
+
+def estimate_label(low, high, fmt):
+    """Tooltip text of an estimate's interval; estimates resting on too few sampled respondents have none."""
+    return [label or "n/a (too few sampled respondents)" for label in interval_label(low, high, fmt)]
+
+
+def provisional_answer(chart, steps, needs_rows, estimate):
+    """Spec estimated from the sample while the exact ``steps`` run in the background, or None to answer exactly.
+
+    Only in approximate mode, for an exact answer that is not cached and ``needs_rows`` (no cube roll-up).
+    ``estimate(level)`` builds the spec from a ``SampleLevel``, or returns None when the sample has no
+    matching respondent. A poll while the exact answer is still computing leaves the chart as it is.
+    """
+    if refiner is None or sample is None or not needs_rows or cached(steps):
+        return None
+    key = steps[0][0]
+    if triggered_id() == f"refine-{chart}" and refiner.pending(key):
+        raise PreventUpdate
+
+    spec = estimate(sample.level_for(APPROX_BUDGET_MS / 1000))
+    if spec is None:
+        return None
+    refiner.submit(key, lambda: [compute() for cache_key, compute in steps if cache_key not in result_cache])
+    # The estimate must not be served again once the exact answer exists
+    http_cache.skip()
+    metrics.APPROXIMATE_ANSWERS.inc(chart)
+    return spec
+
+
+def chart1_estimate(level, key, outcome_var, brush):
+    estimate = level.chart1(key, outcome_var, brush)
+    if len(estimate) == 0:
+        return None
+    estimate["share_ci"] = estimate_label(estimate["share_low"], estimate["share_high"], ".1%")
+    spec = spec_templates.chart1_spec(data_processing.materialize_labels(estimate.drop(columns="sampled")), outcome_var)
+    return spec_templates.provisional(spec, sampling.describe(level, len(df)))
+
+
+@chart_callback(
     Output("chart1", "spec"),
     [Input("province-filter", "value"),
      Input("age-filter", "value"),
@@ -251,136 +810,231 @@ def reset_filters(n_clicks):
      Input("income-filter", "value"),
      Input("immigrant-filter", "value"),
      Input("aboriginal-filter", "value"),
-     Input("outcome-var", "value")]
+     Input("outcome-var", "value"),
+     Input("brush", "data")] + refine_inputs("chart1")
 )
-def update_chart1(province, age_group, gender, income, immigrant, aboriginal, outcome_var):
-    import altair as alt
-
+@metrics.callback("update_chart1")
+def update_chart1(province, age_group, gender, income, immigrant, aboriginal, outcome_var, brush=None, refine=None):
     if not data_loaded:
-        return vega_text("Data not loaded")
+        return not_ready_spec()
+
+    brush = normalize_brush(brush)
+    key = normalize_filters(province, age_group, gender, income, immigrant, aboriginal)
+    spec = prerendered_spec("chart1", key + (outcome_var,)) if brush is None else None
+    if spec is not None:
+        return spec
+    # Brushed states are one-offs: nothing worth precomputing around them
+    if prefetcher is not None and brush is None:
+        prefetch_around(key + (outcome_var,))
+
+    needs_rows = brush is not None or cube is None or not cube.has(outcome_var)
+    spec = provisional_answer("chart1", chart1_steps(key, outcome_var, brush), needs_rows,
+                              lambda level: chart1_estimate(level, key, outcome_var, brush))
+    if spec is not None:
+        return spec
+
+    chart_data = chart1_data(province, age_group, gender, income, immigrant, aboriginal, outcome_var, brush)
+
+    if len(chart_data) == 0:
+        return vega_text("No data matches the current filter selection")
 
-    filtered_df = apply_global_filters(df, province, age_group, gender, income, immigrant, aboriginal)
-    filtered_df = filtered_df.dropna(subset=[outcome_var, "Total_income"])
+    if BOOTSTRAP_REPLICATES:
+        intervals = chart1_intervals(province, age_group, gender, income, immigrant, aboriginal, outcome_var, brush)
+        chart_data = chart_data.merge(intervals, on=[outcome_var, "Total_income"], how="left")
 
-    if len(filtered_df) == 0:
-        return vega_text("No data matches the current filter selection")
+    coalesce.checkpoint()
+    return spec_templates.chart1_spec(data_processing.materialize_labels(chart_data), outcome_var,
+                                      intervals=bool(BOOTSTRAP_REPLICATES))
 
-    chart_data = filtered_df.groupby([outcome_var, "Total_income"]).size().reset_index(name="count")
 
-    chart = alt.Chart(chart_data).mark_bar().encode(
-        x=alt.X(f"{outcome_var}:N", title=outcome_var.replace("_", " ").title(), axis=alt.Axis(labelAngle=-45, labelLimit=200)),
-        y=alt.Y("count:Q", title="Number of Respondents"),
-        color=alt.Color("Total_income:N", title="Income Level"),
-        tooltip=[alt.Tooltip(f"{outcome_var}:N"), alt.Tooltip("Total_income:N"), alt.Tooltip("count:Q", format=",")],
-    ).properties(width=700, height=450)
+def triggered_id():
+    """Id of the component that fired the current callback (None when called outside a Dash request)."""
+    try:
+        return ctx.triggered_id
+    except MissingCallbackContextException:
+        return None
+
+
+@metrics.stage("chart2_density")
+def chart2_density_spec(filtered_df, zoom, behavior_var=spec_templates.DEFAULT_BEHAVIOR, brush=None):
+    """Chart 2 as binned counts over the zoomed domain (the full extent when not zoomed)."""
+    zoom = zoom or {}
+    cells, x_domain, y_domain = density.bin_2d(
+        filtered_df[behavior_var].to_numpy(),
+        filtered_df["Health_utility_index"].to_numpy(),
+        filtered_df["Total_income"],
+        x_domain=zoom.get("x_mid"),
+        y_domain=zoom.get("y_mid"),
+    )
+    return spec_templates.chart2_density_spec(cells, x_domain, y_domain, len(filtered_df), behavior_var, BRUSHING, brush)
 
-    return chart.to_dict()
+
+def brush_from_signal(selection, behavior_var):
+    """Brush store value of Chart 2's ``brush`` signal, keyed by the plotted fields (bin centres in density mode)."""
+    selection = selection or {}
+    x = selection.get(behavior_var, selection.get("x_mid"))
+    y = selection.get("Health_utility_index", selection.get("y_mid"))
+    if not x or not y:
+        return None
+    return [behavior_var, min(x), max(x), min(y), max(y)]
 
 
 @app.callback(
+    [Output("brush", "data"), Output("chart2-zoom", "data")],
+    [Input("chart2", "signalData"), Input("behavior-var", "value")],
+    [State("brush", "data"), State("chart2-zoom", "data")],
+    prevent_initial_call=True,
+)
+def chart2_selections(signal_data, behavior_var, brush, zoom):
+    """Split Chart 2's signals into the brush and zoom stores; a new behaviour variable clears the brush."""
+    signal_data = signal_data or {}
+    if triggered_id() == "behavior-var":
+        new_brush, new_zoom = None, zoom
+    else:
+        new_brush = brush_from_signal(signal_data.get("brush"), behavior_var) if BRUSHING else None
+        new_zoom = signal_data.get("zoom") if CHART2_MODE == "density" else zoom
+    # A re-rendered chart reports the selections it was drawn with again
+    if new_brush == brush and new_zoom == zoom:
+        raise PreventUpdate
+    return (no_update if new_brush == brush else new_brush), (no_update if new_zoom == zoom else new_zoom)
+
+
+@chart_callback(
     Output("chart2", "spec"),
     [Input("province-filter", "value"),
      Input("age-filter", "value"),
      Input("gender-filter", "value"),
      Input("income-filter", "value"),
      Input("immigrant-filter", "value"),
-     Input("aboriginal-filter", "value")]
+     Input("aboriginal-filter", "value"),
+     Input("chart2-zoom", "data"),
+     Input("behavior-var", "value")],
+    [State("brush", "data")]
 )
-def update_chart2(province, age_group, gender, income, immigrant, aboriginal):
+@metrics.callback("update_chart2")
+def update_chart2(province, age_group, gender, income, immigrant, aboriginal, zoom=None, behavior_var=None,
+                  brush=None):
     if not data_loaded:
-        return vega_text("Data not loaded")
-
-    filtered_df = apply_global_filters(df, province, age_group, gender, income, immigrant, aboriginal)
-    filtered_df = filtered_df.dropna(subset=["Total_physical_act_time", "Health_utility_index", "Total_income"])
+        return not_ready_spec()
+
+    zoomed = triggered_id() == "chart2-zoom"
+    if zoomed and (CHART2_MODE != "density" or not zoom):
+        # Only a real zoom re-bins; a freshly rendered spec reports an empty selection
+        raise PreventUpdate
+
+    if behavior_var not in data_processing.BEHAVIOR_VARS:
+        behavior_var = spec_templates.DEFAULT_BEHAVIOR
+    # Chart 2 is not filtered by its own brush; it is drawn with it (the store may still hold the previous variable's)
+    brush = normalize_brush(brush)
+    if brush is not None and brush[0] != behavior_var:
+        brush = None
+    if brush is None and not zoomed:
+        spec = prerendered_spec(
+            "chart2", normalize_filters(province, age_group, gender, income, immigrant, aboriginal) + (behavior_var,))
+        if spec is not None:
+            return spec
+
+    columns = [behavior_var, "Health_utility_index", "Total_income"]
+    filtered_df = filter_rows(province, age_group, gender, income, immigrant, aboriginal, columns=columns)
+    filtered_df = filtered_df.dropna(subset=columns)
 
     if len(filtered_df) == 0:
         return vega_text("No data matches the current filter selection")
 
+    coalesce.checkpoint()
+    if CHART2_MODE == "density":
+        try:
+            return chart2_density_spec(filtered_df, zoom if zoomed else None, behavior_var, brush)
+        except Exception as e:
+            return vega_text(f"Chart 2 error: {type(e).__name__}: {str(e)[:120]}", font_size=12)
+
     if len(filtered_df) > 5000:
         filtered_df = filtered_df.sample(5000, random_state=42)
 
+    plot_df = data_processing.materialize_labels(filtered_df)
+
     try:
-        return behavior_outcome_scatter(filtered_df).to_dict()
+        return spec_templates.chart2_spec(plot_df, behavior_var, BRUSHING, brush)
     except Exception as e:
         return vega_text(f"Chart 2 error: {type(e).__name__}: {str(e)[:120]}", font_size=12)
 
 
-@app.callback(
-    Output("chart3", "srcDoc"),
+@chart_callback(
+    Output("chart3", "spec"),
     [Input("province-filter", "value"),
      Input("age-filter", "value"),
      Input("gender-filter", "value"),
      Input("income-filter", "value"),
      Input("immigrant-filter", "value"),
-     Input("aboriginal-filter", "value")]
+     Input("aboriginal-filter", "value"),
+     Input("brush", "data")] + refine_inputs("chart3")
 )
-def update_chart3(province, age_group, gender, income, immigrant, aboriginal):
-    import altair as alt
-
+@metrics.callback("update_chart3")
+def update_chart3(province, age_group, gender, income, immigrant, aboriginal, brush=None, refine=None):
     if not data_loaded:
-        return '<html><body><h3 style="text-align:center;color:#95a5a6;">Data not loaded</h3></body></html>'
+        return not_ready_spec()
 
-    filtered_df = apply_global_filters(df, province, age_group, gender, income, immigrant, aboriginal)
-    filtered_df = filtered_df.dropna(subset=["Food_security", "Mental_health_state", "Immigrant"])
+    brush = normalize_brush(brush)
+    key = normalize_filters(province, age_group, gender, income, immigrant, aboriginal)
+    spec = prerendered_spec("chart3", key) if brush is None else None
+    if spec is not None:
+        return spec
 
-    if len(filtered_df) == 0:
-        return '<html><body style="display:flex;justify-content:center;align-items:center;height:100%;"><h3 style="color:#95a5a6;">No data matches the current filter selection</h3></body></html>'
+    needs_rows = brush is not None or cube is None or not cube.has()
+    spec = provisional_answer("chart3", chart3_steps(key, brush), needs_rows,
+                              lambda level: chart3_estimate(level, key, age_group, brush))
+    if spec is not None:
+        return spec
 
-    mental_score_map = {"Excellent": 1, "Very good": 2, "Good": 3, "Fair": 4, "Poor": 5}
-    filtered_df = filtered_df.copy()
-    filtered_df["Mental_health_score"] = filtered_df["Mental_health_state"].map(mental_score_map)
+    grouped = chart3_data(province, age_group, gender, income, immigrant, aboriginal, brush)
 
-    grouped = (
-        filtered_df
-        .groupby(["Food_security", "Immigrant"])
-        .agg(avg_score=("Mental_health_score", "mean"),
-             respondent_count=("Mental_health_state", "size"))
-        .reset_index()
-    )
+    if len(grouped) == 0:
+        return vega_text("No data matches the current filter selection")
 
-    food_order = ["Food secure", "Moderately food insecure", "Severely food insecure"]
-    immigrant_order = ["Yes", "No"]
-    available_food = [f for f in food_order if f in grouped["Food_security"].unique()]
-    age_label = age_group if age_group != "All" else "All ages"
-
-    bars = (
-        alt.Chart(grouped)
-        .mark_bar(size=60)
-        .encode(
-            x=alt.X("Food_security:N", title="Food security status",
-                     sort=available_food if available_food else food_order,
-                     axis=alt.Axis(labelAngle=0, labelLimit=240, labelPadding=10),
-                     scale=alt.Scale(paddingInner=0.15, paddingOuter=0.2)),
-            xOffset=alt.XOffset("Immigrant:N", title=None),
-            y=alt.Y("avg_score:Q", title="Average mental health (1 = Excellent, 5 = Poor)",
-                     scale=alt.Scale(domain=[0, 5], nice=False)),
-            y2=alt.Y2(value=0),
-            color=alt.Color("Immigrant:N", title="Immigrant status",
-                            sort=immigrant_order, scale=alt.Scale(range=["#1f77b4", "#ff7f0e"])),
-            tooltip=[
-                alt.Tooltip("Food_security:N", title="Food security"),
-                alt.Tooltip("Immigrant:N", title="Immigrant status"),
-                alt.Tooltip("avg_score:Q", title="Average mental health", format=".2f"),
-                alt.Tooltip("respondent_count:Q", title="Respondents", format=","),
-            ],
+    total_respondents = int(grouped["respondent_count"].sum())
+    if BOOTSTRAP_REPLICATES:
+        intervals = chart3_intervals(province, age_group, gender, income, immigrant, aboriginal, brush)
+        grouped = grouped.merge(intervals, on=["Food_security", "Immigrant"], how="left")
+    coalesce.checkpoint()
+    grouped = data_processing.materialize_labels(grouped)
+    return spec_templates.chart3_spec(grouped, chart3_subtitle(f"{total_respondents:,}", age_group, brush),
+                                      intervals=bool(BOOTSTRAP_REPLICATES))
+
+
+def chart3_subtitle(total, age_group, brush):
+    # Empty values and unknown buckets filter nothing (see normalize_filters)
+    age_label = age_group if age_group in data_processing.AGE_GROUPS else "All ages"
+    subtitle = f"Total: {total} respondents | Filter: {age_label}"
+    if brush is not None:
+        behavior_var, x_low, x_high, y_low, y_high = brush
+        subtitle += f" | Brushed on Chart 2: {behavior_var.replace('_', ' ')} {x_low:,.1f}–{x_high:,.1f}, health utility {y_low:.2f}–{y_high:.2f}"
+    return subtitle
+
+
+def chart3_estimate(level, key, age_group, brush):
+    estimate = level.chart3(key, brush)
+    if len(estimate) == 0:
+        return None
+    estimate["ci_label"] = estimate_label(estimate["ci_low"], estimate["ci_high"], ".2f")
+    subtitle = chart3_subtitle(f"≈{int(estimate['respondent_count'].sum()):,}", age_group, brush)
+    spec = spec_templates.chart3_spec(data_processing.materialize_labels(estimate.drop(columns="sampled")), subtitle)
+    return spec_templates.provisional(spec, sampling.describe(level, len(df)))
+
+
+if refiner is not None:
+    # Poll for the exact answer only while the chart shows an estimate
+    for chart in ("chart1", "chart3"):
+        app.clientside_callback(
+            "function (spec) { return !(spec && spec.usermeta && spec.usermeta.approximate); }",
+            Output(f"refine-{chart}", "disabled"),
+            Input(chart, "spec"),
         )
-    )
-
-    baseline = alt.Chart(pd.DataFrame({"y": [0]})).mark_rule(color="#666", strokeWidth=1, opacity=0.8).encode(y="y:Q")
 
-    chart = (
-        (bars + baseline)
-        .properties(
-            width=640, height=430,
-            title={"text": "Social determinants: mental health by food security (immigrant status)",
-                   "subtitle": f"Total: {len(filtered_df):,} respondents | Filter: {age_label}"},
-        )
-        .configure_axis(labelFontSize=11, titleFontSize=13, gridColor="#e5e7eb", gridOpacity=0.7)
-        .configure_view(strokeWidth=0)
-        .configure_legend(titleFontSize=12, labelFontSize=10, orient="right", offset=10)
-    )
 
-    return chart.to_html()
+if clientside_data is not None:
+    clientside_data.register(app, {"chart1": update_chart1, "chart2": update_chart2, "chart3": update_chart3})
+if prerendered is not None:
+    prerendered.register(app)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,239 @@
+// Clientside callbacks for HEALTH_DASH_CLIENTSIDE=1 (registered by src/clientside.py).
+// The survey snapshot is fetched once; filtering and the chart aggregations run here.
+(function () {
+    // Devices reporting less memory than this (navigator.deviceMemory, GB), or pages
+    // opened with ?lite, ask the server to render charts instead.
+    const LOW_MEMORY_GB = 2;
+    const SAMPLE_POINTS = 5000;
+    const NO_DATA = 'No data matches the current filter selection';
+
+    const TYPED = {int8: Int8Array, int16: Int16Array, int32: Int32Array, float64: Float64Array};
+    const decoded = new WeakMap();
+    let lastRows = {snapshot: null, key: null, rows: null};
+
+    function textSpec(message, fontSize) {
+        return {
+            $schema: 'https://vega.github.io/schema/vega-lite/v5.json',
+            width: 700,
+            height: 450,
+            data: {values: [{text: message}]},
+            mark: {type: 'text', fontSize: fontSize || 16, align: 'center', baseline: 'middle'},
+            encoding: {text: {field: 'text'}},
+        };
+    }
+
+    function decodeColumn(column) {
+        const binary = atob(column.data);
+        const bytes = new Uint8Array(binary.length);
+        for (let i = 0; i < binary.length; i++) {
+            bytes[i] = binary.charCodeAt(i);
+        }
+        const Type = TYPED[column.dtype];
+        return Object.assign({}, column, {values: new Type(bytes.buffer, 0, bytes.length / Type.BYTES_PER_ELEMENT)});
+    }
+
+    function columns(snapshot) {
+        let cols = decoded.get(snapshot);
+        if (!cols) {
+            cols = {};
+            for (const name of Object.keys(snapshot.columns)) {
+                cols[name] = decodeColumn(snapshot.columns[name]);
+            }
+            decoded.set(snapshot, cols);
+        }
+        return cols;
+    }
+
+    function isMissing(column, i) {
+        const v = column.values[i];
+        if (column.labels) return v < 0;
+        if (column.missing !== undefined) return v === column.missing;
+        return Number.isNaN(v);
+    }
+
+    function label(column, raw) {
+        return column.labels ? column.labels[raw] : raw;
+    }
+
+    // Row positions matching the sidebar filters; shared by the three chart callbacks
+    function matchingRows(snapshot, filters) {
+        const key = JSON.stringify(filters);
+        if (lastRows.snapshot === snapshot && lastRows.key === key) return lastRows.rows;
+
+        const cols = columns(snapshot);
+        const tests = [];
+        let impossible = false;
+        for (const name of Object.keys(filters)) {
+            const value = filters[name];
+            if (!value || value === 'All') continue;
+            if (name === 'age_group') {
+                const range = snapshot.age_groups[value];
+                const age = cols.Age;
+                if (!range || !age) continue;
+                tests.push(i => !isMissing(age, i) && age.values[i] >= range[0] && (range[1] === null || age.values[i] <= range[1]));
+            } else {
+                const column = cols[snapshot.filter_columns[name]];
+                if (!column) continue;
+                const code = column.labels.indexOf(value);
+                if (code < 0) impossible = true;
+                tests.push(i => column.values[i] === code);
+            }
+        }
+
+        let rows = new Int32Array(impossible ? 0 : snapshot.rows);
+        let k = 0;
+        if (!impossible) {
+            outer: for (let i = 0; i < snapshot.rows; i++) {
+                for (const test of tests) {
+                    if (!test(i)) continue outer;
+                }
+                rows[k++] = i;
+            }
+        }
+        rows = rows.subarray(0, k);
+        lastRows = {snapshot: snapshot, key: key, rows: rows};
+        return rows;
+    }
+
+    function filtersOf(args) {
+        return {
+            province: args[0], age_group: args[1], gender: args[2],
+            income: args[3], immigrant: args[4], aboriginal: args[5],
+        };
+    }
+
+    function withTable(template, values) {
+        return Object.assign({}, template, {datasets: Object.assign({}, template.datasets, {table: values})});
+    }
+
+    // Fallback for low-memory clients: the server renders the chart
+    function serverChart(meta, name, args) {
+        return fetch(meta.chart_url + name, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({args: args}),
+        }).then(response => response.json()).then(body => body.result);
+    }
+
+    function byKeys(a, b) {
+        for (let i = 0; i < a.length; i++) {
+            if (a[i] !== b[i]) return a[i] < b[i] ? -1 : 1;
+        }
+        return 0;
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        health: {
+            loadSnapshot: function (meta) {
+                if (!meta) return null;
+                const lowMemory = (navigator.deviceMemory !== undefined && navigator.deviceMemory < LOW_MEMORY_GB) ||
+                    new URLSearchParams(window.location.search).has('lite');
+                if (lowMemory) return {fallback: true};
+                return fetch(meta.url, {credentials: 'same-origin'})
+                    .then(response => {
+                        if (!response.ok) throw new Error(response.statusText);
+                        return response.json();
+                    })
+                    .catch(() => ({fallback: true}));
+            },
+
+            chart1: function (province, ageGroup, gender, income, immigrant, aboriginal, outcomeVar, snapshot, meta) {
+                const args = [province, ageGroup, gender, income, immigrant, aboriginal, outcomeVar];
+                if (!snapshot) return textSpec('Loading data…');
+                if (snapshot.fallback) return serverChart(meta, 'chart1', args);
+
+                const cols = columns(snapshot);
+                const outcome = cols[outcomeVar];
+                const incomeCol = cols.Total_income;
+                const counts = new Map();
+                for (const i of matchingRows(snapshot, filtersOf(args))) {
+                    if (isMissing(outcome, i) || isMissing(incomeCol, i)) continue;
+                    const key = outcome.values[i] + '|' + incomeCol.values[i];
+                    counts.set(key, (counts.get(key) || 0) + 1);
+                }
+                if (counts.size === 0) return textSpec(NO_DATA);
+
+                const cells = Array.from(counts, ([key, count]) => [...key.split('|').map(Number), count]);
+                cells.sort(byKeys);
+                const values = cells.map(([o, c, count]) => ({
+                    [outcomeVar]: label(outcome, o), Total_income: label(incomeCol, c), count: count,
+                }));
+                return withTable(snapshot.templates.chart1[outcomeVar], values);
+            },
+
+            chart2: function (province, ageGroup, gender, income, immigrant, aboriginal, behaviorVar, snapshot, meta) {
+                // The server callback also takes the Chart 2 zoom, before the behaviour variable
+                const args = [province, ageGroup, gender, income, immigrant, aboriginal, null, behaviorVar];
+                if (!snapshot) return textSpec('Loading data…');
+                if (snapshot.fallback) return serverChart(meta, 'chart2', args);
+
+                if (!snapshot.templates.chart2[behaviorVar]) behaviorVar = snapshot.default_behavior;
+                const cols = columns(snapshot);
+                const x = cols[behaviorVar];
+                const y = cols.Health_utility_index;
+                const incomeCol = cols.Total_income;
+                const usable = [];
+                for (const i of matchingRows(snapshot, filtersOf(args))) {
+                    if (!isMissing(x, i) && !isMissing(y, i) && !isMissing(incomeCol, i)) usable.push(i);
+                }
+                if (usable.length === 0) return textSpec(NO_DATA);
+
+                // Evenly spaced sample keeps the point count bounded
+                const step = Math.max(1, usable.length / SAMPLE_POINTS);
+                const values = [];
+                for (let k = 0; k < usable.length && values.length < SAMPLE_POINTS; k += step) {
+                    const i = usable[Math.floor(k)];
+                    values.push({
+                        [behaviorVar]: x.values[i],
+                        Health_utility_index: y.values[i],
+                        Total_income: label(incomeCol, incomeCol.values[i]),
+                    });
+                }
+                return withTable(snapshot.templates.chart2[behaviorVar], values);
+            },
+
+            chart3: function (province, ageGroup, gender, income, immigrant, aboriginal, snapshot, meta) {
+                const args = [province, ageGroup, gender, income, immigrant, aboriginal];
+                if (!snapshot) return textSpec('Loading data…');
+                if (snapshot.fallback) return serverChart(meta, 'chart3', args);
+
+                const cols = columns(snapshot);
+                const food = cols.Food_security;
+                const immigrantCol = cols.Immigrant;
+                const mental = cols.Mental_health_state;
+                const groups = new Map();
+                let total = 0;
+                for (const i of matchingRows(snapshot, filtersOf(args))) {
+                    if (isMissing(food, i) || isMissing(immigrantCol, i) || isMissing(mental, i)) continue;
+                    const score = snapshot.mental_scores[label(mental, mental.values[i])];
+                    if (score === undefined) continue;
+                    const key = food.values[i] + '|' + immigrantCol.values[i];
+                    const group = groups.get(key) || {sum: 0, count: 0};
+                    group.sum += score;
+                    group.count += 1;
+                    groups.set(key, group);
+                    total += 1;
+                }
+                if (groups.size === 0) return textSpec(NO_DATA);
+
+                const cells = Array.from(groups, ([key, g]) => [...key.split('|').map(Number), g]);
+                cells.sort(byKeys);
+                const values = cells.map(([f, m, g]) => ({
+                    Food_security: label(food, f),
+                    Immigrant: label(immigrantCol, m),
+                    avg_score: g.sum / g.count,
+                    respondent_count: g.count,
+                }));
+
+                const template = snapshot.templates.chart3;
+                // Empty values and unknown buckets filter nothing, as in matchingRows
+                const ageLabel = ageGroup && snapshot.age_groups[ageGroup] ? ageGroup : 'All ages';
+                const spec = withTable(template, values);
+                spec.title = Object.assign({}, template.title, {
+                    subtitle: 'Total: ' + total.toLocaleString('en-US') + ' respondents | Filter: ' + ageLabel,
+                });
+                return spec;
+            },
+        },
+    });
+})();
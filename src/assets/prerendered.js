@@ -0,0 +1,44 @@
+// Clientside callback for HEALTH_DASH_PRERENDERED=<dir> (registered by src/prerender.py).
+// Each chart's source store holds either the live spec or the URL of a prerendered spec file,
+// fetched here from the app or from the static file server / CDN it was published to.
+(function () {
+    const GZIP_MAGIC = [0x1f, 0x8b];
+
+    function textSpec(message) {
+        return {
+            $schema: 'https://vega.github.io/schema/vega-lite/v5.json',
+            width: 700,
+            height: 450,
+            data: {values: [{text: message}]},
+            mark: {type: 'text', fontSize: 12, align: 'center', baseline: 'middle'},
+            encoding: {text: {field: 'text'}},
+        };
+    }
+
+    // Servers sending Content-Encoding: gzip hand over plain JSON; others send the .json.gz bytes as they are
+    function decode(buffer) {
+        const bytes = new Uint8Array(buffer);
+        if (bytes[0] !== GZIP_MAGIC[0] || bytes[1] !== GZIP_MAGIC[1]) {
+            return Promise.resolve(new TextDecoder().decode(bytes));
+        }
+        const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('gzip'));
+        return new Response(stream).text();
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        prerendered: {
+            spec: function (source) {
+                if (!source) return window.dash_clientside.no_update;
+                if (!source.url) return source.spec;
+                return fetch(source.url, {credentials: 'same-origin'})
+                    .then(response => {
+                        if (!response.ok) throw new Error(response.status + ' ' + response.statusText);
+                        return response.arrayBuffer();
+                    })
+                    .then(decode)
+                    .then(JSON.parse)
+                    .catch(error => textSpec('Chart could not be loaded: ' + error.message));
+            },
+        },
+    });
+})();
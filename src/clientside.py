@@ -0,0 +1,111 @@
+"""Clientside mode (HEALTH_DASH_CLIENTSIDE=1).
+
+The survey snapshot is sent once; filtering and the chart aggregations
+then run in the browser (``assets/clientside.js``). The server keeps the
+compressed snapshot and a fallback route that renders charts for
+clients too small to hold the data.
+"""
+import gzip
+import json
+
+from dash import ClientsideFunction, Input, Output, State, dcc
+from flask import Response, jsonify, request
+
+# Import local modules (works both as script and module)
+try:
+    from .snapshot import snapshot_payload
+except ImportError:
+    from snapshot import snapshot_payload
+
+SNAPSHOT_ROUTE = "/clientside/snapshot.json"
+CHART_ROUTE = "/clientside/chart/"
+
+# Arguments the browser sends for each server-rendered chart (assets/clientside.js): the six filters, then
+# Chart 1's outcome variable, Chart 2's zoom (always null) and behaviour variable
+FALLBACK_ARITY = {"chart1": 7, "chart2": 8, "chart3": 6}
+
+FILTER_INPUTS = [
+    Input("province-filter", "value"),
+    Input("age-filter", "value"),
+    Input("gender-filter", "value"),
+    Input("income-filter", "value"),
+    Input("immigrant-filter", "value"),
+    Input("aboriginal-filter", "value"),
+]
+
+
+class ClientsideData:
+    """Compressed snapshot plus the server-rendered fallback for each chart"""
+
+    def __init__(self, df):
+        self.payload, self.version = snapshot_payload(df)
+        self.fallbacks = {}
+
+    def stores(self, app):
+        """Layout components: where to fetch the snapshot, and where it lives once fetched"""
+        url = app.get_relative_path(SNAPSHOT_ROUTE) + f"?v={self.version}"
+        return [
+            dcc.Store(id="snapshot-meta", data={"url": url, "chart_url": app.get_relative_path(CHART_ROUTE)}),
+            dcc.Store(id="survey-snapshot"),
+        ]
+
+    def register(self, app, fallbacks):
+        """Add the snapshot / fallback routes and the clientside callbacks to ``app``.
+
+        ``fallbacks`` maps chart name to the server-side function rendering it.
+        """
+        self.fallbacks = dict(fallbacks)
+        server = app.server
+
+        @server.route(SNAPSHOT_ROUTE)
+        def clientside_snapshot():
+            etag = f'"{self.version}"'
+            if request.headers.get("If-None-Match") == etag:
+                return Response(status=304, headers={"ETag": etag})
+
+            if "gzip" in request.headers.get("Accept-Encoding", ""):
+                response = Response(self.payload, mimetype="application/json")
+                response.headers["Content-Encoding"] = "gzip"
+            else:
+                response = Response(gzip.decompress(self.payload), mimetype="application/json")
+            response.headers["ETag"] = etag
+            response.headers["Vary"] = "Accept-Encoding"
+            # The URL carries the version, so the body never changes under it
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+            return response
+
+        @server.route(CHART_ROUTE + "<name>", methods=["POST"])
+        def clientside_chart(name):
+            if name not in self.fallbacks:
+                return jsonify({"error": f"unknown chart {name!r}"}), 404
+            body = request.get_json(silent=True)
+            args = body.get("args") if isinstance(body, dict) else None
+            arity = FALLBACK_ARITY[name]
+            if (not isinstance(args, list) or len(args) != arity
+                    or not all(arg is None or isinstance(arg, str) for arg in args)):
+                return jsonify({"error": f"args must be a list of {arity} strings or nulls"}), 400
+            return Response(json.dumps({"result": self.fallbacks[name](*args)}), mimetype="application/json")
+
+        app.clientside_callback(
+            ClientsideFunction(namespace="health", function_name="loadSnapshot"),
+            Output("survey-snapshot", "data"),
+            Input("snapshot-meta", "data"),
+        )
+        app.clientside_callback(
+            ClientsideFunction(namespace="health", function_name="chart1"),
+            Output("chart1", "spec"),
+            FILTER_INPUTS + [Input("outcome-var", "value"), Input("survey-snapshot", "data")],
+            State("snapshot-meta", "data"),
+        )
+        app.clientside_callback(
+            ClientsideFunction(namespace="health", function_name="chart2"),
+            Output("chart2", "spec"),
+            FILTER_INPUTS + [Input("behavior-var", "value"), Input("survey-snapshot", "data")],
+            State("snapshot-meta", "data"),
+        )
+        app.clientside_callback(
+            ClientsideFunction(namespace="health", function_name="chart3"),
+            Output("chart3", "spec"),
+            FILTER_INPUTS + [Input("survey-snapshot", "data")],
+            State("snapshot-meta", "data"),
+        )
@@ -0,0 +1,161 @@
+"""Single-flight and supersession for the chart callbacks.
+
+Two kinds of chart work are wasted on a busy worker:
+
+- identical requests in flight at the same moment (many users on the
+  default view): ``SingleFlight`` lets the first one compute and hands
+  its result to the others;
+- requests a newer state from the same browser tab has already replaced
+  (a burst of filter changes): requests of one tab run one at a time
+  per chart, and a request that is superseded while it waits, or by the
+  time it reaches a ``checkpoint()``, is dropped with ``PreventUpdate``.
+  The tab's newest request renders instead.
+
+A tab is identified by the ``session-id`` store of the page, passed to
+the chart callbacks as their last argument. Saved work is counted in
+``/metrics`` (``health_dash_shared_*``, ``health_dash_superseded_*``).
+Coalescing only matters with concurrent requests in a worker (threaded
+server, gthread workers); sync workers see one request at a time.
+"""
+import functools
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from dash import ctx
+from dash.exceptions import MissingCallbackContextException, PreventUpdate
+
+# Import local modules (works both as script and module)
+try:
+    from . import metrics
+except ImportError:
+    import metrics
+
+MAX_SESSIONS = 4096
+
+_local = threading.local()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.ok = False
+        self.result = None
+        self.elapsed = 0.0
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share one execution"""
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """``(result, flight)``: ``fn()``'s result, and the flight it came from when another call computed it.
+
+        If that call fails (or is superseded), the waiters compute it themselves.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.ok:
+                return flight.result, flight
+            return fn(), None
+
+        start = time.perf_counter()
+        try:
+            flight.result = fn()
+            flight.ok = True
+            return flight.result, None
+        finally:
+            flight.elapsed = time.perf_counter() - start
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+
+class _Session:
+    """Requests of one tab for one chart"""
+
+    def __init__(self):
+        self.latest = 0
+        self.running = threading.Lock()
+
+
+def checkpoint():
+    """Drop the current chart request if its tab has since asked for a newer state"""
+    ticket = getattr(_local, 'ticket', None)
+    if ticket is None:
+        return
+    name, session, number = ticket
+    if session.latest != number:
+        metrics.SUPERSEDED_CALLBACKS.inc(name)
+        raise PreventUpdate
+
+
+def _triggered():
+    try:
+        return tuple(sorted(ctx.triggered_prop_ids))
+    except (MissingCallbackContextException, LookupError):
+        # Called outside a Dash request (LookupError in a thread that never saw one)
+        return ()
+
+
+class Coalescer:
+    """Wraps chart callbacks with single-flight across users and supersession within a tab"""
+
+    def __init__(self, max_sessions=MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self.flights = SingleFlight()
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _ticket(self, name, session_id):
+        """Register a new request of this tab for chart ``name``: ``(name, session, number)``"""
+        with self._lock:
+            key = (session_id, name)
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._sessions[key] = _Session()
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            self._sessions.move_to_end(key)
+            session.latest += 1
+            return name, session, session.latest
+
+    def wrap(self, name, fn):
+        """Callback for Dash taking ``fn``'s arguments plus the tab's session id last"""
+
+        @functools.wraps(fn)
+        def wrapper(*args):
+            *args, session_id = args
+            # Callbacks may depend on which input fired (e.g. a Chart 2 zoom), so that is part of the key
+            key = json.dumps([name, _triggered(), args], sort_keys=True, default=str)
+            if session_id is None:
+                return self._shared(name, key, fn, args)
+
+            ticket = self._ticket(name, session_id)
+            with ticket[1].running:
+                _local.ticket = ticket
+                try:
+                    checkpoint()
+                    return self._shared(name, key, fn, args)
+                finally:
+                    _local.ticket = None
+
+        return wrapper
+
+    def _shared(self, name, key, fn, args):
+        result, flight = self.flights.do(key, lambda: fn(*args))
+        if flight is not None:
+            metrics.SHARED_CALLBACKS.inc(name)
+            metrics.SHARED_SECONDS.inc(name, flight.elapsed)
+            checkpoint()
+        return result
@@ -0,0 +1,170 @@
+"""Bit-packed chronic-condition matrix for the comorbidity views.
+
+The ten Yes/No condition columns (``data_processing.YES_NO_FIELDS``) are
+packed into one ``uint16`` per respondent: bit ``i`` of ``reported`` is
+set when the respondent reported condition ``i``, and bit ``i`` of
+``answered`` when they answered it at all. Kernels work on those integers
+with bitwise operations and popcounts instead of comparing label strings:
+
+- ``prevalence(by=...)``: share reporting each condition per group of a
+  socioeconomic column (the chronic-condition heatmap);
+- ``comorbidity()``: pairwise co-occurrence of every condition pair;
+- ``condition_counts()``: distribution of the number of conditions reported.
+
+Every kernel takes ``rows`` (positions from ``FilterIndex.positions``) to
+restrict it to the current sidebar selection.
+
+    python -m src.conditions --by Total_income
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+# Import local modules (works both as script and module)
+try:
+    from . import data_processing
+except ImportError:
+    import data_processing
+
+CONDITIONS = list(data_processing.YES_NO_FIELDS)
+
+# Socioeconomic columns the heatmap can group by
+GROUP_COLUMNS = ['Total_income', 'Food_security', 'Immigrant', 'Aboriginal_identity', 'Gender', 'Province']
+
+
+def popcount(values):
+    """Set bits per element of a ``uint16`` array"""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    return _POPCOUNT_TABLE[values]
+
+
+_POPCOUNT_TABLE = None if hasattr(np, 'bitwise_count') else np.array(
+    [bin(i).count('1') for i in range(1 << 16)], dtype=np.uint8)
+
+
+class ConditionMatrix:
+    """Reported / answered condition bits per respondent, with group codes for the socioeconomic columns"""
+
+    def __init__(self, reported, answered, conditions, groups=None):
+        self.reported = reported
+        self.answered = answered
+        self.conditions = list(conditions)
+        # column -> (codes per row, labels)
+        self.groups = groups or {}
+
+    @classmethod
+    def build(cls, df, conditions=CONDITIONS, group_columns=GROUP_COLUMNS):
+        """Pack the condition columns of ``df`` (labels or categoricals) and encode its group columns
+
+        Every condition must be a column of ``df``; group columns it lacks are left out.
+        """
+        if len(conditions) > 16:
+            raise ValueError(f"At most 16 conditions fit in a uint16, got {len(conditions)}")
+        missing = [condition for condition in conditions if condition not in df.columns]
+        if missing:
+            raise KeyError(f"Condition column(s) missing from the data: {missing}")
+        yes_no = list(data_processing.YES_NO_MAP.values())
+        yes = yes_no.index('Yes')
+        reported = np.zeros(len(df), dtype=np.uint16)
+        answered = np.zeros(len(df), dtype=np.uint16)
+        for bit, condition in enumerate(conditions):
+            codes = data_processing.label_codes(df[condition], yes_no)
+            reported |= (codes == yes).astype(np.uint16) << bit
+            answered |= (codes >= 0).astype(np.uint16) << bit
+
+        dtypes = data_processing.compact_dtypes()
+        groups = {}
+        for column in group_columns:
+            if column in df.columns and column in dtypes:
+                labels = dtypes[column].categories.tolist()
+                groups[column] = (data_processing.label_codes(df[column], labels), labels)
+        return cls(reported, answered, conditions, groups)
+
+    @property
+    def nbytes(self):
+        return self.reported.nbytes + self.answered.nbytes
+
+    def _rows(self, rows):
+        if rows is None:
+            return self.reported, self.answered
+        return self.reported[rows], self.answered[rows]
+
+    def prevalence(self, by, rows=None):
+        """Answered, reported and prevalence per ``by`` group x condition, in long form for the heatmap"""
+        codes, labels = self.groups[by]
+        reported, answered = self._rows(rows)
+        codes = codes if rows is None else codes[rows]
+        grouped = codes >= 0
+        codes, reported, answered = codes[grouped], reported[grouped], answered[grouped]
+
+        n_groups, n_conditions = len(labels), len(self.conditions)
+        reported_counts = np.empty((n_groups, n_conditions), dtype=np.int64)
+        answered_counts = np.empty((n_groups, n_conditions), dtype=np.int64)
+        for bit in range(n_conditions):
+            reported_counts[:, bit] = np.bincount(codes, weights=(reported >> bit) & 1, minlength=n_groups)
+            answered_counts[:, bit] = np.bincount(codes, weights=(answered >> bit) & 1, minlength=n_groups)
+        reported_counts, answered_counts = reported_counts.ravel(), answered_counts.ravel()
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            prevalence = reported_counts / answered_counts
+        return pd.DataFrame({
+            by: np.repeat(labels, n_conditions),
+            'condition': self.conditions * n_groups,
+            'answered': answered_counts,
+            'reported': reported_counts,
+            'prevalence': prevalence,
+        })
+
+    def patterns(self, rows=None):
+        """``(reported, answered, count)`` of every distinct answer pattern among ``rows``"""
+        reported, answered = self._rows(rows)
+        width = len(self.conditions)
+        keys = (answered.astype(np.int64) << width) | reported
+        counts = np.bincount(keys, minlength=1 << (2 * width))
+        present = np.flatnonzero(counts)
+        mask = (1 << width) - 1
+        return (present & mask).astype(np.uint16), (present >> width).astype(np.uint16), counts[present]
+
+    def comorbidity(self, rows=None):
+        """Pairwise matrices over conditions: respondents reporting both, answering both, and the rate
+
+        Computed from the distinct answer patterns (a few hundred at most in
+        practice), so the cost is one pass over the rows plus tiny matmuls.
+        """
+        reported, answered, counts = self.patterns(rows)
+        bits = np.arange(len(self.conditions), dtype=np.uint16)
+        reported_bits = ((reported[:, None] >> bits) & 1).astype(np.int64)
+        answered_bits = ((answered[:, None] >> bits) & 1).astype(np.int64)
+        both = reported_bits.T @ (reported_bits * counts[:, None])
+        answered_both = answered_bits.T @ (answered_bits * counts[:, None])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rate = both / answered_both
+        frame = lambda values: pd.DataFrame(values, index=self.conditions, columns=self.conditions)
+        return {'both': frame(both), 'answered': frame(answered_both), 'rate': frame(rate)}
+
+    def condition_counts(self, rows=None, complete_only=False):
+        """Respondents by number of conditions reported (0 .. len(conditions))
+
+        ``complete_only`` keeps only respondents who answered every condition.
+        """
+        reported, answered = self._rows(rows)
+        if complete_only:
+            reported = reported[answered == (1 << len(self.conditions)) - 1]
+        counts = np.bincount(popcount(reported), minlength=len(self.conditions) + 1)
+        return pd.Series(counts, index=pd.RangeIndex(len(counts), name='conditions'), name='respondents')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Condition prevalence, comorbidity and counts from the packed matrix.')
+    parser.add_argument('--by', default='Total_income', choices=GROUP_COLUMNS)
+    args = parser.parse_args()
+
+    matrix = ConditionMatrix.build(data_processing.load_data(compact=True))
+    prevalence = matrix.prevalence(args.by).pivot(index=args.by, columns='condition', values='prevalence')
+    print(prevalence.loc[matrix.groups[args.by][1], matrix.conditions].to_string(float_format=lambda x: f'{x:.3f}'))
+    print()
+    print(matrix.comorbidity()['rate'].to_string(float_format=lambda x: f'{x:.3f}'))
+    print()
+    print(matrix.condition_counts().to_string())
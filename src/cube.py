@@ -0,0 +1,209 @@
+"""Pre-aggregated data cube for Chart 1 and Chart 3.
+
+The cube holds additive measures (count, sum, sum of squares) for every
+observed combination of the six sidebar filter dimensions plus each
+chart's grouping dimensions. Any sidebar selection, "All" included, is
+answered by masking and rolling up cube cells, so the callbacks cost
+O(cells) instead of O(rows).
+
+Build and persist it offline with ``python -m src.cube``.
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+# Import local modules (works both as script and module)
+try:
+    from . import data_processing, storage
+    from .filter_index import FILTER_NAMES
+except ImportError:
+    import data_processing
+    import storage
+    from filter_index import FILTER_NAMES
+
+# Bump when the cube layout changes so persisted cubes are rebuilt
+CUBE_VERSION = 2
+
+AGE_BUCKET = 'Age_group'
+
+# Cube column per sidebar filter, in FILTER_NAMES order
+DIMENSIONS = {
+    'province': 'Province',
+    'age_group': AGE_BUCKET,
+    'gender': 'Gender',
+    'income': 'Total_income',
+    'immigrant': 'Immigrant',
+    'aboriginal': 'Aboriginal_identity',
+}
+
+CHART3_TABLE = 'chart3'
+# Respondents per Mental_health_state within each Chart 3 cell, for bootstrap intervals
+CHART3_SCORES_TABLE = 'chart3_scores'
+
+
+def _chart1_table(outcome_var):
+    return f'chart1_{outcome_var}'
+
+
+def _dimension_frame(df):
+    """The filter dimensions of ``df``, with Age replaced by its bucket label"""
+    columns = {}
+    for name in FILTER_NAMES:
+        column = DIMENSIONS[name]
+        if column == AGE_BUCKET:
+            columns[column] = data_processing.age_group_labels(df['Age']) if 'Age' in df.columns else None
+        else:
+            columns[column] = df[column] if column in df.columns else None
+    return pd.DataFrame(columns, index=df.index)
+
+
+def _aggregate(keys, by, measure=None):
+    """Count (and sum / sum of squares of ``measure``) per observed combination of ``by``"""
+    if measure is None:
+        return keys.groupby(by, dropna=False, observed=True, sort=False).size().reset_index(name='count')
+    keys = keys.assign(_squared=keys[measure] * keys[measure])
+    grouped = keys.groupby(by, dropna=False, observed=True, sort=False)
+    return grouped.agg(count=(measure, 'size'), sum=(measure, 'sum'), sumsq=('_squared', 'sum')).reset_index()
+
+
+class AggregateCube:
+    """Additive aggregates over the sidebar filter space, one table per chart query"""
+
+    def __init__(self, tables):
+        self.tables = tables
+
+    @classmethod
+    def build(cls, df):
+        """Aggregate the row-level frame into cube tables"""
+        dims = _dimension_frame(df)
+        dim_columns = list(DIMENSIONS.values())
+        tables = {}
+
+        for outcome_var in data_processing.OUTCOME_VARS:
+            if outcome_var not in df.columns or 'Total_income' not in df.columns:
+                continue
+            keys = dims.assign(**{outcome_var: df[outcome_var]})
+            # Rows Chart 1 drops: missing outcome or income
+            keys = keys[keys[outcome_var].notna() & keys['Total_income'].notna()]
+            by = dim_columns + ([] if outcome_var in dim_columns else [outcome_var])
+            tables[_chart1_table(outcome_var)] = _aggregate(keys, by)
+
+        chart3_columns = ['Food_security', 'Mental_health_state', 'Immigrant']
+        if all(c in df.columns for c in chart3_columns):
+            scores = df['Mental_health_state'].map(data_processing.MENTAL_HEALTH_SCORES).astype(float)
+            keys = dims.assign(Food_security=df['Food_security'], Mental_health_score=scores)
+            keys = keys[keys['Food_security'].notna() & keys['Mental_health_score'].notna() & keys['Immigrant'].notna()]
+            tables[CHART3_TABLE] = _aggregate(keys, dim_columns + ['Food_security'], 'Mental_health_score')
+            keys = keys.assign(Mental_health_state=df['Mental_health_state'])
+            tables[CHART3_SCORES_TABLE] = _aggregate(keys, dim_columns + ['Food_security', 'Mental_health_state'])
+
+        return cls(tables)
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+    @staticmethod
+    def path_for(cache_path):
+        return os.path.join(cache_path, f'cube-v{CUBE_VERSION}')
+
+    def save(self, cache_path):
+        """Persist the tables next to the dataset cache, labels stored as plain strings"""
+        root = self.path_for(cache_path)
+        for name, table in self.tables.items():
+            if not storage.read_manifest(os.path.join(root, name)):
+                storage.write_table(data_processing.materialize_labels(table), os.path.join(root, name))
+
+    @classmethod
+    def load(cls, cache_path, like=None):
+        """Read persisted tables, or None if any is missing.
+
+        ``like`` is the row-level frame the app serves; its categorical
+        dtypes are applied to the cube so roll-ups sort the same way.
+        """
+        root = cls.path_for(cache_path)
+        names = [_chart1_table(v) for v in data_processing.OUTCOME_VARS] + [CHART3_TABLE, CHART3_SCORES_TABLE]
+        tables = {}
+        for name in names:
+            path = os.path.join(root, name)
+            if not storage.read_manifest(path):
+                return None
+            table = storage.read_table(path)
+            if like is not None:
+                for column in table.columns:
+                    if column in like.columns and isinstance(like[column].dtype, pd.CategoricalDtype):
+                        table[column] = table[column].astype(like[column].dtype)
+            tables[name] = table
+        return cls(tables)
+
+    @classmethod
+    def load_or_build(cls, df, cache_path=None):
+        """Persisted cube if present, else build it from ``df`` (and persist when a cache exists)"""
+        if cache_path:
+            cube = cls.load(cache_path, like=df)
+            if cube is not None:
+                return cube
+        cube = cls.build(df)
+        if cache_path:
+            try:
+                cube.save(cache_path)
+            except OSError:
+                pass
+        return cube
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+    def has(self, outcome_var=None):
+        name = CHART3_TABLE if outcome_var is None else _chart1_table(outcome_var)
+        return name in self.tables
+
+    def rollup(self, name, filters, by, measures):
+        """Sum ``measures`` by ``by`` over cube cells matching the sidebar ``filters``"""
+        table = self.tables[name]
+        mask = np.ones(len(table), dtype=bool)
+        for filter_name, value in filters.items():
+            if not value or value == 'All':
+                continue
+            if filter_name == 'age_group' and value not in data_processing.AGE_GROUPS:
+                continue
+            mask &= (table[DIMENSIONS[filter_name]] == value).to_numpy()
+
+        cells = table[mask]
+        if by:
+            return cells.groupby(by, observed=True)[measures].sum().reset_index()
+        return cells[measures].sum()
+
+    def chart1(self, province, age_group, gender, income, immigrant, aboriginal, outcome_var):
+        """Respondent count by ``outcome_var`` x Total_income, as update_chart1 plots it"""
+        filters = dict(zip(FILTER_NAMES, (province, age_group, gender, income, immigrant, aboriginal)))
+        return self.rollup(_chart1_table(outcome_var), filters, [outcome_var, 'Total_income'], ['count'])
+
+    def chart3(self, province, age_group, gender, income, immigrant, aboriginal):
+        """Mean mental-health score and respondent count by Food_security x Immigrant, as update_chart3 plots it"""
+        filters = dict(zip(FILTER_NAMES, (province, age_group, gender, income, immigrant, aboriginal)))
+        cells = self.rollup(CHART3_TABLE, filters, ['Food_security', 'Immigrant'], ['count', 'sum'])
+        return pd.DataFrame({
+            'Food_security': cells['Food_security'],
+            'Immigrant': cells['Immigrant'],
+            'avg_score': cells['sum'] / cells['count'],
+            'respondent_count': cells['count'],
+        })
+
+    def chart3_scores(self, province, age_group, gender, income, immigrant, aboriginal):
+        """Respondents per Food_security x Immigrant x Mental_health_state"""
+        filters = dict(zip(FILTER_NAMES, (province, age_group, gender, income, immigrant, aboriginal)))
+        by = ['Food_security', 'Immigrant', 'Mental_health_state']
+        return self.rollup(CHART3_SCORES_TABLE, filters, by, ['count'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the Chart 1 / Chart 3 aggregate cube next to the dataset cache.')
+    parser.parse_args()
+
+    frame = data_processing.load_data()
+    cube = AggregateCube.build(frame)
+    cube.save(data_processing.cache_dir())
+    cells = sum(len(t) for t in cube.tables.values())
+    print(f"✅ Cube ready: {len(cube.tables)} tables, {cells:,} cells from {len(frame):,} rows")
@@ -1,5 +1,17 @@
-import pandas as pd
+import argparse
+import hashlib
+import json
 import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+# Import local modules (works both as script and module)
+try:
+    from . import storage
+except ImportError:
+    import storage
 
 # Encoding mappings for categorical variables
 PROVINCE_MAP = {
@@ -94,31 +106,105 @@ WORK_STRESS_MAP = {
 }
 
 
-def load_data():
-    """Load and return cleaned health survey data with decoded labels"""
-    # Get current directory
-    current_dir = os.path.dirname(__file__)
-    data_path = os.path.join(current_dir, '..', 'data', 'raw', 'health_dataset.csv')
+# Chart 3 scores mental health on its original 1 (Excellent) - 5 (Poor) scale
+MENTAL_HEALTH_SCORES = {label: code for code, label in MENTAL_HEALTH_MAP.items()}
+
+# Columns decoded through the maps above
+CODE_MAPS = {
+    'Province': PROVINCE_MAP,
+    'Gender': GENDER_MAP,
+    'Gen_health_state': GEN_HEALTH_MAP,
+    'Mental_health_state': MENTAL_HEALTH_MAP,
+    'Stress_level': STRESS_LEVEL_MAP,
+    'Total_income': INCOME_MAP,
+    'Immigrant': IMMIGRANT_MAP,
+    'Aboriginal_identity': ABORIGINAL_MAP,
+    'Food_security': FOOD_SECURITY_MAP,
+    'Sense_belonging': SENSE_BELONGING_MAP,
+    'Work_stress': WORK_STRESS_MAP,
+}
 
-    # Load the dataset
-    df = pd.read_csv(data_path)
+YES_NO_FIELDS = [
+    'Sleep_apnea', 'High_BP', 'High_cholesterol', 'Diabetic',
+    'Fatigue_syndrome', 'Mood_disorder', 'Anxiety_disorder',
+    'Respiratory_chronic_con', 'Musculoskeletal_con', 'Cardiovascular_con'
+]
+
+# Coded columns whose map order is meaningful (kept as ordered categoricals in compact mode)
+ORDERED_COLUMNS = [
+    'Gen_health_state', 'Mental_health_state', 'Stress_level', 'Total_income',
+    'Food_security', 'Sense_belonging', 'Work_stress'
+]
+
+# Sidebar filter name -> column it filters on (age is bucketed separately)
+FILTER_COLUMNS = {
+    'province': 'Province',
+    'gender': 'Gender',
+    'income': 'Total_income',
+    'immigrant': 'Immigrant',
+    'aboriginal': 'Aboriginal_identity',
+}
 
+# Age Group dropdown value -> inclusive (min, max) age, None meaning open-ended
+AGE_GROUPS = {
+    '12-19': (12, 19),
+    '20-34': (20, 34),
+    '35-49': (35, 49),
+    '50-64': (50, 64),
+    '65+': (65, None),
+}
+
+# Variable toggles in the sidebar
+OUTCOME_VARS = [
+    'Gen_health_state',
+    'Mental_health_state',
+    'Stress_level',
+    'Health_utility_index',
+    'Life_satisfaction'
+]
+
+BEHAVIOR_VARS = [
+    'Total_physical_act_time',
+    'Physical_vigorous_act_time',
+    'Fruit_veg_con',
+    'Work_hours'
+]
+
+# Common candidate names for Health_utility_index in raw health datasets
+HUI_CANDIDATES = [
+    'Health_utility_indx',
+    'HUI', 'hui', 'HUI_index', 'hui_index',
+    'HUI3', 'hui3',
+    'Health_utility', 'health_utility',
+    'HealthUtilityIndex', 'healthutilityindex',
+    'Health_Utility_Index', 'health_utility_index',
+    'Health utility index', 'health utility index',
+    'Utility_index', 'utility_index',
+]
+
+# Rows missing any of these are dropped
+REQUIRED_COLUMNS = ['Province', 'Gender', 'Gen_health_state']
+
+# Bump when the decoding logic changes so existing caches are rebuilt
+CACHE_VERSION = 2
+
+# HEALTH_DASH_DATA_DIR points the app (and the benchmarks) at another raw/ + processed/ tree
+DATA_DIR = os.environ.get('HEALTH_DASH_DATA_DIR', os.path.join(os.path.dirname(__file__), '..', 'data'))
+RAW_DATA_PATH = os.path.join(DATA_DIR, 'raw', 'health_dataset.csv')
+PROCESSED_CSV_PATH = os.path.join(DATA_DIR, 'processed', 'clean_health_data.csv')
+CACHE_ROOT = os.path.join(DATA_DIR, 'processed', 'cache')
+
+# HEALTH_DASH_TABLE loads a table written by ``python -m src.ingest`` instead of the raw CSV cache
+TABLE_PATH = os.environ.get('HEALTH_DASH_TABLE')
+
+
+def decode_raw(df):
+    """Rename, decode and clean a raw survey frame"""
     # ------------------------------------------------------------------
     # Ensure Health_utility_index exists (rename from raw column if needed)
     # ------------------------------------------------------------------
     if 'Health_utility_index' not in df.columns:
-        # Common candidate names in raw health datasets
-        candidates = [
-            'Health_utility_indx',
-            'HUI', 'hui', 'HUI_index', 'hui_index',
-            'HUI3', 'hui3',
-            'Health_utility', 'health_utility',
-            'HealthUtilityIndex', 'healthutilityindex',
-            'Health_Utility_Index', 'health_utility_index',
-            'Health utility index', 'health utility index',
-            'Utility_index', 'utility_index',
-        ]
-        found = next((c for c in candidates if c in df.columns), None)
+        found = next((c for c in HUI_CANDIDATES if c in df.columns), None)
 
         if found is not None:
             df = df.rename(columns={found: 'Health_utility_index'})
@@ -128,72 +214,248 @@ def load_data():
             df['Health_utility_index'] = pd.NA
 
     # Apply mappings to convert codes to labels
-    if 'Province' in df.columns:
-        df['Province'] = df['Province'].map(PROVINCE_MAP)
+    for column, mapping in CODE_MAPS.items():
+        if column in df.columns:
+            df[column] = df[column].map(mapping)
 
-    if 'Gender' in df.columns:
-        df['Gender'] = df['Gender'].map(GENDER_MAP)
+    # Map Yes/No fields
+    for field in YES_NO_FIELDS:
+        if field in df.columns:
+            df[field] = df[field].map(YES_NO_MAP)
 
-    if 'Gen_health_state' in df.columns:
-        df['Gen_health_state'] = df['Gen_health_state'].map(GEN_HEALTH_MAP)
+    # Basic cleaning - keep only essential filters non-null
+    df = df.dropna(subset=REQUIRED_COLUMNS)
 
-    if 'Mental_health_state' in df.columns:
-        df['Mental_health_state'] = df['Mental_health_state'].map(MENTAL_HEALTH_MAP)
+    return df
 
-    if 'Stress_level' in df.columns:
-        df['Stress_level'] = df['Stress_level'].map(STRESS_LEVEL_MAP)
 
-    if 'Total_income' in df.columns:
-        df['Total_income'] = df['Total_income'].map(INCOME_MAP)
+def maps_digest():
+    """Hash of the decoding tables, part of the cache key"""
+    payload = {
+        'version': CACHE_VERSION,
+        'code_maps': {col: sorted(m.items()) for col, m in CODE_MAPS.items()},
+        'yes_no_map': sorted(YES_NO_MAP.items()),
+        'yes_no_fields': YES_NO_FIELDS,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def raw_digest(raw_path=RAW_DATA_PATH, cache_root=CACHE_ROOT):
+    """Hash of the raw CSV, reusing the last result while size and mtime are unchanged"""
+    stat = os.stat(raw_path)
+    stamp_path = os.path.join(cache_root, 'raw_stat.json')
+    stamp = {'path': os.path.abspath(raw_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    try:
+        with open(stamp_path) as fh:
+            saved = json.load(fh)
+        if {k: saved.get(k) for k in stamp} == stamp:
+            return saved['sha256']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    stamp['sha256'] = storage.file_digest(raw_path)
+    try:
+        os.makedirs(cache_root, exist_ok=True)
+        with open(stamp_path, 'w') as fh:
+            json.dump(stamp, fh)
+    except OSError:
+        pass
+    return stamp['sha256']
+
+
+def cache_key(raw_path=RAW_DATA_PATH, cache_root=CACHE_ROOT):
+    """Cache key combining the raw file hash and the mapping tables"""
+    combined = f'{raw_digest(raw_path, cache_root)}:{maps_digest()}'
+    return hashlib.sha256(combined.encode()).hexdigest()[:16]
+
+
+def _find_cache(raw_path, cache_root):
+    """Return the directory of a usable cache, or None"""
+    if os.path.exists(raw_path):
+        path = os.path.join(cache_root, cache_key(raw_path, cache_root))
+        return path if storage.read_manifest(path) else None
+
+    # No raw file (e.g. a deploy that only ships the cache): accept the newest
+    # cache built with the current mapping tables.
+    if not os.path.isdir(cache_root):
+        return None
+    candidates = []
+    for name in os.listdir(cache_root):
+        path = os.path.join(cache_root, name)
+        manifest = storage.read_manifest(path)
+        if manifest and manifest['metadata'].get('maps_digest') == maps_digest():
+            candidates.append((os.path.getmtime(path), path))
+    return max(candidates)[1] if candidates else None
+
+
+def cache_dir():
+    """Directory of the binary cache ``load_data`` reads from, or None if it has not been built"""
+    if TABLE_PATH:
+        return TABLE_PATH if storage.read_manifest(TABLE_PATH) else None
+    return _find_cache(RAW_DATA_PATH, CACHE_ROOT)
+
+
+def build_cache(raw_path=RAW_DATA_PATH, cache_root=CACHE_ROOT, force=False):
+    """Decode the raw CSV into the binary cache and return the cache directory"""
+    key = cache_key(raw_path, cache_root)
+    path = os.path.join(cache_root, key)
+    if force and os.path.isdir(path):
+        shutil.rmtree(path)
+    if storage.read_manifest(path):
+        return path
+
+    df = decode_raw(pd.read_csv(raw_path))
 
-    if 'Immigrant' in df.columns:
-        df['Immigrant'] = df['Immigrant'].map(IMMIGRANT_MAP)
+    # Save processed data
+    os.makedirs(os.path.dirname(PROCESSED_CSV_PATH), exist_ok=True)
+    df.to_csv(PROCESSED_CSV_PATH, index=False)
+
+    metadata = {'raw_sha256': raw_digest(raw_path, cache_root), 'maps_digest': maps_digest(),
+                'filter_options': get_filter_options(df)}
+    # Store label codes in map order so compact loads need no recoding
+    label_orders = {column: (dtype.categories.tolist(), dtype.ordered) for column, dtype in compact_dtypes().items()}
+    storage.write_table(df.reset_index(drop=True), path, metadata=metadata, label_orders=label_orders)
+
+    # Drop caches built from older raw files or maps
+    for name in os.listdir(cache_root):
+        stale = os.path.join(cache_root, name)
+        if name != key and os.path.isdir(stale) and not name.startswith('.tmp-'):
+            shutil.rmtree(stale, ignore_errors=True)
+
+    return path
+
+
+def compact_dtypes():
+    """Categorical dtype of every coded column, with categories in map order"""
+    coded = dict(CODE_MAPS, **{field: YES_NO_MAP for field in YES_NO_FIELDS})
+    return {
+        column: pd.CategoricalDtype(list(mapping.values()), ordered=column in ORDERED_COLUMNS)
+        for column, mapping in coded.items()
+    }
+
+
+def to_compact(df, downcast=True):
+    """Return ``df`` with coded columns as categoricals in map order and numeric columns downcast.
+
+    Columns that already have their compact dtype are kept as they are
+    (not copied); ``downcast=False`` leaves numeric columns untouched.
+    """
+    df = df.copy(deep=False)
+    dtypes = compact_dtypes()
+
+    for column in df.columns:
+        if column in dtypes:
+            dtype = dtypes[column]
+            if df[column].dtype == dtype:
+                continue
+            if isinstance(df[column].dtype, pd.CategoricalDtype):
+                df[column] = df[column].cat.set_categories(dtype.categories, ordered=dtype.ordered)
+            else:
+                df[column] = df[column].astype(dtype)
+        elif not downcast:
+            continue
+        elif pd.api.types.is_integer_dtype(df[column].dtype):
+            df[column] = pd.to_numeric(df[column], downcast='integer')
+        elif pd.api.types.is_float_dtype(df[column].dtype):
+            # Only downcast when float32 round-trips exactly, so tooltips don't show float noise
+            narrow = df[column].astype('float32')
+            if narrow.astype(df[column].dtype).equals(df[column]):
+                df[column] = narrow
 
-    if 'Aboriginal_identity' in df.columns:
-        df['Aboriginal_identity'] = df['Aboriginal_identity'].map(ABORIGINAL_MAP)
+    return df
 
-    if 'Food_security' in df.columns:
-        df['Food_security'] = df['Food_security'].map(FOOD_SECURITY_MAP)
 
-    if 'Sense_belonging' in df.columns:
-        df['Sense_belonging'] = df['Sense_belonging'].map(SENSE_BELONGING_MAP)
+def label_codes(values, labels):
+    """Position of each value in ``labels`` (-1 when missing or unknown), without comparing strings row by row"""
+    lookup = pd.Index(labels)
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Recode the categories, not the rows
+        recode = np.append(lookup.get_indexer(values.cat.categories), -1)
+        return recode[values.cat.codes.to_numpy()]
+    return lookup.get_indexer(values)
 
-    if 'Work_stress' in df.columns:
-        df['Work_stress'] = df['Work_stress'].map(WORK_STRESS_MAP)
 
-    # Map Yes/No fields
-    yes_no_fields = [
-        'Sleep_apnea', 'High_BP', 'High_cholesterol', 'Diabetic',
-        'Fatigue_syndrome', 'Mood_disorder', 'Anxiety_disorder',
-        'Respiratory_chronic_con', 'Musculoskeletal_con', 'Cardiovascular_con'
-    ]
+def materialize_labels(df):
+    """Turn categorical columns back into plain labels, for small frames about to be rendered"""
+    df = df.copy()
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype(object)
+    return df
 
-    for field in yes_no_fields:
-        if field in df.columns:
-            df[field] = df[field].map(YES_NO_MAP)
 
-    # Basic cleaning - keep only essential filters non-null
-    df = df.dropna(subset=['Province', 'Gender', 'Gen_health_state'])
+def load_data(use_cache=True, compact=False, mmap=False):
+    """Load and return cleaned health survey data with decoded labels.
 
-    # Save processed data
-    processed_path = os.path.join(current_dir, '..', 'data', 'processed', 'clean_health_data.csv')
-    os.makedirs(os.path.dirname(processed_path), exist_ok=True)
-    df.to_csv(processed_path, index=False)
+    With ``compact=True`` coded columns stay as ``pd.Categorical`` (small-int
+    codes ordered like the maps) and numeric columns are downcast.
+
+    With ``mmap=True`` (implies ``compact``) the cached column files are
+    memory-mapped read-only and used as they are, so every process loading
+    the same cache shares one copy of the data through the page cache.
+    """
+    if not use_cache:
+        df = decode_raw(pd.read_csv(RAW_DATA_PATH))
+        return to_compact(df) if compact or mmap else df
+
+    path = TABLE_PATH or _find_cache(RAW_DATA_PATH, CACHE_ROOT)
+    if path is None:
+        path = build_cache(RAW_DATA_PATH, CACHE_ROOT)
+
+    if mmap:
+        return to_compact(storage.read_table(path, mmap_mode='r', labels_as_categorical=True), downcast=False)
+    if compact:
+        return to_compact(storage.read_table(path, labels_as_categorical=True))
+    return storage.read_table(path)
 
-    return df
+
+def age_group_mask(ages, age_group):
+    """Boolean mask of ``ages`` falling in an ``AGE_GROUPS`` bucket"""
+    low, high = AGE_GROUPS[age_group]
+    mask = ages >= low
+    if high is not None:
+        mask &= ages <= high
+    return mask
+
+
+def age_group_labels(ages):
+    """``AGE_GROUPS`` bucket label per age, None outside every bucket"""
+    ages = pd.Series(ages).to_numpy()
+    labels = np.full(len(ages), None, dtype=object)
+    for group in AGE_GROUPS:
+        labels[age_group_mask(ages, group)] = group
+    return labels
 
 
 def get_filter_options(df):
     """Get unique values for filter dropdowns"""
+    present = {
+        column: set(df[column].dropna().unique().tolist())
+        for column in FILTER_COLUMNS.values() if column in df.columns
+    }
+    age_range = None
+    if 'Age' in df.columns:
+        age_values = df['Age'].dropna()
+        age_range = (age_values.min(), age_values.max()) if len(age_values) > 0 else ()
+    return filter_options_from(present, age_range)
+
+
+def filter_options_from(present, age_range=None):
+    """Dropdown options from the labels present in each filter column and the (min, max) age.
+
+    ``present`` maps column name to its observed labels; ``age_range`` is
+    None without an Age column and empty when every age is missing.
+    """
     options = {}
 
-    if 'Province' in df.columns:
-        options['provinces'] = ['All'] + sorted([x for x in df['Province'].dropna().unique().tolist() if pd.notna(x)])
+    if 'Province' in present:
+        options['provinces'] = ['All'] + sorted(present['Province'])
 
-    if 'Gender' in df.columns:
-        options['genders'] = ['All'] + sorted([x for x in df['Gender'].dropna().unique().tolist() if pd.notna(x)])
+    if 'Gender' in present:
+        options['genders'] = ['All'] + sorted(present['Gender'])
 
-    if 'Total_income' in df.columns:
+    if 'Total_income' in present:
         # Keep income in logical order
         income_order = [
             'Less than $20,000',
@@ -204,46 +466,73 @@ def get_filter_options(df):
             '$100,000 to $149,999',
             '$150,000 or more'
         ]
-        available_incomes = [x for x in income_order if x in df['Total_income'].values]
+        available_incomes = [x for x in income_order if x in present['Total_income']]
         options['incomes'] = ['All'] + available_incomes
 
-    if 'Immigrant' in df.columns:
-        options['immigrant'] = ['All'] + sorted([x for x in df['Immigrant'].dropna().unique().tolist() if pd.notna(x)])
+    if 'Immigrant' in present:
+        options['immigrant'] = ['All'] + sorted(present['Immigrant'])
 
-    if 'Aboriginal_identity' in df.columns:
-        options['aboriginal'] = ['All'] + sorted([x for x in df['Aboriginal_identity'].dropna().unique().tolist() if pd.notna(x)])
+    if 'Aboriginal_identity' in present:
+        options['aboriginal'] = ['All'] + sorted(present['Aboriginal_identity'])
 
     # Age range
-    if 'Age' in df.columns:
-        age_values = df['Age'].dropna()
-        if len(age_values) > 0:
-            options['age_min'] = int(age_values.min())
-            options['age_max'] = int(age_values.max())
+    if age_range is not None:
+        if len(age_range) > 0:
+            options['age_min'] = int(age_range[0])
+            options['age_max'] = int(age_range[1])
         else:
             options['age_min'] = 12
             options['age_max'] = 80
 
     # Outcome variables
-    options['outcome_vars'] = [
-        'Gen_health_state',
-        'Mental_health_state',
-        'Stress_level',
-        'Health_utility_index',
-        'Life_satisfaction'
-    ]
+    options['outcome_vars'] = list(OUTCOME_VARS)
 
     # Behavior variables
-    options['behavior_vars'] = [
-        'Total_physical_act_time',
-        'Physical_vigorous_act_time',
-        'Fruit_veg_con',
-        'Work_hours'
-    ]
+    options['behavior_vars'] = list(BEHAVIOR_VARS)
 
     return options
 
 
+def table_metadata(path):
+    """Metadata in the manifest of the table at ``path`` (empty when there is no table)"""
+    manifest = storage.read_manifest(path) if path else None
+    return manifest['metadata'] if manifest else {}
+
+
+def stored_filter_options(path):
+    """Dropdown options kept in the manifest of the table at ``path``, or None"""
+    options = table_metadata(path).get('filter_options')
+    if options is None:
+        return None
+    # The variable toggles come from the code, not the data
+    return dict(options, outcome_vars=list(OUTCOME_VARS), behavior_vars=list(BEHAVIOR_VARS))
+
+
+def table_filter_options(df, path=None):
+    """Dropdown options for ``df`` from its table's manifest; computed once and stored there when missing"""
+    options = stored_filter_options(path)
+    if options is None:
+        options = get_filter_options(df)
+        if path:
+            try:
+                storage.update_metadata(path, filter_options=options)
+            except OSError:
+                # A read-only deployment just computes them at every start
+                pass
+    return options
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load the health survey data or prebuild its binary cache.')
+    parser.add_argument('--build-cache', action='store_true', help='decode the raw CSV into the binary cache and exit')
+    parser.add_argument('--force', action='store_true', help='rebuild the cache even if it is up to date')
+    args = parser.parse_args()
+
+    if args.build_cache:
+        cache_path = build_cache(force=args.force)
+        print(f"✅ Cache ready at {os.path.normpath(cache_path)}")
+        raise SystemExit(0)
+
     # Test data loading
     print("Loading data...")
     df = load_data()
@@ -0,0 +1,367 @@
+"""Bulk aggregate export for scripted analyst workloads.
+
+A batch is a list of sidebar filter states and the columns to group by,
+e.g. the Mental_health_state distribution by income for every province:
+
+    {"states": [{"province": "*"}], "group_by": ["Total_income", "Mental_health_state"],
+     "values": ["Health_utility_index"], "format": "csv"}
+
+A state maps sidebar fields (``FILTER_NAMES``) to a value, a list of
+values or ``"*"`` (every value in the data); lists expand into one state
+per combination and missing fields are "All". Rather than filtering and
+grouping once per state, a ``Batch`` makes one grouped pass over the rows
+matching the filters every state shares, keyed by the fields that differ
+between states plus ``group_by``, and rolls each state up from those
+cells. Rows missing a ``group_by`` value are left out, as in the charts.
+A state matching no rows still gets one row, with a zero count and
+missing ``group_by`` values, so every state appears in the output.
+
+Each state's table has the six filter values, the ``group_by`` columns,
+the respondent ``count`` and, per ``values`` column, its mean and
+number of answers (``<column>_mean``, ``<column>_n``). ``POST /api/export``
+streams a batch in chunks of consecutive states as CSV or, with the
+optional ``pyarrow`` package, as an Arrow IPC stream; ``aggregate(...)``
+returns it as a frame.
+"""
+import io
+import itertools
+import math
+
+import numpy as np
+import pandas as pd
+from flask import Response
+
+# Import local modules (works both as script and module)
+try:
+    from . import data_processing, metrics
+    from .cube import AGE_BUCKET, DIMENSIONS
+    from .filter_index import FILTER_NAMES, normalize_filters
+except ImportError:
+    import data_processing
+    import metrics
+    from cube import AGE_BUCKET, DIMENSIONS
+    from filter_index import FILTER_NAMES, normalize_filters
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+ROUTE = '/api/export'
+FORMATS = {'csv': 'text/csv', 'arrow': 'application/vnd.apache.arrow.stream'}
+# Columns computed from others, usable in group_by / values
+DERIVED = {AGE_BUCKET: 'Age', 'Mental_health_score': 'Mental_health_state'}
+# Most filter states per batch (the whole sidebar space is about 18k)
+MAX_STATES = 20_000
+# Output rows per streamed chunk
+CHUNK_ROWS = 65_536
+EVERY = '*'
+
+
+class ExportError(ValueError):
+    """A batch that cannot be answered; the message says why"""
+
+
+def _column(df, column):
+    """A data column, or one of the ``DERIVED`` columns computed from it"""
+    if column == AGE_BUCKET:
+        return pd.Series(data_processing.age_group_labels(df['Age']), index=df.index)
+    if column == 'Mental_health_score':
+        return df['Mental_health_state'].map(data_processing.MENTAL_HEALTH_SCORES).astype(float)
+    return df[column]
+
+
+def _every(df, name):
+    """Values of the sidebar field ``name`` present in the data, in dropdown order"""
+    if name == 'age_group':
+        return list(data_processing.AGE_GROUPS)
+    column = DIMENSIONS[name]
+    if column not in df.columns:
+        return []
+    present = df[column].dropna().unique()
+    if isinstance(df[column].dtype, pd.CategoricalDtype):
+        present = set(present)
+        return [value for value in df[column].cat.categories if value in present]
+    return sorted(present)
+
+
+def expand(df, states):
+    """Normalized filter tuples of ``states``, lists and ``"*"`` expanded into one state per combination"""
+    if not isinstance(states, list) or not states:
+        raise ExportError('"states" must be a non-empty list of filter states')
+    expanded = []
+    for state in states:
+        if not isinstance(state, dict):
+            raise ExportError(f'filter state {state!r} is not an object')
+        unknown = sorted(set(state) - set(FILTER_NAMES))
+        if unknown:
+            raise ExportError(f'unknown filter field(s) {unknown}; expected some of {list(FILTER_NAMES)}')
+        choices = []
+        for name in FILTER_NAMES:
+            value = state.get(name)
+            if value == EVERY:
+                value = _every(df, name)
+            elif not isinstance(value, list):
+                value = [value]
+            if not all(item is None or isinstance(item, str) for item in value):
+                raise ExportError(f'values of {name!r} must be strings')
+            choices.append(value)
+        if len(expanded) + math.prod(len(values) for values in choices) > MAX_STATES:
+            raise ExportError(f'more than {MAX_STATES:,} filter states in one batch')
+        expanded += [normalize_filters(*values) for values in itertools.product(*choices)]
+    if not expanded:
+        raise ExportError('no filter states: a list of values is empty')
+    return expanded
+
+
+def _check_columns(df, columns, field, numeric=False):
+    if not isinstance(columns, (list, tuple)) or not all(isinstance(column, str) for column in columns):
+        raise ExportError(f'"{field}" must be a list of column names')
+    columns = list(columns)
+    for column in columns:
+        if column in DERIVED:
+            if DERIVED[column] not in df.columns:
+                raise ExportError(f'{column!r} needs the {DERIVED[column]!r} column')
+            if numeric and column == AGE_BUCKET:
+                raise ExportError(f'{column!r} is not numeric')
+        elif column not in df.columns:
+            raise ExportError(f'unknown column {column!r} in "{field}"')
+        elif numeric and not pd.api.types.is_numeric_dtype(df[column].dtype):
+            raise ExportError(f'{column!r} is not numeric; it can only be grouped by')
+    if len(set(columns)) != len(columns):
+        raise ExportError(f'duplicate columns in "{field}"')
+    return columns
+
+
+def _common_rows(df, common, index):
+    """Row positions matching the filters every state shares, or None when there are none"""
+    if index is not None:
+        return index.positions(*common)
+    mask = None
+    for name, value in zip(FILTER_NAMES, common):
+        if value == 'All':
+            continue
+        if name == 'age_group':
+            selected = data_processing.age_group_mask(df['Age'].to_numpy(), value) if 'Age' in df.columns else None
+        else:
+            column = DIMENSIONS[name]
+            selected = (df[column] == value).to_numpy() if column in df.columns else None
+        if selected is not None:
+            mask = selected if mask is None else mask & selected
+    return None if mask is None else np.flatnonzero(mask)
+
+
+class Batch:
+    """Cells of one grouped pass over the data, rolled up per filter state on demand"""
+
+    def __init__(self, df, states, group_by=(), values=(), index=None):
+        """``index`` is the frame's ``FilterIndex``, used to gather the rows every state shares"""
+        self.states = expand(df, states)
+        self.group_by = _check_columns(df, group_by, 'group_by')
+        self.values = _check_columns(df, values, 'values', numeric=True)
+        self.measures = ['count'] + [f'{v}_{m}' for v in self.values for m in ('sum', 'n')]
+        # Fields with one value across the batch filter the rows; the others become grouping keys
+        self.varying = [i for i in range(len(FILTER_NAMES)) if len({state[i] for state in self.states}) > 1]
+        common = tuple('All' if i in self.varying else value for i, value in enumerate(self.states[0]))
+        self.cells, self.keys, self.offsets = self._cells(df, _common_rows(df, common, index))
+        # The one row of a state matching nothing: zero counts, missing group_by values (integer columns made
+        # nullable, so the other rows keep printing as integers)
+        empty = self.cells[self.group_by + self.measures].iloc[:0]
+        nullable = {c: 'Int64' for c in self.group_by if pd.api.types.is_integer_dtype(empty[c].dtype)}
+        self._empty = empty.astype(nullable).reindex([0])
+        self._empty[self.measures] = 0
+        # Slice lookup: by key for states setting every varying field, by codes for states leaving some "All"
+        self._group_of = {key: g for g, key in enumerate(self.keys.itertuples(index=False, name=None))}
+        self._codes = []
+        for column in self.keys.columns:
+            codes, uniques = pd.factorize(self.keys[column])
+            self._codes.append((codes, {value: code for code, value in enumerate(uniques)}))
+
+    def __len__(self):
+        return len(self.states)
+
+    @property
+    def columns(self):
+        return list(FILTER_NAMES) + self.group_by + ['count'] + [f'{v}_{m}' for v in self.values for m in ('mean', 'n')]
+
+    @metrics.stage('export_cells', rows=lambda cells: len(cells[0]))
+    def _cells(self, df, rows):
+        """Measures per combination of varying fields and ``group_by``, sorted so each combination of varying
+        fields is one slice of rows (``offsets``) described by one row of ``keys``"""
+        dims = [DIMENSIONS[FILTER_NAMES[i]] for i in self.varying]
+        base = {DERIVED.get(column, column) for column in dims + self.group_by + self.values}
+        frame = df[[column for column in df.columns if column in base]]
+        if rows is not None:
+            frame = frame.take(rows)
+        # A filter on a column the data lacks matches nothing, as in the cube
+        data = {column: _column(frame, column) if DERIVED.get(column, column) in frame.columns else None
+                for column in dict.fromkeys(dims + self.group_by)}
+        data.update({f'{v}_value': _column(frame, v) for v in self.values})
+        keys = pd.DataFrame(data, index=frame.index)
+        if self.group_by:
+            keys = keys[keys[self.group_by].notna().all(axis=1).to_numpy()]
+
+        by = list(dict.fromkeys(dims + self.group_by)) or [np.zeros(len(keys), dtype=np.int8)]
+        grouped = keys.groupby(by, dropna=False, observed=True, sort=False)
+        cells = grouped.size().to_frame('count')
+        for v in self.values:
+            cells[f'{v}_sum'] = grouped[f'{v}_value'].sum()
+            cells[f'{v}_n'] = grouped[f'{v}_value'].count()
+        cells = cells.reset_index(drop=not dims and not self.group_by)
+        # Within a slice, rows come in group_by order, as the rollup's groupby would sort them
+        if self.group_by:
+            cells = cells.sort_values(self.group_by, kind='stable').reset_index(drop=True)
+
+        if not dims:
+            return cells, pd.DataFrame(index=[0]), np.array([0, len(cells)])
+        group = cells.groupby(dims, dropna=False, observed=True, sort=False).ngroup().to_numpy()
+        order = np.argsort(group, kind='stable')
+        cells = cells.take(order).reset_index(drop=True)
+        starts = np.concatenate([[0], np.cumsum(np.bincount(group))])
+        return cells, cells[dims].take(starts[:-1]).reset_index(drop=True), starts
+
+    def _groups(self, state):
+        """Slices of ``cells`` (rows of ``keys``) matching a filter state"""
+        values = tuple(state[i] for i in self.varying)
+        if not values:
+            return np.zeros(1, dtype=np.intp)
+        if 'All' not in values:
+            group = self._group_of.get(values)
+            return np.array([] if group is None else [group], dtype=np.intp)
+        selected = np.ones(len(self.keys), dtype=bool)
+        for (codes, lookup), value in zip(self._codes, values):
+            if value != 'All':
+                selected &= codes == lookup.get(value, -2)
+        return np.flatnonzero(selected)
+
+    def _part(self, state):
+        """Cells of one state: positions in ``cells`` when they need no rollup, else the rolled-up frame"""
+        groups = self._groups(state)
+        rows = np.concatenate([np.arange(self.offsets[g], self.offsets[g + 1]) for g in groups] or [groups])
+        if not len(rows):
+            return self._empty
+        # At most one combination of the varying fields: its cells are already one row per group_by combination
+        if len(groups) <= 1:
+            return rows
+        cells = self.cells.take(rows)
+        if self.group_by:
+            return cells.groupby(self.group_by, observed=True)[self.measures].sum().reset_index()
+        return cells[self.measures].sum().to_frame().T
+
+    def _table(self, states, parts):
+        """Output rows of consecutive ``states`` from their ``_part``s"""
+        frames, positions, lengths = [], [], []
+        for part in parts + [None]:
+            if isinstance(part, np.ndarray):
+                positions.append(part)
+                lengths.append(len(part))
+                continue
+            if positions:
+                frames.append(self.cells.take(np.concatenate(positions))[self.group_by + self.measures])
+                positions = []
+            if part is not None:
+                frames.append(part)
+                lengths.append(len(part))
+        table = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0].reset_index(drop=True)
+        table = table.astype({column: 'int64' for column in self.measures if not column.endswith('_sum')})
+        for v in self.values:
+            table[f'{v}_mean'] = table[f'{v}_sum'] / table[f'{v}_n']
+        for i, name in enumerate(FILTER_NAMES):
+            table[name] = np.repeat(np.array([state[i] for state in states], dtype=object), lengths)
+        return data_processing.materialize_labels(table[self.columns])
+
+    def table(self, state):
+        """Aggregates of one normalized filter state, one row per observed ``group_by`` combination.
+
+        A state matching no rows gets one row with a zero count and missing ``group_by`` values.
+        """
+        return self._table([state], [self._part(state)])
+
+    def tables(self):
+        """Tables of consecutive states, in batch order, of about ``CHUNK_ROWS`` rows each"""
+        states, parts, rows = [], [], 0
+        for state in self.states:
+            part = self._part(state)
+            states.append(state)
+            parts.append(part)
+            rows += len(part)
+            if rows >= CHUNK_ROWS:
+                yield self._table(states, parts)
+                states, parts, rows = [], [], 0
+        if states:
+            yield self._table(states, parts)
+
+    def frame(self):
+        """Every state's table in one frame"""
+        return pd.concat(self.tables(), ignore_index=True)
+
+    def csv(self):
+        """The batch as CSV text chunks"""
+        for i, table in enumerate(self.tables()):
+            yield table.to_csv(index=False, header=i == 0)
+
+    def arrow_schema(self):
+        fields = [(name, pyarrow.string()) for name in FILTER_NAMES]
+        for column in self.group_by:
+            dtype = self.cells[column].dtype
+            if isinstance(dtype, pd.CategoricalDtype) or not pd.api.types.is_numeric_dtype(dtype):
+                fields.append((column, pyarrow.string()))
+            else:
+                fields.append((column, pyarrow.from_numpy_dtype(dtype)))
+        fields.append(('count', pyarrow.int64()))
+        for v in self.values:
+            fields += [(f'{v}_mean', pyarrow.float64()), (f'{v}_n', pyarrow.int64())]
+        return pyarrow.schema(fields)
+
+    def arrow(self):
+        """The batch as an Arrow IPC stream, one record batch per table of ``tables()``"""
+        if pyarrow is None:
+            raise ExportError('Arrow output needs the optional pyarrow package')
+        schema = self.arrow_schema()
+        sink = io.BytesIO()
+        with pyarrow.ipc.new_stream(sink, schema) as writer:
+            for table in self.tables():
+                writer.write_batch(pyarrow.RecordBatch.from_pandas(table, schema=schema, preserve_index=False))
+                yield _drain(sink)
+        yield _drain(sink)
+
+
+def _drain(sink):
+    data = sink.getvalue()
+    sink.seek(0)
+    sink.truncate()
+    return data
+
+
+def aggregate(states, group_by=(), values=(), df=None, index=None):
+    """Every state's aggregates as one frame; loads the survey data when no ``df`` is given"""
+    if df is None:
+        df = data_processing.load_data()
+    return Batch(df, states, group_by, values, index).frame()
+
+
+def parse(body, accept=None):
+    """``(Batch arguments, format)`` of a request body; the format defaults to what ``accept`` prefers"""
+    if not isinstance(body, dict):
+        raise ExportError('expected a JSON object with "states" and optionally "group_by", "values", "format"')
+    unknown = sorted(set(body) - {'states', 'group_by', 'values', 'format'})
+    if unknown:
+        raise ExportError(f'unknown field(s) {unknown}')
+    fmt = body.get('format')
+    if fmt is None:
+        fmt = 'arrow' if accept is not None and accept.best_match(list(FORMATS.values())) == FORMATS['arrow'] else 'csv'
+    if fmt not in FORMATS:
+        raise ExportError(f'unknown format {fmt!r}; expected one of {list(FORMATS)}')
+    if fmt == 'arrow' and pyarrow is None:
+        raise ExportError('Arrow output needs the optional pyarrow package')
+    arguments = {'states': body.get('states'), 'group_by': body.get('group_by', []), 'values': body.get('values', [])}
+    return arguments, fmt
+
+
+def response(batch, fmt):
+    """Streaming response of a batch in ``fmt``"""
+    metrics.EXPORT_STATES.inc(fmt, len(batch))
+    chunks = batch.csv() if fmt == 'csv' else batch.arrow()
+    extension = 'csv' if fmt == 'csv' else 'arrows'
+    return Response(chunks, mimetype=FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename=export.{extension}'})
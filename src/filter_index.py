@@ -0,0 +1,91 @@
+"""Packed bitmap index over the six global sidebar filters.
+
+Built once per loaded frame. A filter state resolves to one AND over the
+selected bitmaps followed by a single ``take`` of the matching row
+positions, instead of chaining boolean-mask copies of the whole frame.
+"""
+import numpy as np
+import pandas as pd
+
+# Import local modules (works both as script and module)
+try:
+    from . import data_processing
+except ImportError:
+    import data_processing
+
+FILTER_NAMES = ('province', 'age_group', 'gender', 'income', 'immigrant', 'aboriginal')
+
+
+def normalize_filters(province, age_group, gender, income, immigrant, aboriginal):
+    """Canonical filter tuple: empty values become "All" and unknown age buckets are ignored"""
+    values = [value if value else 'All' for value in (province, age_group, gender, income, immigrant, aboriginal)]
+    if values[1] not in data_processing.AGE_GROUPS:
+        values[1] = 'All'
+    return tuple(values)
+
+
+class FilterIndex:
+    """One ``np.packbits`` bitmap per value of each sidebar filter"""
+
+    def __init__(self, df):
+        self.n_rows = len(df)
+        self._bitmaps = {}
+
+        for name, column in data_processing.FILTER_COLUMNS.items():
+            if column not in df.columns:
+                continue
+            codes, uniques = pd.factorize(df[column])
+            self._bitmaps[name] = {
+                value: np.packbits(codes == i) for i, value in enumerate(uniques.tolist())
+            }
+
+        if 'Age' in df.columns:
+            ages = df['Age'].to_numpy()
+            self._bitmaps['age_group'] = {
+                group: np.packbits(data_processing.age_group_mask(ages, group))
+                for group in data_processing.AGE_GROUPS
+            }
+
+        self._empty = np.zeros((self.n_rows + 7) // 8, dtype=np.uint8)
+
+        # Bitmaps are built before gunicorn forks; read-only keeps them shared copy-on-write
+        for values in self._bitmaps.values():
+            for bitmap in values.values():
+                bitmap.flags.writeable = False
+        self._empty.flags.writeable = False
+
+    @property
+    def nbytes(self):
+        """Memory held by the bitmaps"""
+        return sum(b.nbytes for values in self._bitmaps.values() for b in values.values())
+
+    def _selected(self, filters):
+        """Bitmaps for the active (non-"All") filters"""
+        selected = []
+        for name, value in filters.items():
+            if not value or value == 'All' or name not in self._bitmaps:
+                continue
+            if name == 'age_group' and value not in data_processing.AGE_GROUPS:
+                # Unknown age buckets are ignored, as in the sidebar's age dropdown
+                continue
+            selected.append(self._bitmaps[name].get(value, self._empty))
+        return selected
+
+    def positions(self, province, age_group, gender, income, immigrant, aboriginal):
+        """Row positions matching the filter state, or None when no filter is active"""
+        selected = self._selected(dict(zip(FILTER_NAMES, (province, age_group, gender, income, immigrant, aboriginal))))
+        if not selected:
+            return None
+
+        combined = selected[0].copy()
+        for bitmap in selected[1:]:
+            np.bitwise_and(combined, bitmap, out=combined)
+        rows = np.flatnonzero(np.unpackbits(combined, count=self.n_rows))
+        return rows.astype(np.int32) if self.n_rows < np.iinfo(np.int32).max else rows
+
+    def take(self, df, province, age_group, gender, income, immigrant, aboriginal):
+        """Rows of ``df`` matching the filter state; ``df`` itself when nothing is filtered"""
+        rows = self.positions(province, age_group, gender, income, immigrant, aboriginal)
+        if rows is None:
+            return df
+        return df.take(rows)
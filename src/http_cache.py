@@ -0,0 +1,162 @@
+"""HTTP caching and compression of chart responses.
+
+Dash answers every chart update with a freshly built spec through
+``POST /_dash-update-component``, even for a filter state it has already
+served. ``register`` hooks the Flask server so that a request for one of
+the cacheable outputs is keyed by a hash of what determines its answer
+(the output, its input and state values, which input changed) and of a
+version string (dataset, code and settings). The first response for a key
+is compressed once and kept in a byte cache; repeats are answered from
+it before Dash runs the callback.
+
+Bodies are stored gzip-compressed, plus brotli when the optional
+``brotli`` package is installed, and sent in the best encoding the
+client accepts. Responses also carry an ``ETag`` (the key) and
+``Cache-Control``, and a request whose ``If-None-Match`` matches gets
+``304 Not Modified``. Browsers never send ``If-None-Match`` on these
+POST requests, though, so for the dashboard itself only the server-side
+byte cache takes effect; the 304 path serves only clients that set the
+header themselves (scripts replaying callback requests).
+"""
+import gzip
+import hashlib
+import json
+import os
+
+import dash
+from flask import Response, g, has_request_context, request
+
+# Import local modules (works both as script and module)
+try:
+    from . import metrics
+    from .result_cache import ResultCache
+except ImportError:
+    import metrics
+    from result_cache import ResultCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ROUTE = '/_dash-update-component'
+CACHE_CONTROL = 'private, no-cache'
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 9
+
+
+def digest(*parts):
+    """Short, stable hash of JSON-serialisable ``parts``"""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def code_version(directory):
+    """Hash of the ``.py`` sources in ``directory`` and the Dash version: responses change with the code"""
+    sha = hashlib.sha256(dash.__version__.encode())
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.py'):
+            with open(os.path.join(directory, name), 'rb') as fh:
+                sha.update(name.encode() + fh.read())
+    return sha.hexdigest()[:16]
+
+
+def request_key(body, version, ignore_state=(), ignore_inputs=()):
+    """Cache key of a callback request: everything in the body the callback's answer depends on.
+
+    State and Input components in ``ignore_state`` / ``ignore_inputs`` (ids) do not change the answer
+    and are left out (an ignored Input still counts when it is the one that fired).
+    """
+    relevant = {
+        'output': body.get('output'),
+        'inputs': [item for item in body.get('inputs') or [] if item.get('id') not in ignore_inputs],
+        'state': [item for item in body.get('state') or [] if item.get('id') not in ignore_state],
+        'changed': sorted(body.get('changedPropIds') or []),
+    }
+    payload = json.dumps([version, relevant], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def compress(body):
+    """``(gzip, brotli or None)`` encodings of a response body"""
+    return (gzip.compress(body, compresslevel=GZIP_LEVEL),
+            brotli.compress(body, quality=BROTLI_QUALITY) if brotli is not None else None)
+
+
+def _accepts(encoding):
+    return request.accept_encodings[encoding] > 0
+
+
+def encode(response, entry, etag):
+    """Put the stored body into ``response`` in the best encoding the client accepts"""
+    gzipped, brotlied = entry
+    # Uncompressed size (the gzip trailer's ISIZE), for the response-size metric
+    g.response_bytes = int.from_bytes(gzipped[-4:], 'little')
+    if brotlied is not None and _accepts('br'):
+        response.set_data(brotlied)
+        response.headers['Content-Encoding'] = 'br'
+    elif _accepts('gzip'):
+        response.set_data(gzipped)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response.set_data(gzip.decompress(gzipped))
+    return _cache_headers(response, etag)
+
+
+def _cache_headers(response, etag):
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def skip():
+    """Keep the response of the current request out of the cache (e.g. a provisional answer)"""
+    if has_request_context():
+        g.pop('http_cache_key', None)
+
+
+def register(server, outputs, version, max_bytes=64 * 1024 * 1024, ignore_state=(), ignore_inputs=()):
+    """Serve the Dash callbacks for ``outputs`` (e.g. ``"chart1.spec"``) from a compressed byte cache.
+
+    ``version()`` returns the string that invalidates every entry when it
+    changes, or None while responses must not be cached (e.g. before the
+    data is loaded). ``ignore_state`` and ``ignore_inputs`` list ids of
+    State and Input components that do not affect the response. Returns the ``ResultCache`` holding the bodies.
+    """
+    outputs = set(outputs)
+    cache = ResultCache(max_bytes=max_bytes)
+
+    @server.before_request
+    def serve_cached_response():
+        if request.method != 'POST' or not request.path.endswith(ROUTE):
+            return None
+        body = request.get_json(silent=True) or {}
+        current = version()
+        if body.get('output') not in outputs or current is None:
+            return None
+
+        key = request_key(body, current, ignore_state, ignore_inputs)
+        # The key is content-addressed, so a client holding it has the current body even after eviction
+        if request.if_none_match.contains(key):
+            metrics.HTTP_CACHE_REQUESTS.inc('not_modified')
+            return _cache_headers(Response(status=304), key)
+        entry = cache.get(key)
+        if entry is None:
+            metrics.HTTP_CACHE_REQUESTS.inc('miss')
+            g.http_cache_key = key
+            return None
+        metrics.HTTP_CACHE_REQUESTS.inc('hit')
+        return encode(Response(mimetype='application/json'), entry, key)
+
+    @server.after_request
+    def store_response(response):
+        key = g.pop('http_cache_key', None)
+        # PreventUpdate answers 204 and errors 500: only real answers are kept
+        if key is None or response.status_code != 200 or response.direct_passthrough:
+            return response
+        entry = compress(response.get_data())
+        cache.put(key, entry)
+        return encode(response, entry, key)
+
+    return cache
@@ -0,0 +1,207 @@
+"""Streaming ingestion of raw survey CSVs into the binary column store.
+
+Each file is read in chunks of ``chunk_rows`` rows, only for the columns
+the dashboard uses (``DASHBOARD_COLUMNS``), with every column read as
+float64 up front instead of inferred. Coded columns are decoded per chunk
+straight to category codes in map order, rows missing a required column
+are dropped, and the chunk is appended to a ``storage.TableWriter``, so
+memory stays bounded by the chunk size whatever the size of the input.
+Several files (survey cycles, provincial supplements) are concatenated in
+the order given, optionally ingested in parallel by a process pool.
+``cycles`` labels each file's rows in a ``Cycle`` column, and
+``partition_by`` writes a table partitioned by Province (and Cycle, see
+``partitions.py``) instead of a single table.
+
+    python -m src.ingest data/raw/cchs_2017.csv data/raw/cchs_2019.csv --workers 2
+    HEALTH_DASH_TABLE=data/processed/ingested python src/app.py
+
+    python -m src.ingest data/raw/cchs_2017.csv data/raw/cchs_2019.csv --cycles 2017 2019 \
+        --partition-by Province Cycle --out data/processed/partitioned
+    HEALTH_DASH_PARTITIONS=data/processed/partitioned python src/app.py
+"""
+import argparse
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Import local modules (works both as script and module)
+try:
+    from . import data_processing, storage
+    from .partitions import PartitionedWriter
+except ImportError:
+    import data_processing
+    import storage
+    from partitions import PartitionedWriter
+
+DEFAULT_CHUNK_ROWS = 250_000
+DEFAULT_OUT = os.path.join(data_processing.DATA_DIR, 'processed', 'ingested')
+
+# Everything the filters, charts, cube and the segment / chronic-condition engines read
+DASHBOARD_COLUMNS = list(dict.fromkeys(
+    list(data_processing.FILTER_COLUMNS.values())
+    + ['Age']
+    + data_processing.OUTCOME_VARS
+    + data_processing.BEHAVIOR_VARS
+    + ['Food_security', 'Mental_health_state']
+    + data_processing.YES_NO_FIELDS
+))
+
+# dtype load_data gives decoded label columns
+LABEL_DTYPE = str(pd.Series(['']).dtype)
+
+CYCLE_COLUMN = 'Cycle'
+
+
+def _header(path):
+    """Column names of a raw CSV, with the Health_utility_index alias resolved"""
+    columns = pd.read_csv(path, nrows=0).columns.tolist()
+    if 'Health_utility_index' not in columns:
+        found = next((c for c in data_processing.HUI_CANDIDATES if c in columns), None)
+        if found is not None:
+            columns[columns.index(found)] = 'Health_utility_index'
+    return columns
+
+
+def schema(columns, cycles=None):
+    """``TableWriter`` schema: coded columns as map-ordered label codes, the rest as float64"""
+    dtypes = data_processing.compact_dtypes()
+    if cycles:
+        dtypes[CYCLE_COLUMN] = pd.CategoricalDtype([str(c) for c in cycles], ordered=True)
+        columns = list(columns) + [CYCLE_COLUMN]
+    entries = []
+    for name in columns:
+        if name in dtypes:
+            categories = dtypes[name].categories.tolist()
+            entries.append({'name': name, 'kind': 'labels', 'dtype': LABEL_DTYPE, 'categories': categories,
+                            'ordered': bool(dtypes[name].ordered), 'storage': storage._code_dtype(len(categories))})
+        else:
+            entries.append({'name': name, 'kind': 'numeric', 'dtype': 'float64', 'storage': 'float64'})
+    return entries
+
+
+def _code_lookups(columns):
+    """``pd.Index`` of raw codes per coded column; a raw value's position is its category code"""
+    coded = dict(data_processing.CODE_MAPS, **{f: data_processing.YES_NO_MAP for f in data_processing.YES_NO_FIELDS})
+    return {name: pd.Index(list(coded[name]), dtype='float64') for name in columns if name in coded}
+
+
+def iter_chunks(path, columns, chunk_rows=DEFAULT_CHUNK_ROWS, cycle=None):
+    """Decoded chunks of one raw CSV: ``{column: array}`` with codes for coded columns.
+
+    ``cycle`` is the code every row gets in the ``Cycle`` column.
+    """
+    header = _header(path)
+    raw_names = pd.read_csv(path, nrows=0).columns.tolist()
+    renames = {raw: name for raw, name in zip(raw_names, header) if raw != name}
+    present = [name for name in columns if name in header]
+    usecols = [raw for raw, name in zip(raw_names, header) if name in present]
+    lookups = _code_lookups(columns)
+
+    reader = pd.read_csv(path, usecols=usecols, dtype={raw: 'float64' for raw in usecols}, chunksize=chunk_rows)
+    for frame in reader:
+        frame = frame.rename(columns=renames)
+        chunk = {}
+        for name in columns:
+            values = frame[name].to_numpy() if name in frame.columns else np.full(len(frame), np.nan)
+            # Values outside the map (non-response codes, blanks) become -1, i.e. missing
+            chunk[name] = lookups[name].get_indexer(values) if name in lookups else values
+
+        keep = np.ones(len(frame), dtype=bool)
+        for name in data_processing.REQUIRED_COLUMNS:
+            if name in chunk:
+                keep &= chunk[name] >= 0
+        chunk = {name: values[keep] for name, values in chunk.items()}
+        if cycle is not None:
+            chunk[CYCLE_COLUMN] = np.full(int(keep.sum()), cycle)
+        yield chunk
+
+
+def _source(path):
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _writer(out_path, columns, cycles, partition_by, metadata):
+    if partition_by:
+        return PartitionedWriter(out_path, schema(columns, cycles), partition_by, metadata)
+    return storage.TableWriter(out_path, schema(columns, cycles), metadata)
+
+
+def _ingest_file(path, out_path, columns, chunk_rows, cycles, cycle, partition_by):
+    """Stream one raw CSV into its own (possibly partitioned) table at ``out_path``"""
+    metadata = {'maps_digest': data_processing.maps_digest(), 'sources': [_source(path)]}
+    with _writer(out_path, columns, cycles, partition_by, metadata) as writer:
+        for chunk in iter_chunks(path, columns, chunk_rows, cycle):
+            writer.append(chunk)
+    return out_path
+
+
+def ingest(paths, out_path=DEFAULT_OUT, columns=None, chunk_rows=DEFAULT_CHUNK_ROWS, workers=1,
+           cycles=None, partition_by=None):
+    """Ingest raw CSVs, in order, into one table at ``out_path``; returns its row count.
+
+    ``columns`` defaults to ``DASHBOARD_COLUMNS`` (``'all'`` keeps every
+    column of the first file). ``cycles`` gives one survey-cycle label per
+    file; ``partition_by`` (e.g. ``['Province', 'Cycle']``) writes a
+    partitioned table. With ``workers > 1`` files are ingested in
+    parallel into temporary tables, which are then concatenated.
+    """
+    paths = list(paths)
+    if columns is None:
+        columns = DASHBOARD_COLUMNS
+    elif columns == 'all':
+        columns = _header(paths[0])
+    if cycles is not None and len(cycles) != len(paths):
+        raise ValueError(f"Got {len(cycles)} cycle labels for {len(paths)} files")
+    file_cycles = list(range(len(paths))) if cycles else [None] * len(paths)
+    metadata = {'maps_digest': data_processing.maps_digest(), 'sources': [_source(p) for p in paths]}
+
+    with _writer(out_path, columns, cycles, partition_by, metadata) as writer:
+        if workers > 1 and len(paths) > 1:
+            parts_dir = f'{out_path}.parts'
+            shutil.rmtree(parts_dir, ignore_errors=True)
+            try:
+                parts = [os.path.join(parts_dir, f'part-{i:04d}') for i in range(len(paths))]
+                n = len(paths)
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    done = list(pool.map(_ingest_file, paths, parts, [columns] * n, [chunk_rows] * n,
+                                         [cycles] * n, file_cycles, [partition_by] * n))
+                for part in done:
+                    writer.append_table(part)
+            finally:
+                shutil.rmtree(parts_dir, ignore_errors=True)
+        else:
+            for path, cycle in zip(paths, file_cycles):
+                for chunk in iter_chunks(path, columns, chunk_rows, cycle):
+                    writer.append(chunk)
+        rows = writer.rows
+
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('paths', nargs='+', help='raw CSV files, concatenated in this order')
+    parser.add_argument('--out', default=DEFAULT_OUT, help=f'table directory (default {DEFAULT_OUT})')
+    parser.add_argument('--workers', type=int, default=1, help='ingest this many files in parallel')
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS)
+    parser.add_argument('--all-columns', action='store_true', help='keep every column, not just the dashboard ones')
+    parser.add_argument('--cycles', nargs='+', help='survey-cycle label of each file, stored in a Cycle column')
+    parser.add_argument('--partition-by', nargs='+', choices=['Province', CYCLE_COLUMN],
+                        help='write a table partitioned by these columns')
+    parser.add_argument('--force', action='store_true', help='replace an existing table at --out')
+    args = parser.parse_args()
+
+    if os.path.exists(args.out):
+        if not args.force:
+            parser.error(f'{args.out} exists; pass --force to replace it')
+        shutil.rmtree(args.out)
+
+    if args.partition_by and CYCLE_COLUMN in args.partition_by and not args.cycles:
+        parser.error('--partition-by Cycle needs --cycles')
+    n = ingest(args.paths, args.out, columns='all' if args.all_columns else None, chunk_rows=args.chunk_rows,
+               workers=args.workers, cycles=args.cycles, partition_by=args.partition_by)
+    print(f'Ingested {n:,} rows from {len(args.paths)} file(s) into {args.out}')
@@ -0,0 +1,68 @@
+"""Per-process memory report.
+
+Reads ``/proc/self/smaps_rollup`` where available, so pages shared with
+the gunicorn master or mapped from the data cache are told apart from the
+worker's private memory. Falls back to ``/proc/self/status`` (RSS only)
+and then to ``resource`` (peak RSS) on other platforms.
+"""
+import os
+
+SMAPS_FIELDS = {
+    'Rss': 'rss',
+    'Pss': 'pss',
+    'Shared_Clean': 'shared_clean',
+    'Shared_Dirty': 'shared_dirty',
+    'Private_Clean': 'private_clean',
+    'Private_Dirty': 'private_dirty',
+}
+
+
+def _read_kb_fields(path, fields):
+    """``{name: bytes}`` for the ``<Field>: <n> kB`` lines of a /proc file"""
+    values = {}
+    with open(path) as fh:
+        for line in fh:
+            key, _, rest = line.partition(':')
+            if key in fields:
+                values[fields[key]] = int(rest.split()[0]) * 1024
+    return values
+
+
+def process_memory(pid=None):
+    """Memory of process ``pid`` (default: this one) in bytes: rss, pss, shared and private where the OS reports them"""
+    report = {'pid': pid or os.getpid()}
+    proc = f'/proc/{pid or "self"}'
+    try:
+        values = _read_kb_fields(f'{proc}/smaps_rollup', SMAPS_FIELDS)
+        report.update(values)
+        report['shared'] = values.get('shared_clean', 0) + values.get('shared_dirty', 0)
+        report['private'] = values.get('private_clean', 0) + values.get('private_dirty', 0)
+        return report
+    except OSError:
+        pass
+
+    try:
+        report.update(_read_kb_fields(f'{proc}/status', {'VmRSS': 'rss'}))
+        return report
+    except OSError:
+        pass
+
+    if pid is not None:
+        # resource only reports on this process
+        return report
+
+    import resource
+    import sys
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    report['max_rss'] = peak if sys.platform == 'darwin' else peak * 1024
+    return report
+
+
+def format_memory(report):
+    """One-line summary of a ``process_memory()`` report, in MiB"""
+    parts = [f"pid={report['pid']}"]
+    for name in ('rss', 'pss', 'shared', 'private', 'max_rss'):
+        if name in report:
+            parts.append(f"{name}={report[name] / (1024 * 1024):.1f}MiB")
+    return ' '.join(parts)
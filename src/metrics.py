@@ -0,0 +1,242 @@
+"""Latency, row-count and payload-size instrumentation, exposed as Prometheus text at /metrics.
+
+Callbacks are wrapped with ``@callback(name)`` and pipeline stages with
+``@stage(name, rows=...)``. Stage timings are inclusive (a stage calling
+another counts both). ``register(server)`` adds the ``/metrics`` route and
+records the size of every ``/_dash-update-component`` response per output.
+
+Metrics live in the worker process: with several gunicorn workers each
+scrape sees the worker that answered it. Set HEALTH_DASH_SLOW_MS to log
+callbacks slower than that, with their filter values and stage breakdown.
+"""
+import functools
+import logging
+import os
+import threading
+import time
+
+from dash.exceptions import PreventUpdate
+from flask import Response, g, request
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROW_BUCKETS = (0, 10, 100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+BYTE_BUCKETS = (1_000, 10_000, 50_000, 100_000, 250_000, 500_000, 1_000_000, 5_000_000)
+
+SLOW_MS = float(os.environ.get('HEALTH_DASH_SLOW_MS', '0') or 0)
+
+slow_log = logging.getLogger('health_dash.slow')
+
+_local = threading.local()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count per label value"""
+
+    def __init__(self, name, documentation, label):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_value, amount=1):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for label_value, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{{{self.label}="{_escape(label_value)}"}} {_number(value)}')
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label value"""
+
+    def __init__(self, name, documentation, label, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, value):
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][i] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for label_value, series in sorted(self._series.items()):
+                label = f'{self.label}="{_escape(label_value)}"'
+                cumulative = 0
+                for bound, count in zip(self.buckets, series['buckets']):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{{{label},le="{_number(bound)}"}} {cumulative}')
+                lines.append(f'{self.name}_sum{{{label}}} {_number(series["sum"])}')
+                lines.append(f'{self.name}_count{{{label}}} {series["count"]}')
+        return lines
+
+
+CALLBACK_SECONDS = Histogram('health_dash_callback_duration_seconds',
+                             'Wall time of each Dash callback', 'callback', LATENCY_BUCKETS)
+CALLBACK_ERRORS = Counter('health_dash_callback_errors_total',
+                          'Callbacks that raised (PreventUpdate excluded)', 'callback')
+SLOW_CALLBACKS = Counter('health_dash_slow_callbacks_total',
+                         'Callbacks slower than HEALTH_DASH_SLOW_MS', 'callback')
+STAGE_SECONDS = Histogram('health_dash_stage_duration_seconds',
+                          'Wall time of each data-pipeline or spec-building stage (inclusive)', 'stage', LATENCY_BUCKETS)
+STAGE_ROWS = Histogram('health_dash_stage_rows', 'Rows returned by each data-pipeline stage', 'stage', ROW_BUCKETS)
+RESPONSE_BYTES = Histogram('health_dash_response_bytes',
+                           'Uncompressed size of /_dash-update-component responses by output', 'output', BYTE_BUCKETS)
+HTTP_CACHE_REQUESTS = Counter('health_dash_http_cache_requests_total',
+                              'Cacheable chart requests by result (hit, not_modified, miss)', 'result')
+SHARED_CALLBACKS = Counter('health_dash_shared_callbacks_total',
+                           'Chart requests answered by an identical request already in flight', 'callback')
+SHARED_SECONDS = Counter('health_dash_shared_seconds_total',
+                         'Callback time not spent thanks to shared in-flight results', 'callback')
+SUPERSEDED_CALLBACKS = Counter('health_dash_superseded_callbacks_total',
+                               'Chart requests dropped because the same tab asked for a newer state', 'callback')
+APPROXIMATE_ANSWERS = Counter('health_dash_approximate_answers_total',
+                              'Chart requests answered from a stratified sample while the exact result computes',
+                              'callback')
+EXPORT_STATES = Counter('health_dash_export_states_total', 'Filter states answered by /api/export', 'format')
+
+METRICS = [CALLBACK_SECONDS, CALLBACK_ERRORS, SLOW_CALLBACKS, STAGE_SECONDS, STAGE_ROWS, RESPONSE_BYTES,
+           HTTP_CACHE_REQUESTS, SHARED_CALLBACKS, SHARED_SECONDS, SUPERSEDED_CALLBACKS, APPROXIMATE_ANSWERS,
+           EXPORT_STATES]
+
+
+def stage(name, rows=None):
+    """Decorator timing a pipeline stage; ``rows(result)`` gives the row count to record"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                STAGE_SECONDS.observe(name, elapsed)
+                breakdown = getattr(_local, 'stages', None)
+                if breakdown is not None:
+                    breakdown.append((name, elapsed))
+            if rows is not None:
+                STAGE_ROWS.observe(name, rows(result))
+            return result
+        return wrapper
+    return decorator
+
+
+def callback(name):
+    """Decorator timing a Dash callback and logging it when slower than HEALTH_DASH_SLOW_MS"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            outer = getattr(_local, 'stages', None)
+            _local.stages = []
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except PreventUpdate:
+                raise
+            except Exception:
+                CALLBACK_ERRORS.inc(name)
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                stages, _local.stages = _local.stages, outer
+                CALLBACK_SECONDS.observe(name, elapsed)
+                if SLOW_MS and elapsed * 1000 >= SLOW_MS:
+                    SLOW_CALLBACKS.inc(name)
+                    breakdown = ' '.join(f'{s}={t * 1000:.1f}ms' for s, t in stages)
+                    slow_log.warning('slow %s: %.1f ms args=%r %s', name, elapsed * 1000, args, breakdown)
+        return wrapper
+    return decorator
+
+
+def result_cache_lines(result_cache):
+    """Gauges and counters for a ``ResultCache``"""
+    stats = result_cache.stats()
+    lines = []
+    for key, kind, documentation in (
+        ('entries', 'gauge', 'Entries in the in-process result cache'),
+        ('bytes', 'gauge', 'Bytes held by the in-process result cache'),
+        ('hits', 'counter', 'In-process result cache hits'),
+        ('backend_hits', 'counter', 'Results found in the shared on-disk cache'),
+        ('misses', 'counter', 'Results computed because no cache had them'),
+        ('evictions', 'counter', 'Entries evicted from the in-process result cache'),
+    ):
+        name = f'health_dash_result_cache_{key}' + ('_total' if kind == 'counter' else '')
+        lines += [f'# HELP {name} {documentation}', f'# TYPE {name} {kind}', f'{name} {_number(stats[key])}']
+    return lines
+
+
+def prefetch_lines(prefetcher):
+    """Task counters, queue length and hit rate of a ``prefetch.Prefetcher``"""
+    stats = prefetcher.stats()
+    name = 'health_dash_prefetch_tasks_total'
+    lines = [f'# HELP {name} Speculative states by what became of them', f'# TYPE {name} counter']
+    for outcome in ('scheduled', 'computed', 'already_cached', 'interrupted', 'dropped', 'failed'):
+        lines.append(f'{name}{{outcome="{outcome}"}} {stats[outcome]}')
+    for key, kind, documentation in (
+        ('hits', 'counter', 'Requests for a state the prefetcher computed'),
+        ('misses', 'counter', 'Requests for a state the prefetcher had not computed'),
+        ('pending', 'gauge', 'States waiting in the prefetch queue'),
+        ('hit_rate', 'gauge', 'Share of requests answered from prefetched states'),
+        ('useful_rate', 'gauge', 'Share of prefetched states a request used'),
+    ):
+        name = f'health_dash_prefetch_{key}' + ('_total' if kind == 'counter' else '')
+        lines += [f'# HELP {name} {documentation}', f'# TYPE {name} {kind}', f'{name} {_number(stats[key])}']
+    return lines
+
+
+def render(result_cache=None, prefetcher=None):
+    """Every metric in Prometheus text format"""
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    if result_cache is not None:
+        lines += result_cache_lines(result_cache)
+    if prefetcher is not None:
+        lines += prefetch_lines(prefetcher)
+    return '\n'.join(lines) + '\n'
+
+
+def register(server, result_cache=None, route='/metrics', prefetcher=None):
+    """Add the metrics route to the Flask ``server`` and record Dash response sizes"""
+
+    @server.route(route)
+    def prometheus_metrics():
+        return Response(render(result_cache, prefetcher), content_type=CONTENT_TYPE)
+
+    @server.after_request
+    def record_response_bytes(response):
+        if request.path.endswith('/_dash-update-component') and not response.direct_passthrough:
+            output = (request.get_json(silent=True) or {}).get('output', 'unknown')
+            # Before compression: http_cache records the size of the bodies it compresses or serves compressed
+            size = g.pop('response_bytes', None)
+            RESPONSE_BYTES.observe(output, size if size is not None else response.calculate_content_length() or 0)
+        return response
@@ -0,0 +1,328 @@
+"""Column store partitioned by Province (and optionally survey cycle).
+
+A partitioned table is a directory with a ``partitions.json`` root
+manifest and one ``storage`` table per partition, e.g.
+``Province=Ontario/Cycle=2019/``. Each partition's manifest carries a
+small statistics footer (row count, label counts, numeric min/max/nulls,
+Gender x income counts), so row counts per Province x Gender x income
+are answered from metadata without touching column data.
+
+``PartitionedTable.load(province=...)`` reads or maps only the matching
+partitions, so a single-province deployment never loads the rest of the
+country. When several provinces are loaded, their rows are contiguous
+and ``PartitionPruner`` resolves a province filter over that row range
+only. Write partitioned tables with ``python -m src.ingest --partition-by Province``.
+"""
+import json
+import os
+import re
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+
+# Import local modules (works both as script and module)
+try:
+    from . import data_processing, storage
+    from .filter_index import FilterIndex
+except ImportError:
+    import data_processing
+    import storage
+    from filter_index import FilterIndex
+
+PARTITION_FORMAT_VERSION = 1
+ROOT_MANIFEST = 'partitions.json'
+
+NULL_PARTITION = '__null__'
+
+
+def _slug(value):
+    """Directory-safe form of a partition value"""
+    if value is None:
+        return NULL_PARTITION
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', str(value)).strip('_') or NULL_PARTITION
+
+
+def partition_stats(frame):
+    """Statistics footer of one partition"""
+    stats = {'rows': int(len(frame)), 'columns': {}}
+    for name in frame.columns:
+        column = frame[name]
+        nulls = int(column.isna().sum())
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            counts = column.value_counts(sort=False)
+            stats['columns'][name] = {'counts': {str(k): int(v) for k, v in counts.items() if v}, 'nulls': nulls}
+        elif pd.api.types.is_numeric_dtype(column.dtype):
+            values = column.to_numpy(dtype=float, na_value=np.nan)
+            finite = values[np.isfinite(values)]
+            stats['columns'][name] = {
+                'min': float(finite.min()) if len(finite) else None,
+                'max': float(finite.max()) if len(finite) else None,
+                'nulls': nulls,
+            }
+
+    if 'Gender' in frame.columns and 'Total_income' in frame.columns:
+        counts = frame.groupby(['Gender', 'Total_income'], observed=True).size()
+        stats['gender_income'] = [[str(g), str(i), int(n)] for (g, i), n in counts.items() if n]
+    return stats
+
+
+class PartitionedWriter:
+    """Stream chunks into one ``storage.TableWriter`` per partition.
+
+    Takes the same ``schema`` and chunks as ``TableWriter``; ``by`` names
+    label columns of the schema. ``close()`` computes each partition's
+    statistics footer and moves the whole table into place atomically.
+    """
+
+    def __init__(self, path, schema, by, metadata=None):
+        self.path = path
+        self.schema = schema
+        self.by = list(by)
+        self.metadata = dict(metadata or {})
+        self.rows = 0
+        entries = {entry['name']: entry for entry in schema}
+        missing = [name for name in self.by if entries.get(name, {}).get('kind') != 'labels']
+        if missing:
+            raise ValueError(f"Partition columns must be label columns of the table: {missing}")
+        self._categories = [entries[name]['categories'] for name in self.by]
+
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        self._tmp_path = os.path.join(parent, f'.tmp-{uuid.uuid4().hex}')
+        os.makedirs(self._tmp_path)
+        self._writers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        elif not self.close():
+            raise FileExistsError(f"A table already exists at {self.path}")
+
+    def _writer(self, values):
+        """TableWriter of the partition with these ``by`` values, created on first use"""
+        writer = self._writers.get(values)
+        if writer is None:
+            subdir = os.path.join(*[f'{name}={_slug(value)}' for name, value in zip(self.by, values)])
+            writer = storage.TableWriter(os.path.join(self._tmp_path, subdir), self.schema)
+            self._writers[values] = writer
+        return writer
+
+    def append(self, data):
+        """Split one chunk (arrays keyed by column name) over its partitions"""
+        codes = [np.asarray(data[name]) for name in self.by]
+        if not len(codes[0]):
+            return
+        # One integer per row combining the codes of every partition column (-1 shifted to 0)
+        key = np.zeros(len(codes[0]), dtype=np.int64)
+        for column_codes, categories in zip(codes, self._categories):
+            key = key * (len(categories) + 1) + (column_codes.astype(np.int64) + 1)
+
+        order = np.argsort(key, kind='stable')
+        bounds = np.flatnonzero(np.diff(key[order])) + 1
+        for rows in np.split(order, bounds):
+            first = rows[0]
+            values = tuple(
+                categories[c[first]] if c[first] >= 0 else None
+                for c, categories in zip(codes, self._categories)
+            )
+            self._writer(values).append({name: np.asarray(array)[rows] for name, array in data.items()})
+        self.rows += len(key)
+
+    def append_table(self, path):
+        """Append every partition of another partitioned table with the same schema"""
+        other = PartitionedTable(path)
+        if other.by != self.by:
+            raise ValueError(f"{path} is partitioned by {other.by}, not {self.by}")
+        for partition in other.partitions:
+            values = tuple(partition['values'][name] for name in self.by)
+            self._writer(values).append_table(os.path.join(path, partition['path']))
+        self.rows += other.rows
+
+    def close(self):
+        """Finish every partition and the root manifest; returns False if the table already exists"""
+        try:
+            partitions = []
+            for values in sorted(self._writers, key=lambda v: [(x is None, str(x)) for x in v]):
+                writer = self._writers[values]
+                writer.close()
+                stats = partition_stats(storage.read_table(writer.path, mmap_mode='r', labels_as_categorical=True))
+                storage.update_metadata(writer.path, partition=dict(zip(self.by, values)), stats=stats)
+                partitions.append({
+                    'values': dict(zip(self.by, values)),
+                    'path': os.path.relpath(writer.path, self._tmp_path),
+                    'rows': writer.rows,
+                })
+
+            manifest = {
+                'format_version': PARTITION_FORMAT_VERSION,
+                'by': self.by,
+                'rows': self.rows,
+                'partitions': partitions,
+                'metadata': self.metadata,
+            }
+            with open(os.path.join(self._tmp_path, ROOT_MANIFEST), 'w') as fh:
+                json.dump(manifest, fh)
+            try:
+                os.rename(self._tmp_path, self.path)
+            except OSError:
+                return False
+            return True
+        finally:
+            self.abort()
+
+    def abort(self):
+        """Drop everything written so far"""
+        for writer in self._writers.values():
+            writer.abort()
+        if os.path.exists(self._tmp_path):
+            shutil.rmtree(self._tmp_path, ignore_errors=True)
+
+
+def is_partitioned(path):
+    return os.path.exists(os.path.join(path, ROOT_MANIFEST))
+
+
+class PartitionedTable:
+    """Read side: partition pruning, lazy loading and metadata-only counts"""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(os.path.join(path, ROOT_MANIFEST)) as fh:
+                manifest = json.load(fh)
+        except (OSError, ValueError):
+            raise FileNotFoundError(f"No readable partitioned table at {path}")
+        if manifest.get('format_version') != PARTITION_FORMAT_VERSION:
+            raise FileNotFoundError(f"Partitioned table at {path} has an unsupported format")
+        self.by = manifest['by']
+        self.rows = manifest['rows']
+        self.partitions = manifest['partitions']
+        self.metadata = manifest['metadata']
+
+    def values(self, column):
+        """Distinct values of a partition column"""
+        return sorted({p['values'][column] for p in self.partitions if p['values'][column] is not None})
+
+    def select(self, **filters):
+        """Partitions matching ``column=value`` filters on partition columns ("All" or None matches all)"""
+        selected = self.partitions
+        for column, value in filters.items():
+            if column not in self.by:
+                raise KeyError(f"{column!r} is not a partition column ({self.by})")
+            if value is not None and value != 'All':
+                selected = [p for p in selected if p['values'][column] == value]
+        return selected
+
+    def cache_dir(self, province=None):
+        """Directory for derived data (cube, shared results) of a ``load(province)`` selection"""
+        if province in (None, 'All') or 'Province' not in self.by:
+            return self.path
+        selected = self.select(Province=province)
+        if len(selected) == 1:
+            return os.path.join(self.path, selected[0]['path'])
+        return os.path.join(self.path, f'Province={_slug(province)}')
+
+    def footer(self, partition):
+        """Statistics footer stored in a partition's manifest"""
+        manifest = storage.read_manifest(os.path.join(self.path, partition['path']))
+        return manifest['metadata'].get('stats', {}) if manifest else {}
+
+    def counts(self, **filters):
+        """Respondents per Province x Gender x Total_income, from the partition footers alone"""
+        rows = []
+        for partition in self.select(**filters):
+            province = partition['values'].get('Province')
+            for gender, income, n in self.footer(partition).get('gender_income', []):
+                rows.append((province, gender, income, n))
+        frame = pd.DataFrame(rows, columns=['Province', 'Gender', 'Total_income', 'count'])
+        return frame.groupby(['Province', 'Gender', 'Total_income'], sort=True)['count'].sum().reset_index()
+
+    def filter_options(self, province=None):
+        """Dropdown options for ``load(province)``, from the partition footers alone"""
+        present, ages, has_age = {}, [], False
+        for partition in self._selected(province):
+            columns = self.footer(partition).get('columns', {})
+            for column in data_processing.FILTER_COLUMNS.values():
+                if column in columns:
+                    present.setdefault(column, set()).update(columns[column].get('counts', {}))
+            if 'Age' in columns:
+                has_age = True
+                if columns['Age']['min'] is not None:
+                    ages += [columns['Age']['min'], columns['Age']['max']]
+        age_range = (min(ages), max(ages)) if ages else (() if has_age else None)
+        return data_processing.filter_options_from(present, age_range)
+
+    def _selected(self, province):
+        selected = self.select(Province=province) if 'Province' in self.by else self.partitions
+        if not selected:
+            raise FileNotFoundError(f"No partition for Province={province!r} in {self.path}")
+        return selected
+
+    def load(self, province=None, compact=False, mmap=False):
+        """``(frame, pruner)`` for the partitions of ``province`` (all when None / "All").
+
+        Column handling follows ``data_processing.load_data``. Partitions
+        are stacked grouped by Province (in manifest order within each
+        province), so each province's rows form one contiguous range,
+        whatever the order of the partition columns. Without a Province
+        partition column the pruner is None.
+
+        Stacking copies: with ``mmap`` only a single selected partition
+        stays memory-mapped. Several partitions are concatenated into
+        private memory, shared by forked workers only copy-on-write and
+        no longer backed by the page cache.
+        """
+        selected = self._selected(province)
+        if 'Province' in self.by:
+            selected = sorted(selected, key=lambda p: (p['values']['Province'] is None, str(p['values']['Province'])))
+
+        frames, ranges, start = [], {}, 0
+        for partition in selected:
+            frame = storage.read_table(os.path.join(self.path, partition['path']),
+                                       mmap_mode='r' if mmap else None,
+                                       labels_as_categorical=compact or mmap)
+            if mmap:
+                frame = data_processing.to_compact(frame, downcast=False)
+            elif compact:
+                frame = data_processing.to_compact(frame)
+            frames.append(frame)
+            key = partition['values'].get('Province')
+            low, _ = ranges.get(key, (start, start))
+            ranges[key] = (low, start + len(frame))
+            start += len(frame)
+
+        df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+        return df, PartitionPruner(df, ranges) if 'Province' in self.by else None
+
+
+class PartitionPruner:
+    """Resolve filter states within the row range of the selected province"""
+
+    def __init__(self, df, ranges):
+        self.df = df
+        self.ranges = ranges
+        self._indexes = {}
+
+    def _index(self, province):
+        index = self._indexes.get(province)
+        if index is None:
+            start, stop = self.ranges[province]
+            index = self._indexes[province] = FilterIndex(self.df.iloc[start:stop])
+        return index
+
+    def positions(self, province, age_group, gender, income, immigrant, aboriginal):
+        """Row positions in the loaded frame, like ``FilterIndex.positions``; None for province "All" """
+        if not province or province == 'All':
+            return None
+        if province not in self.ranges:
+            return np.empty(0, dtype=np.int32)
+        start, stop = self.ranges[province]
+        rows = self._index(province).positions('All', age_group, gender, income, immigrant, aboriginal)
+        if rows is None:
+            rows = np.arange(stop - start)
+        return (rows + start).astype(np.int32 if stop < np.iinfo(np.int32).max else np.int64)
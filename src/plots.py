@@ -1,23 +1,134 @@
 import altair as alt
+import pandas as pd
 
+FOOD_ORDER = ["Food secure", "Moderately food insecure", "Severely food insecure"]
+IMMIGRANT_ORDER = ["Yes", "No"]
 
-def behavior_outcome_scatter(df):
+# Behaviour variable -> (headline name, axis title, tooltip title) on Chart 2
+BEHAVIOR_LABELS = {
+    "Total_physical_act_time": ("Physical Activity", "Total physical activity time", "Physical act time"),
+    "Physical_vigorous_act_time": ("Vigorous Activity", "Vigorous physical activity time", "Vigorous act time"),
+    "Fruit_veg_con": ("Fruit & Vegetables", "Fruit and vegetable consumption", "Fruit/veg consumption"),
+    "Work_hours": ("Work Hours", "Hours worked per week", "Work hours"),
+}
+
+# Chart 2 brushing: shift-drag draws the brush, a plain drag still pans
+BRUSH_DRAG = "[pointerdown[event.shiftKey], window:pointerup] > window:pointermove!"
+PAN_DRAG = "[pointerdown[!event.shiftKey], window:pointerup] > window:pointermove!"
+
+
+def brush_param():
+    """Interval selection named ``brush`` that the app observes to cross-filter Charts 1 and 3"""
+    return alt.selection_interval(name="brush", encodings=["x", "y"], on=BRUSH_DRAG, translate=BRUSH_DRAG, zoom=False)
+
+
+def outcome_income_bars(data, outcome_var, intervals=True):
+    """
+    Chart 1: Outcome × Income Stacked Bar Chart
+    Requirements:
+      - X: the selected outcome variable
+      - Y: number of respondents (``count`` column of the aggregated data)
+      - Color: Total_income (income level)
+      - With ``intervals``, tooltips include the share of the income group and its 95% bootstrap interval
+        (``share``, ``share_ci``)
+    """
+    tooltip = [alt.Tooltip(f"{outcome_var}:N"), alt.Tooltip("Total_income:N"), alt.Tooltip("count:Q", format=",")]
+    if intervals:
+        tooltip += [alt.Tooltip("share:Q", title="Share of income group", format=".1%"),
+                    alt.Tooltip("share_ci:N", title="95% CI")]
+    chart = alt.Chart(data).mark_bar().encode(
+        x=alt.X(f"{outcome_var}:N", title=outcome_var.replace("_", " ").title(), axis=alt.Axis(labelAngle=-45, labelLimit=200)),
+        y=alt.Y("count:Q", title="Number of Respondents"),
+        color=alt.Color("Total_income:N", title="Income Level"),
+        tooltip=tooltip,
+    ).properties(width=700, height=450)
+
+    return chart
+
+
+def food_security_mental_health_bars(data, subtitle, food_sort=FOOD_ORDER, intervals=True):
+    """
+    Chart 3: Social Determinants Grouped Bar Chart
+    Requirements:
+      - X: Food_security, offset by Immigrant status
+      - Y: average mental health score (``avg_score``), 1 = Excellent ... 5 = Poor
+      - Tooltips include the respondent count per group
+      - With ``intervals``, error bars / tooltip: 95% bootstrap interval of the mean (``ci_low``, ``ci_high``, ``ci_label``)
+    """
+    tooltip = [
+        alt.Tooltip("Food_security:N", title="Food security"),
+        alt.Tooltip("Immigrant:N", title="Immigrant status"),
+        alt.Tooltip("avg_score:Q", title="Average mental health", format=".2f"),
+    ]
+    if intervals:
+        tooltip.append(alt.Tooltip("ci_label:N", title="95% CI"))
+    tooltip.append(alt.Tooltip("respondent_count:Q", title="Respondents", format=","))
+
+    bars = (
+        alt.Chart(data)
+        .mark_bar(size=60)
+        .encode(
+            x=alt.X("Food_security:N", title="Food security status",
+                     sort=food_sort,
+                     axis=alt.Axis(labelAngle=0, labelLimit=240, labelPadding=10),
+                     scale=alt.Scale(paddingInner=0.15, paddingOuter=0.2)),
+            xOffset=alt.XOffset("Immigrant:N", title=None),
+            y=alt.Y("avg_score:Q", title="Average mental health (1 = Excellent, 5 = Poor)",
+                     scale=alt.Scale(domain=[0, 5], nice=False)),
+            y2=alt.Y2(value=0),
+            color=alt.Color("Immigrant:N", title="Immigrant status",
+                            sort=IMMIGRANT_ORDER, scale=alt.Scale(range=["#1f77b4", "#ff7f0e"])),
+            tooltip=tooltip,
+        )
+    )
+
+    error_bars = (
+        alt.Chart(data)
+        .mark_rule(color="#111827", strokeWidth=1.5)
+        .encode(
+            x=alt.X("Food_security:N", sort=food_sort),
+            xOffset=alt.XOffset("Immigrant:N"),
+            y=alt.Y("ci_low:Q"),
+            y2=alt.Y2("ci_high:Q"),
+        )
+    )
+
+    baseline = alt.Chart(pd.DataFrame({"y": [0]})).mark_rule(color="#666", strokeWidth=1, opacity=0.8).encode(y="y:Q")
+
+    chart = (
+        (bars + error_bars + baseline if intervals else bars + baseline)
+        .properties(
+            width=640, height=430,
+            title={"text": "Social determinants: mental health by food security (immigrant status)",
+                   "subtitle": subtitle},
+        )
+        .configure_axis(labelFontSize=11, titleFontSize=13, gridColor="#e5e7eb", gridOpacity=0.7)
+        .configure_view(strokeWidth=0)
+        .configure_legend(titleFontSize=12, labelFontSize=10, orient="right", offset=10)
+    )
+
+    return chart
+
+
+def behavior_outcome_scatter(df, x_col="Total_physical_act_time", brush=False):
     """
     Chart 2: Behavior × Outcome Scatter Plot
     Requirements:
       - Altair scatter plot
-      - X: Total_physical_act_time
+      - X: the selected behaviour variable (Total_physical_act_time by default)
       - Y: Health_utility_index
       - Color: Total_income (income level)
       - Tooltips included
       - Connected to filters (handled in app.py by passing filtered df)
+      - ``brush``: shift-drag selects a rectangle (the ``brush`` param) instead of panning
     """
-    x_col = "Total_physical_act_time"
+    headline, x_title, x_tooltip = BEHAVIOR_LABELS[x_col]
     y_col = "Health_utility_index"
     income_col = "Total_income"
 
     required = [x_col, y_col, income_col]
-    missing = [c for c in required if c not in df.columns]
+    # Named (template) data has no columns to check
+    missing = [c for c in required if c not in df.columns] if hasattr(df, "columns") else []
     if missing:
         raise ValueError(f"Missing columns for Chart 2: {missing}")
 
@@ -25,11 +136,11 @@ def behavior_outcome_scatter(df):
         alt.Chart(df)
         .mark_circle(size=60, opacity=0.7)
         .encode(
-            x=alt.X(f"{x_col}:Q", title="Total physical activity time"),
+            x=alt.X(f"{x_col}:Q", title=x_title),
             y=alt.Y(f"{y_col}:Q", title="Health utility index"),
             color=alt.Color(f"{income_col}:N", title="Income level"),
             tooltip=[
-                alt.Tooltip(f"{x_col}:Q", title="Physical act time"),
+                alt.Tooltip(f"{x_col}:Q", title=x_tooltip),
                 alt.Tooltip(f"{y_col}:Q", title="Health utility index"),
                 alt.Tooltip(f"{income_col}:N", title="Income level"),
             ],
@@ -38,11 +149,57 @@ def behavior_outcome_scatter(df):
             width=700,
             height=450,
             title={
-                "text": "Behavior × Outcome: Physical Activity vs Health Utility",
-                "subtitle": "Colored by income level"
+                "text": f"Behavior × Outcome: {headline} vs Health Utility",
+                "subtitle": "Colored by income level" + (" · shift-drag to filter Charts 1 and 3" if brush else "")
+            },
+        )
+    )
+    if brush:
+        return chart.add_params(brush_param(), alt.selection_interval(name="pan", bind="scales", translate=PAN_DRAG))
+    return chart.interactive()
+
+
+def behavior_outcome_density(cells, x_domain, y_domain, n_respondents, x_col="Total_physical_act_time", brush=False):
+    """
+    Chart 2 (density mode): Behavior × Outcome as binned counts
+    Requirements:
+      - Input is the output of density.bin_2d (one row per non-empty cell)
+      - X / Y: bin centres on the behaviour variable / Health_utility_index scales
+      - Size: respondents in the cell; Color: income level
+      - Scale-bound "zoom" selection so the app can re-bin the visible domain
+      - ``brush``: shift-drag selects a rectangle (the ``brush`` param) instead of panning
+    """
+    headline, x_title, x_tooltip = BEHAVIOR_LABELS[x_col]
+    zoom = alt.selection_interval(bind="scales", name="zoom", translate=PAN_DRAG if brush else True)
+
+    chart = (
+        alt.Chart(cells)
+        .mark_circle(opacity=0.6)
+        .encode(
+            x=alt.X("x_mid:Q", title=x_title,
+                    scale=alt.Scale(domain=list(x_domain), nice=False)),
+            y=alt.Y("y_mid:Q", title="Health utility index",
+                    scale=alt.Scale(domain=list(y_domain), nice=False)),
+            size=alt.Size("count:Q", title="Respondents", scale=alt.Scale(range=[10, 600])),
+            color=alt.Color("group:N", title="Income level"),
+            tooltip=[
+                alt.Tooltip("group:N", title="Income level"),
+                alt.Tooltip("x_start:Q", title=f"{x_tooltip} from", format=",.1f"),
+                alt.Tooltip("x_end:Q", title=f"{x_tooltip} to", format=",.1f"),
+                alt.Tooltip("y_start:Q", title="Health utility from", format=".2f"),
+                alt.Tooltip("y_end:Q", title="Health utility to", format=".2f"),
+                alt.Tooltip("count:Q", title="Respondents", format=","),
+            ],
+        )
+        .add_params(*([zoom, brush_param()] if brush else [zoom]))
+        .properties(
+            width=700,
+            height=450,
+            title={
+                "text": f"Behavior × Outcome: {headline} vs Health Utility",
+                "subtitle": f"{n_respondents:,} respondents binned by income level · zoom to refine"
             },
         )
-        .interactive()
     )
 
-    return chart
\ No newline at end of file
+    return chart
@@ -0,0 +1,172 @@
+"""Speculative precompute of the filter states a user is likely to open next.
+
+Users change one dropdown at a time, so after a view of state ``S`` the
+next request is most likely ``S`` with a single field changed.
+``neighbours`` lists those one-step states (back to "All" first, fields
+interleaved so a small limit still covers every dropdown), and a
+``Prefetcher`` computes them on a few background threads into the
+result cache.
+
+Prefetching only runs while the worker is idle: a task waits until no
+real request is in flight, and tasks made of several steps stop between
+steps when a request arrives. Newer views go first, and when the queue is
+full the oldest tasks are dropped. ``stats()`` reports how many
+prefetched states a real request asked for afterwards (``hit_rate``) and
+how much of the prefetch work was used (``useful_rate``), to tune the
+neighbour limit.
+"""
+import heapq
+import itertools
+import threading
+from collections import OrderedDict
+
+# Fields of a prefetch state, in order: the six sidebar filters, then the Chart 1 outcome
+FIELDS = ('province', 'age_group', 'gender', 'income', 'immigrant', 'aboriginal', 'outcome_var')
+
+DEFAULT_WORKERS = 1
+MAX_PENDING = 256
+REMEMBERED = 2048
+
+
+def neighbours(state, choices, limit=None):
+    """States differing from ``state`` in exactly one field, most likely first.
+
+    ``choices`` maps each field name to its dropdown values. "All" comes
+    first for a field that is set, then the values next to the current one
+    in dropdown order; fields are interleaved round-robin.
+    """
+    per_field = []
+    for i, field in enumerate(FIELDS):
+        values = list(choices.get(field, ()))
+        current = state[i]
+        position = values.index(current) if current in values else 0
+        ordered = sorted((v for v in values if v != current),
+                         key=lambda v: (v != 'All', abs(values.index(v) - position)))
+        per_field.append([state[:i] + (value,) + state[i + 1:] for value in ordered])
+
+    result = []
+    for batch in itertools.zip_longest(*per_field):
+        result += [candidate for candidate in batch if candidate is not None]
+    return result if limit is None else result[:limit]
+
+
+class Prefetcher:
+    """Background threads computing speculative states while no real request is running.
+
+    ``compute(state, interrupted)`` does the work for one state and
+    returns False if it stopped early because ``interrupted()`` became
+    true; ``is_cached(state)`` skips states that are already computed.
+    """
+
+    def __init__(self, compute, is_cached=None, workers=DEFAULT_WORKERS, max_pending=MAX_PENDING):
+        self.compute = compute
+        self.is_cached = is_cached
+        self.workers = workers
+        self.max_pending = max_pending
+        self._heap = []
+        self._queued = set()
+        self._sequence = itertools.count()
+        self._prefetched = OrderedDict()
+        self._active = 0
+        self._cond = threading.Condition()
+        self._threads = []
+        self.counts = dict.fromkeys(
+            ('scheduled', 'computed', 'already_cached', 'interrupted', 'dropped', 'failed', 'hits', 'misses'), 0)
+
+    def start(self):
+        """Start the worker threads (daemons, so they never block shutdown); a no-op while they run.
+
+        Threads do not survive a fork, so a process forked from one that
+        started them (a preloaded gunicorn master) starts its own.
+        """
+        with self._cond:
+            if any(thread.is_alive() for thread in self._threads):
+                return
+            self._threads = []
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'health-dash-prefetch-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def begin_request(self):
+        """Mark a real request in flight; prefetch tasks pause until it ends"""
+        with self._cond:
+            self._active += 1
+
+    def end_request(self):
+        with self._cond:
+            self._active = max(0, self._active - 1)
+            if not self._active:
+                self._cond.notify_all()
+
+    def observe(self, state):
+        """Record a real request for ``state``: a hit if it was prefetched"""
+        with self._cond:
+            if self._prefetched.pop(state, None) is not None:
+                self.counts['hits'] += 1
+            else:
+                self.counts['misses'] += 1
+
+    def schedule(self, states):
+        """Queue ``states`` ahead of everything queued before, dropping the oldest beyond ``max_pending``"""
+        with self._cond:
+            priority = -next(self._sequence)
+            for rank, state in enumerate(states):
+                if state in self._queued:
+                    continue
+                heapq.heappush(self._heap, (priority, rank, state))
+                self._queued.add(state)
+                self.counts['scheduled'] += 1
+            if len(self._heap) > self.max_pending:
+                self._heap.sort()
+                for _, _, state in self._heap[self.max_pending:]:
+                    self._queued.discard(state)
+                self.counts['dropped'] += len(self._heap) - self.max_pending
+                del self._heap[self.max_pending:]
+                heapq.heapify(self._heap)
+            self._cond.notify()
+
+    def _interrupted(self):
+        return self._active > 0
+
+    def _next(self):
+        """Highest-priority queue entry, once the queue is non-empty and no real request is running"""
+        with self._cond:
+            while not self._heap or self._active:
+                self._cond.wait()
+            entry = heapq.heappop(self._heap)
+            self._queued.discard(entry[2])
+            return entry
+
+    def _run(self):
+        while True:
+            entry = self._next()
+            state = entry[2]
+            if self.is_cached is not None and self.is_cached(state):
+                outcome = 'already_cached'
+            else:
+                try:
+                    outcome = 'computed' if self.compute(state, self._interrupted) else 'interrupted'
+                except Exception:
+                    outcome = 'failed'
+            with self._cond:
+                self.counts[outcome] += 1
+                if outcome == 'computed':
+                    self._prefetched[state] = True
+                    self._prefetched.move_to_end(state)
+                    while len(self._prefetched) > REMEMBERED:
+                        self._prefetched.popitem(last=False)
+                elif outcome == 'interrupted':
+                    # Try again once the worker is idle, unless newer work has pushed it out
+                    if state not in self._queued:
+                        heapq.heappush(self._heap, entry)
+                        self._queued.add(state)
+
+    def stats(self):
+        """Counters, queue length and the rates to tune the neighbour limit with"""
+        with self._cond:
+            stats = dict(self.counts, pending=len(self._heap))
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        stats['useful_rate'] = stats['hits'] / stats['computed'] if stats['computed'] else 0.0
+        return stats
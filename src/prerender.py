@@ -0,0 +1,272 @@
+"""Offline pre-rendering of the chart specs for every sidebar state.
+
+The six sidebar dropdowns, the outcome toggle and the behaviour variable
+span a finite state space, and the data only changes with a new survey
+release. ``python -m src.prerender OUTPUT`` walks every combination (or
+a subset: ``--vary``, ``--max-filters``) through the Chart 1/2/3
+callbacks on a process pool and writes
+
+- ``specs/<sha256>.json.gz``: each distinct spec once, gzip-compressed
+  and named by the hash of its JSON, so files never change under a name
+  and can be cached forever (many states share e.g. the "no data" spec);
+- ``manifest.json``: for each chart, state key -> spec file, plus the
+  version of the data and code the specs were rendered from.
+
+With ``HEALTH_DASH_PRERENDERED=OUTPUT`` the app answers a chart request
+for a state in the manifest with the URL of its file instead of
+rendering it; the browser fetches the spec from the app
+(``/prerendered/<file>``) or, with ``HEALTH_DASH_PRERENDERED_URL``, from a
+static file server or CDN where the directory is published. States
+outside the manifest (brushed, zoomed, other settings) and manifests
+built from other data or code are rendered live as usual.
+
+    python -m src.prerender dist/prerendered                      # every state, all CPUs
+    python -m src.prerender dist/prerendered --vary province gender --max-filters 1
+"""
+import argparse
+import gzip
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from dash import ClientsideFunction, Input, Output
+from flask import Response, abort, request
+
+# Import local modules (works both as script and module)
+try:
+    from . import data_processing
+except ImportError:
+    import data_processing
+
+MANIFEST = 'manifest.json'
+SPECS = 'specs'
+ROUTE = '/prerendered/'
+FORMAT = 1
+GZIP_LEVEL = 9
+CHARTS = ('chart1', 'chart2', 'chart3')
+SIDEBAR = ('province', 'age_group', 'gender', 'income', 'immigrant', 'aboriginal')
+# Most filter states rendered per pool task
+CHUNK = 32
+
+
+def state_key(values):
+    """Manifest key of a state: its normalized dropdown values"""
+    return '|'.join(values)
+
+
+def encode(spec):
+    """JSON bytes of a spec, serialised the way Dash sends it"""
+    from plotly.io.json import to_json_plotly
+    return to_json_plotly(spec).encode()
+
+
+class SpecFile(str):
+    """URL of a prerendered spec, returned by a chart callback in place of the spec"""
+
+
+def source(result):
+    """Value of a chart's ``<chart>-source`` store: the URL of a prerendered spec, or the live spec"""
+    return {'url': str(result)} if isinstance(result, SpecFile) else {'spec': result}
+
+
+class Prerendered:
+    """Manifest of a prerendered directory, and the route serving its files"""
+
+    def __init__(self, directory, base_url=None):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST)) as fh:
+            manifest = json.load(fh)
+        if manifest.get('format') != FORMAT:
+            raise ValueError(f"{directory}: unsupported manifest format {manifest.get('format')!r}")
+        self.version = manifest['version']
+        self.charts = manifest['charts']
+        self.base_url = base_url.rstrip('/') + '/' if base_url else None
+
+    def __len__(self):
+        return sum(len(files) for files in self.charts.values())
+
+    def lookup(self, chart, values, version, prefix=''):
+        """``SpecFile`` of ``chart`` in the state ``values``, or None (not prerendered, or rendered from other
+        data or code than ``version``). ``prefix`` is the app's URL prefix for files it serves itself."""
+        if version != self.version:
+            return None
+        name = self.charts.get(chart, {}).get(state_key(values))
+        if name is None:
+            return None
+        return SpecFile((self.base_url or prefix + ROUTE) + name)
+
+    def status(self, version):
+        return {'states': len(self), 'current': version == self.version}
+
+    def register(self, app, charts=CHARTS):
+        """Add the file route and, per chart, the clientside callback turning its source store into the spec"""
+        specs = os.path.join(self.directory, SPECS)
+
+        @app.server.route(ROUTE + '<name>')
+        def prerendered_spec(name):
+            path = os.path.join(specs, os.path.basename(name))
+            if not name.endswith('.json.gz') or not os.path.isfile(path):
+                abort(404)
+            etag = name.split('.')[0]
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+            else:
+                with open(path, 'rb') as fh:
+                    response = Response(fh.read(), mimetype='application/gzip')
+                # Browsers decompress this themselves; assets/prerendered.js gunzips bodies sent as-is
+                if request.accept_encodings['gzip'] > 0:
+                    response.mimetype = 'application/json'
+                    response.headers['Content-Encoding'] = 'gzip'
+            response.set_etag(etag)
+            response.vary.add('Accept-Encoding')
+            # The name is the hash of the content, so it never changes
+            response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+            return response
+
+        for chart in charts:
+            app.clientside_callback(
+                ClientsideFunction(namespace='prerendered', function_name='spec'),
+                Output(chart, 'spec'),
+                Input(f'{chart}-source', 'data'),
+            )
+
+
+def _app():
+    """The dashboard module (loads the data on first import)"""
+    try:
+        from . import app
+    except ImportError:
+        import app
+    return app
+
+
+def states(choices, vary=SIDEBAR, max_filters=None):
+    """Normalized sidebar states: every combination of the ``vary`` fields' dropdown values, the others "All",
+    with at most ``max_filters`` fields other than "All"."""
+    fields = [choices[field] if field in vary else ['All'] for field in SIDEBAR]
+    for values in itertools.product(*fields):
+        if max_filters is None or sum(value != 'All' for value in values) <= max_filters:
+            yield values
+
+
+def _write(directory, body):
+    """Store ``body`` under its content hash (once) and return the file name"""
+    name = hashlib.sha256(body).hexdigest()[:32] + '.json.gz'
+    path = os.path.join(directory, SPECS, name)
+    if not os.path.exists(path):
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as fh:
+            fh.write(gzip.compress(body, GZIP_LEVEL, mtime=0))
+        os.replace(temporary, path)
+    return name
+
+
+def render(directory, filter_states, outcomes, behaviors, charts):
+    """Render and store the charts of ``filter_states``: ``[(chart, state key, file name, JSON bytes)]``"""
+    app = _app()
+    entries = []
+
+    def store(chart, values, spec):
+        body = encode(spec)
+        entries.append((chart, state_key(values), _write(directory, body), len(body)))
+
+    for filters in filter_states:
+        if 'chart1' in charts:
+            for outcome_var in outcomes:
+                store('chart1', filters + (outcome_var,), app.update_chart1(*filters, outcome_var))
+        if 'chart2' in charts:
+            for behavior_var in behaviors:
+                store('chart2', filters + (behavior_var,), app.update_chart2(*filters, None, behavior_var))
+        if 'chart3' in charts:
+            store('chart3', filters, app.update_chart3(*filters))
+    return entries
+
+
+def _context():
+    # Forked workers share the data the parent has loaded; elsewhere each worker loads it on first use
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return None
+
+
+def build(directory, vary=SIDEBAR, max_filters=None, outcomes=None, behaviors=None, charts=CHARTS, workers=None,
+          log=print):
+    """Prerender the states into ``directory`` and write its manifest; returns the manifest.
+
+    Runs before the dashboard module is imported in this process, which it then loads with the settings below.
+    """
+    # Specs are rendered exactly, without the request-time machinery (estimates, prefetching)
+    os.environ.update({'HEALTH_DASH_APPROXIMATE': '0', 'HEALTH_DASH_PREFETCH': '0', 'HEALTH_DASH_CLIENTSIDE': '0',
+                       'HEALTH_DASH_FAST_BOOT': '0'})
+    os.environ.pop('HEALTH_DASH_PRERENDERED', None)
+    app = _app()
+    if not app.data_loaded:
+        raise RuntimeError(app.data_status)
+
+    choices = app.prefetch_choices()
+    outcomes = list(outcomes or choices['outcome_var'])
+    behaviors = list(behaviors or [app.spec_templates.DEFAULT_BEHAVIOR])
+    filter_states = list(states(choices, vary, max_filters))
+    workers = workers or os.cpu_count() or 1
+    # Small walks still keep every worker busy
+    size = max(1, min(CHUNK, -(-len(filter_states) // (4 * workers))))
+    chunks = [filter_states[i:i + size] for i in range(0, len(filter_states), size)]
+    os.makedirs(os.path.join(directory, SPECS), exist_ok=True)
+
+    start = time.perf_counter()
+    manifest = {'format': FORMAT, 'version': app.spec_version(), 'rows': len(app.df),
+                'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                'charts': {chart: {} for chart in charts}}
+    files, total_bytes = set(), 0
+    log(f"Prerendering {len(filter_states):,} filter states x {len(charts)} charts on {workers} worker(s)")
+    with ProcessPoolExecutor(workers, mp_context=_context()) as pool:
+        jobs = [pool.submit(render, directory, chunk, outcomes, behaviors, charts) for chunk in chunks]
+        for done, job in enumerate(jobs, 1):
+            for chart, key, name, length in job.result():
+                manifest['charts'][chart][key] = name
+                if name not in files:
+                    files.add(name)
+                    total_bytes += length
+            if done % 50 == 0 or done == len(jobs):
+                log(f"  {min(done * size, len(filter_states)):,}/{len(filter_states):,} states "
+                    f"({time.perf_counter() - start:.0f}s)")
+
+    stored = sum(os.path.getsize(os.path.join(directory, SPECS, name)) for name in files)
+    manifest['files'] = len(files)
+    temporary = os.path.join(directory, MANIFEST + '.tmp')
+    with open(temporary, 'w') as fh:
+        json.dump(manifest, fh, separators=(',', ':'), sort_keys=True)
+    os.replace(temporary, os.path.join(directory, MANIFEST))
+    log(f"{sum(len(v) for v in manifest['charts'].values()):,} specs, {len(files):,} distinct files, "
+        f"{total_bytes / 1e6:,.1f} MB of JSON stored as {stored / 1e6:,.1f} MB in {time.perf_counter() - start:.0f}s")
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('output', help='directory for the spec files and manifest.json')
+    parser.add_argument('--vary', nargs='+', choices=SIDEBAR, default=list(SIDEBAR),
+                        help='sidebar fields to enumerate; the others stay "All" (default: all six)')
+    parser.add_argument('--max-filters', type=int, help='only states with at most this many sidebar filters set')
+    parser.add_argument('--outcomes', nargs='+', choices=data_processing.OUTCOME_VARS,
+                        help='Chart 1 outcome variables (default: every option)')
+    parser.add_argument('--behaviors', nargs='+', choices=data_processing.BEHAVIOR_VARS,
+                        help='Chart 2 behaviour variables (default: the default one)')
+    parser.add_argument('--charts', nargs='+', choices=CHARTS, default=list(CHARTS))
+    parser.add_argument('--workers', type=int, help='worker processes (default: one per CPU)')
+    args = parser.parse_args(argv)
+    try:
+        build(args.output, args.vary, args.max_filters, args.outcomes, args.behaviors, args.charts, args.workers)
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
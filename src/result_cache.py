@@ -0,0 +1,179 @@
+"""Memoized filter results shared across callbacks and users.
+
+Entries are keyed by the normalized filter tuple and hold row-position
+arrays or small aggregate frames, never copies of the full DataFrame.
+The in-process cache is LRU and bounded both by entry count and by
+bytes. An optional on-disk backend lets every gunicorn worker on the
+host reuse results another worker already computed.
+"""
+import hashlib
+import os
+import pickle
+import threading
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+_MISSING = object()
+
+
+def _nbytes(value):
+    """Approximate memory held by a cached value"""
+    if value is None:
+        return 0
+    if isinstance(value, bytes):
+        return len(value)
+    if isinstance(value, tuple):
+        return sum(_nbytes(item) for item in value)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+class DiskBackend:
+    """Local directory of pickled results, shared by processes on the same host"""
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._writes = 0
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key):
+        return os.path.join(self.path, hashlib.sha1(repr(key).encode()).hexdigest() + '.pkl')
+
+    def get(self, key):
+        try:
+            with open(self._file(key), 'rb') as fh:
+                stored_key, value = pickle.load(fh)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            return _MISSING
+        return value if stored_key == key else _MISSING
+
+    def put(self, key, value):
+        tmp_path = os.path.join(self.path, f'.tmp-{uuid.uuid4().hex}')
+        try:
+            with open(tmp_path, 'wb') as fh:
+                pickle.dump((key, value), fh, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._file(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._writes += 1
+        if self._writes % 64 == 0:
+            self.prune()
+
+    def prune(self):
+        """Delete the oldest files until the directory fits in ``max_bytes``"""
+        entries = []
+        for name in os.listdir(self.path):
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+            total -= size
+
+
+class ResultCache:
+    """Thread-safe LRU cache bounded by entry count and total bytes, with hit/miss counters"""
+
+    def __init__(self, max_entries=512, max_bytes=64 * 1024 * 1024, backend=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.backend = backend
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.backend_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        """Whether ``key`` is held in process, without counting a lookup or touching its LRU position"""
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+
+        if self.backend is not None:
+            value = self.backend.get(key)
+            if value is not _MISSING:
+                with self._lock:
+                    self.backend_hits += 1
+                self._store(key, value)
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def _store(self, key, value):
+        size = _nbytes(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def put(self, key, value):
+        self._store(key, value)
+        if self.backend is not None:
+            self.backend.put(key, value)
+
+    def get_or_compute(self, key, compute):
+        """Cached value for ``key``, calling ``compute()`` and storing the result on a miss"""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Counters for monitoring and tuning"""
+        with self._lock:
+            lookups = self.hits + self.backend_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'backend_hits': self.backend_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': (self.hits + self.backend_hits) / lookups if lookups else 0.0,
+            }
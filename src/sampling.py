@@ -0,0 +1,274 @@
+"""Stratified samples behind the approximate mode of Charts 1 and 3.
+
+At load time the respondents are split into strata by Province x Gender x
+Total_income and a few nested samples are drawn: each takes a fraction
+of every stratum, but never fewer than ``MIN_PER_STRATUM`` respondents
+(or the whole stratum when it is smaller), so small provinces and
+income groups stay represented. Each sampled row stands for
+``N_h / n_h`` respondents of its stratum.
+
+A ``SampleLevel`` answers the Chart 1 and Chart 3 aggregates from its
+rows with the usual stratified estimators: weighted totals, ratios of
+totals for shares and means, and their standard errors by linearisation
+with the finite-population correction, giving 95% intervals for the
+tooltips (left out for estimates resting on fewer than ``MIN_SAMPLED``
+sampled respondents). ``StratifiedSample.calibrate`` times each level once, so a
+request can take the largest sample whose answer fits its latency
+budget (``level_for``).
+
+``Refiner`` runs the exact computations in the background, one per state
+at a time, so the exact answer can replace the estimate once it is ready.
+"""
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Import local modules (works both as script and module)
+try:
+    from . import data_processing
+    from .filter_index import FilterIndex
+except ImportError:
+    import data_processing
+    from filter_index import FilterIndex
+
+STRATA = ('Province', 'Gender', 'Total_income')
+DEFAULT_FRACTIONS = (0.002, 0.01, 0.05)
+MIN_PER_STRATUM = 30
+# Estimates resting on fewer sampled respondents get no interval: linearisation understates their error
+MIN_SAMPLED = 10
+SEED = 20240551
+Z = 1.96
+
+CHART3_GROUPS = ['Food_security', 'Immigrant']
+
+# Columns a sample keeps: filters, chart dimensions and measures, brushing axes
+SAMPLE_COLUMNS = list(dict.fromkeys(
+    list(data_processing.FILTER_COLUMNS.values()) + ['Age']
+    + data_processing.OUTCOME_VARS + ['Food_security', 'Mental_health_state', 'Health_utility_index']
+    + data_processing.BEHAVIOR_VARS
+))
+
+
+def stratum_codes(df):
+    """Stratum of every row (missing labels form their own strata) and the number of strata"""
+    columns = [c for c in STRATA if c in df.columns]
+    if not columns:
+        return np.zeros(len(df), dtype=np.int64), 1
+    codes = df.groupby(columns, observed=True, dropna=False, sort=False).ngroup().to_numpy(dtype=np.int64)
+    return codes, int(codes.max()) + 1 if len(codes) else 1
+
+
+def _variance(sum_e, sum_e2, strata, n, N):
+    """Variance contribution of each (stratum, group) entry of a linearised total.
+
+    ``sum_e`` / ``sum_e2`` are the sums of the linearised variable and its
+    square over the stratum's sampled rows (zero on rows outside the group).
+    """
+    n_h = n[strata].astype(float)
+    N_h = N[strata].astype(float)
+    s2 = np.maximum(sum_e2 - sum_e ** 2 / n_h, 0) / np.maximum(n_h - 1, 1)
+    return N_h ** 2 * (1 - n_h / N_h) * s2 / n_h
+
+
+class SampleLevel:
+    """One stratified sample: its rows, their strata and the stratum sizes in sample and population"""
+
+    def __init__(self, frame, strata, n, N):
+        self.frame = frame
+        self.strata = strata
+        self.n = n
+        self.N = N
+        self.index = FilterIndex(frame)
+        # Seconds for the largest Chart 1 / Chart 3 answer, set by StratifiedSample.calibrate
+        self.cost = None
+
+    def __len__(self):
+        return len(self.frame)
+
+    def rows(self, filters, brush=None):
+        """Sample row positions matching the sidebar ``filters`` and the Chart 2 ``brush``"""
+        rows = self.index.positions(*filters)
+        rows = np.arange(len(self.frame)) if rows is None else rows
+        if brush is not None:
+            behavior_var, x_low, x_high, y_low, y_high = brush
+            x = self.frame[behavior_var].to_numpy(dtype=float, na_value=np.nan)[rows]
+            y = self.frame['Health_utility_index'].to_numpy(dtype=float, na_value=np.nan)[rows]
+            rows = rows[(x >= x_low) & (x <= x_high) & (y >= y_low) & (y <= y_high)]
+        return rows
+
+    def chart1(self, filters, outcome_var, brush=None):
+        """Estimated respondents per outcome x income, with the share of the income group and its 95% interval"""
+        rows = self.rows(filters, brush)
+        cells = pd.DataFrame({
+            'stratum': self.strata[rows],
+            'Total_income': self.frame['Total_income'].to_numpy()[rows],
+            outcome_var: self.frame[outcome_var].to_numpy()[rows],
+        }).dropna(subset=['Total_income', outcome_var])
+        columns = [outcome_var, 'Total_income', 'count', 'share', 'share_low', 'share_high', 'sampled']
+        if cells.empty:
+            return pd.DataFrame(columns=columns)
+
+        # Sampled respondents per (stratum, income) x outcome; an income group spans whole strata
+        table = cells.groupby(['stratum', 'Total_income', outcome_var], observed=True).size().unstack(fill_value=0)
+        a = table.to_numpy(dtype=float)
+        b = a.sum(axis=1, keepdims=True)
+        strata = table.index.get_level_values('stratum').to_numpy()
+        incomes = table.index.get_level_values('Total_income')
+        weights = (self.N[strata] / self.n[strata])[:, None]
+
+        totals = pd.DataFrame(weights * a, index=incomes, columns=table.columns).groupby(level=0, sort=False).sum()
+        shares = totals.div(totals.sum(axis=1), axis=0)
+        R = shares.loc[incomes].to_numpy()
+        # Share = total of 1{outcome} / total of 1{income group}: e = 1{outcome} - R on the group's rows
+        variance = _variance(a - R * b, a - 2 * R * a + R ** 2 * b, strata[:, None], self.n, self.N)
+        variance = pd.DataFrame(variance, index=incomes, columns=table.columns).groupby(level=0, sort=False).sum()
+        se = np.sqrt(variance.to_numpy()) / totals.sum(axis=1).to_numpy()[:, None]
+        # Sampled respondents of each income group, the shares' denominator
+        group_sampled = pd.Series(b[:, 0], index=incomes).groupby(level=0, sort=False).sum().loc[shares.index].to_numpy()
+
+        result = pd.DataFrame({
+            'count': totals.stack(),
+            'share': shares.stack(),
+            'share_low': (shares - Z * se).clip(0, 1).stack(),
+            'share_high': (shares + Z * se).clip(0, 1).stack(),
+            'sampled': pd.DataFrame(np.broadcast_to(group_sampled[:, None], shares.shape), index=shares.index,
+                                    columns=shares.columns).stack(),
+        })
+        result = result[result['count'] > 0].reset_index()
+        result.columns = ['Total_income', outcome_var] + columns[2:]
+        result['count'] = result['count'].round().astype(np.int64)
+        result.loc[result['sampled'] < MIN_SAMPLED, ['share_low', 'share_high']] = np.nan
+        return result[columns]
+
+    def chart3(self, filters, brush=None):
+        """Estimated mean mental-health score and respondents per Chart 3 bar, with the mean's 95% interval"""
+        rows = self.rows(filters, brush)
+        scores = self.frame['Mental_health_state'].iloc[rows].map(data_processing.MENTAL_HEALTH_SCORES)
+        cells = pd.DataFrame({
+            'stratum': self.strata[rows],
+            'Food_security': self.frame['Food_security'].to_numpy()[rows],
+            'Immigrant': self.frame['Immigrant'].to_numpy()[rows],
+            'score': scores.to_numpy(dtype=float, na_value=np.nan),
+        }).dropna()
+        columns = CHART3_GROUPS + ['avg_score', 'respondent_count', 'ci_low', 'ci_high', 'sampled']
+        if cells.empty:
+            return pd.DataFrame(columns=columns)
+
+        sums = (cells.assign(square=cells['score'] ** 2)
+                .groupby(['stratum'] + CHART3_GROUPS, observed=True)
+                .agg(c=('score', 'size'), s=('score', 'sum'), q=('square', 'sum'))
+                .reset_index())
+        weights = self.N[sums['stratum']] / self.n[sums['stratum']]
+        totals = sums[CHART3_GROUPS].assign(x=weights * sums['c'], y=weights * sums['s'], sampled=sums['c'])
+        totals = totals.groupby(CHART3_GROUPS, observed=True, sort=False)[['x', 'y', 'sampled']].sum()
+        means = totals['y'] / totals['x']
+
+        R = means.loc[pd.MultiIndex.from_frame(sums[CHART3_GROUPS])].to_numpy()
+        c, s, q = sums['c'].to_numpy(float), sums['s'].to_numpy(float), sums['q'].to_numpy(float)
+        # Mean = total of score / total of 1{group}: e = score - R on the group's rows
+        variance = sums[CHART3_GROUPS].assign(v=_variance(s - R * c, q - 2 * R * s + R ** 2 * c,
+                                                          sums['stratum'].to_numpy(), self.n, self.N))
+        variance = variance.groupby(CHART3_GROUPS, observed=True, sort=False)['v'].sum()
+        se = np.sqrt(variance.loc[totals.index].to_numpy()) / totals['x'].to_numpy()
+
+        result = totals.index.to_frame(index=False).assign(
+            avg_score=means.to_numpy(),
+            respondent_count=totals['x'].round().astype(np.int64).to_numpy(),
+            ci_low=means.to_numpy() - Z * se,
+            ci_high=means.to_numpy() + Z * se,
+            sampled=totals['sampled'].to_numpy(),
+        )
+        result.loc[result['sampled'] < MIN_SAMPLED, ['ci_low', 'ci_high']] = np.nan
+        return result[columns]
+
+
+class StratifiedSample:
+    """Nested stratified samples of ``df``, smallest first"""
+
+    def __init__(self, df, fractions=DEFAULT_FRACTIONS, min_per_stratum=MIN_PER_STRATUM, seed=SEED):
+        strata, n_strata = stratum_codes(df)
+        N = np.bincount(strata, minlength=n_strata)
+        # Rows grouped by stratum, in random order within each
+        order = np.lexsort((np.random.default_rng(seed).random(len(df)), strata))
+        rank = np.arange(len(df)) - np.concatenate([[0], np.cumsum(N)[:-1]])[strata[order]]
+        columns = [c for c in SAMPLE_COLUMNS if c in df.columns]
+
+        self.rows = len(df)
+        self.levels = []
+        for fraction in sorted(fractions):
+            n = np.minimum(N, np.maximum(min_per_stratum, np.ceil(fraction * N).astype(np.int64)))
+            positions = np.sort(order[rank < n[strata[order]]])
+            frame = df[columns].take(positions).reset_index(drop=True)
+            # Strata with no row in the population are never looked up; keep n >= 1 to avoid dividing by zero
+            self.levels.append(SampleLevel(frame, strata[positions], np.maximum(n, 1), np.maximum(N, 1)))
+
+    def calibrate(self, outcome_var=data_processing.OUTCOME_VARS[0], runs=2):
+        """Time the unfiltered Chart 1 and Chart 3 answers of every level (the most rows a request touches).
+
+        Each is timed ``runs`` times and the fastest kept, leaving out one-off setup on the first call.
+        """
+        everything = ('All',) * 6
+
+        def fastest(fn):
+            timings = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                fn()
+                timings.append(time.perf_counter() - start)
+            return min(timings)
+
+        for level in self.levels:
+            level.cost = max(fastest(lambda: level.chart1(everything, outcome_var)),
+                             fastest(lambda: level.chart3(everything)))
+        return self
+
+    def level_for(self, budget):
+        """Largest level whose answers fit ``budget`` seconds (the smallest when none does)"""
+        fitting = [level for level in self.levels if level.cost is not None and level.cost <= budget]
+        return fitting[-1] if fitting else self.levels[0]
+
+
+class Refiner:
+    """Runs exact computations on background threads, each key at most once at a time"""
+
+    def __init__(self, workers=1):
+        self.workers = workers
+        self._pool = None
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def submit(self, key, fn):
+        """Run ``fn()`` in the background unless ``key`` is already running or queued"""
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+            if self._pool is None:
+                # Created on first use, so a worker forked from a preloaded master gets its own threads
+                self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='health-dash-refine')
+        self._pool.submit(self._run, key, fn)
+
+    def _run(self, key, fn):
+        try:
+            fn()
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def pending(self, key):
+        """True while the computation for ``key`` is queued or running"""
+        with self._lock:
+            return key in self._pending
+
+
+def describe(level, total_rows):
+    """Short note on an estimate, e.g. "≈ estimated from a 1% stratified sample (10,000 respondents)" """
+    percent = 100 * len(level) / total_rows if total_rows else 0
+    share = f"{percent:.0f}%" if percent >= 1 else f"{percent:.1g}%"
+    if math.isclose(percent, 100):
+        share = "full"
+    return f"≈ estimated from a {share} stratified sample ({len(level):,} respondents) · exact result loading"
@@ -0,0 +1,231 @@
+"""Segment-risk engine for the high-risk demographic ranking panel.
+
+A segment is one Age group x Province x Gender combination. A single pass
+over the rows bins every respondent into a dense count array over the
+segment dimensions and the other sidebar filters (income, immigrant,
+aboriginal identity, each with an extra slot for missing values), holding
+per cell the respondents, and per chronic condition (``CONDITIONS``) those
+who answered and those who reported it. Prevalence, support and risk for
+every segment and condition are then array arithmetic over that small
+array; rows are never read again.
+
+Sidebar filters on segment dimensions only narrow which segments are
+ranked. Segment counts for the other filters are cached per filter state
+with one filter left open, so changing a single filter is a slice of a
+cached array rather than a new reduction.
+
+    python -m src.segments --top 10 --min-support 50 --province Ontario
+"""
+import argparse
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Import local modules (works both as script and module)
+try:
+    from . import data_processing
+    from .filter_index import normalize_filters
+except ImportError:
+    import data_processing
+    from filter_index import normalize_filters
+
+CONDITIONS = ['High_BP', 'Diabetic', 'Mood_disorder', 'Anxiety_disorder']
+
+# Filter name -> column of the ranked segment table
+SEGMENT_COLUMNS = {'age_group': 'Age_group', 'province': 'Province', 'gender': 'Gender'}
+# Filters that subset respondents without being segment dimensions
+OPEN_FILTERS = ('income', 'immigrant', 'aboriginal')
+
+DEFAULT_TOP_K = 10
+DEFAULT_MIN_SUPPORT = 30
+CACHE_ENTRIES = 256
+
+
+def _levels():
+    """Filter name -> values of its dimension, in map order"""
+    dtypes = data_processing.compact_dtypes()
+    levels = {'age_group': list(data_processing.AGE_GROUPS)}
+    for name, column in data_processing.FILTER_COLUMNS.items():
+        levels[name] = dtypes[column].categories.tolist()
+    return levels
+
+
+def _codes(df, name, levels):
+    """Position of each row's value of filter ``name`` in ``levels`` (-1 when missing or unknown)"""
+    codes = np.full(len(df), -1, dtype=np.int8)
+    if name == 'age_group':
+        if 'Age' in df.columns:
+            ages = df['Age'].to_numpy()
+            for i, group in enumerate(levels):
+                codes[data_processing.age_group_mask(ages, group)] = i
+        return codes
+    column = data_processing.FILTER_COLUMNS[name]
+    return data_processing.label_codes(df[column], levels).astype(np.int8) if column in df.columns else codes
+
+
+def _select(counts, axis, levels, value):
+    """Sum ``axis`` for "All", else take the slot of ``value`` (all zeros for an unseen value)"""
+    if value == 'All':
+        return counts.sum(axis=axis)
+    if value not in levels:
+        return np.zeros(counts.shape[:axis] + counts.shape[axis + 1:], dtype=counts.dtype)
+    return counts.take(levels.index(value), axis=axis)
+
+
+class SegmentEngine:
+    """Dense segment counts with cached, incrementally updated filter reductions"""
+
+    def __init__(self, counts, levels, conditions):
+        # counts[age, province, gender, income, immigrant, aboriginal, measure]; measures are
+        # respondents, then respondents answering each condition, then respondents reporting it
+        self.counts = counts
+        self.levels = levels
+        self.conditions = list(conditions)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, df, conditions=CONDITIONS):
+        """Bin every row of ``df`` into the count array in one pass; every condition must be a column of ``df``"""
+        missing = [condition for condition in conditions if condition not in df.columns]
+        if missing:
+            raise KeyError(f"Condition column(s) missing from the data: {missing}")
+        levels = _levels()
+        segment_codes = [_codes(df, name, levels[name]) for name in SEGMENT_COLUMNS]
+        open_codes = [_codes(df, name, levels[name]) for name in OPEN_FILTERS]
+        keep = np.logical_and.reduce([codes >= 0 for codes in segment_codes])
+
+        # Missing values of the open filters get their own last slot, so "All" still counts them
+        shape = [len(levels[name]) for name in SEGMENT_COLUMNS] + [len(levels[name]) + 1 for name in OPEN_FILTERS]
+        open_codes = [np.where(codes >= 0, codes, len(levels[name])) for codes, name in zip(open_codes, OPEN_FILTERS)]
+        cells = np.ravel_multi_index([codes[keep] for codes in segment_codes + open_codes], shape)
+        size = int(np.prod(shape))
+
+        answered, reported = [], []
+        yes_no = list(data_processing.YES_NO_MAP.values())
+        for condition in conditions:
+            codes = data_processing.label_codes(df[condition], yes_no)[keep]
+            answered.append(np.bincount(cells, weights=codes >= 0, minlength=size))
+            reported.append(np.bincount(cells, weights=codes == yes_no.index('Yes'), minlength=size))
+        measures = [np.bincount(cells, minlength=size)] + answered + reported
+        counts = np.stack(measures, axis=-1).astype(np.int64).reshape(shape + [len(measures)])
+        return cls(counts, levels, conditions)
+
+    def segment_counts(self, income='All', immigrant='All', aboriginal='All'):
+        """``(age, province, gender, measure)`` counts for one state of the open filters.
+
+        Each computed state caches its counts with one filter left open, so
+        a later state differing in a single filter only slices that array.
+        """
+        state = (income, immigrant, aboriginal)
+        for axis, name in enumerate(OPEN_FILTERS):
+            key = (axis,) + state[:axis] + state[axis + 1:]
+            with self._lock:
+                partial = self._cache.get(key)
+                if partial is not None:
+                    self._cache.move_to_end(key)
+            if partial is not None:
+                return _select(partial, 3, self.levels[name], state[axis])
+
+        # Reduce the open filters one axis at a time, keeping one open for each cache entry
+        partials = {}
+        for axis in range(len(OPEN_FILTERS)):
+            partial = self.counts
+            for other in reversed(range(len(OPEN_FILTERS))):
+                if other != axis:
+                    partial = _select(partial, 3 + other, self.levels[OPEN_FILTERS[other]], state[other])
+            partials[(axis,) + state[:axis] + state[axis + 1:]] = partial
+        with self._lock:
+            self._cache.update(partials)
+            while len(self._cache) > CACHE_ENTRIES:
+                self._cache.popitem(last=False)
+        return _select(partials[(0,) + state[1:]], 3, self.levels[OPEN_FILTERS[0]], income)
+
+    def _in_scope(self, filters):
+        """Boolean ``(age, province, gender)`` mask of segments the sidebar filters allow"""
+        mask = np.ones(self.counts.shape[:3], dtype=bool)
+        for axis, name in enumerate(SEGMENT_COLUMNS):
+            value = filters[name]
+            if value == 'All':
+                continue
+            allowed = np.array([level == value for level in self.levels[name]])
+            mask &= allowed.reshape([-1 if i == axis else 1 for i in range(3)])
+        return mask
+
+    def prevalence(self, province='All', age_group='All', gender='All', income='All', immigrant='All',
+                   aboriginal='All'):
+        """Arrays over ``(age, province, gender, condition)`` for the sidebar state.
+
+        Returns ``respondents`` (per segment), ``answered``, ``reported``,
+        ``prevalence``, ``baseline`` (prevalence over all in-scope segments,
+        per condition), ``risk`` (prevalence / baseline) and ``in_scope``.
+        """
+        province, age_group, gender, income, immigrant, aboriginal = normalize_filters(
+            province, age_group, gender, income, immigrant, aboriginal)
+        filters = {'province': province, 'age_group': age_group, 'gender': gender}
+        counts = self.segment_counts(income, immigrant, aboriginal)
+        n = len(self.conditions)
+        answered = counts[..., 1:1 + n]
+        reported = counts[..., 1 + n:]
+        in_scope = self._in_scope(filters)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            prevalence = reported / answered
+            baseline = reported[in_scope].sum(axis=0) / answered[in_scope].sum(axis=0)
+            risk = prevalence / baseline
+        return {
+            'respondents': counts[..., 0],
+            'answered': answered,
+            'reported': reported,
+            'prevalence': prevalence,
+            'baseline': baseline,
+            'risk': risk,
+            'in_scope': in_scope,
+        }
+
+    def rank(self, province='All', age_group='All', gender='All', income='All', immigrant='All',
+             aboriginal='All', k=DEFAULT_TOP_K, min_support=DEFAULT_MIN_SUPPORT, conditions=None):
+        """Top ``k`` segment x condition pairs by risk, among those with ``min_support`` respondents answering"""
+        stats = self.prevalence(province, age_group, gender, income, immigrant, aboriginal)
+        wanted = np.array([c in (conditions or self.conditions) for c in self.conditions])
+        eligible = stats['in_scope'][..., None] & wanted & (stats['answered'] >= max(min_support, 1))
+        eligible &= np.isfinite(stats['risk'])
+
+        candidates = np.flatnonzero(eligible)
+        risk = stats['risk'].ravel()[candidates]
+        if len(candidates) > k:
+            keep = np.argpartition(-risk, k - 1)[:k]
+            candidates, risk = candidates[keep], risk[keep]
+        top = candidates[np.lexsort((candidates, -risk))]
+
+        age, prov, sex, condition = np.unravel_index(top, stats['risk'].shape)
+        segment = (age, prov, sex)
+        return pd.DataFrame({
+            'Age_group': [self.levels['age_group'][i] for i in age],
+            'Province': [self.levels['province'][i] for i in prov],
+            'Gender': [self.levels['gender'][i] for i in sex],
+            'condition': [self.conditions[i] for i in condition],
+            'prevalence': stats['prevalence'][segment + (condition,)],
+            'baseline': stats['baseline'][condition],
+            'risk': stats['risk'][segment + (condition,)],
+            'cases': stats['reported'][segment + (condition,)],
+            'support': stats['answered'][segment + (condition,)],
+            'respondents': stats['respondents'][segment],
+        })
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rank Age group x Province x Gender segments by chronic-condition risk.')
+    parser.add_argument('--top', type=int, default=DEFAULT_TOP_K)
+    parser.add_argument('--min-support', type=int, default=DEFAULT_MIN_SUPPORT)
+    parser.add_argument('--condition', nargs='+', choices=CONDITIONS, help='only rank these conditions')
+    for name in ('province', 'age_group', 'gender', 'income', 'immigrant', 'aboriginal'):
+        parser.add_argument(f"--{name.replace('_', '-')}", default='All')
+    args = parser.parse_args()
+
+    engine = SegmentEngine.build(data_processing.load_data(compact=True))
+    ranking = engine.rank(args.province, args.age_group, args.gender, args.income, args.immigrant, args.aboriginal,
+                          k=args.top, min_support=args.min_support, conditions=args.condition)
+    print(ranking.to_string(index=False, float_format=lambda x: f'{x:.3f}'))
@@ -0,0 +1,80 @@
+"""Compact columnar snapshot of the survey for the clientside mode.
+
+Only the columns the charts need are shipped. Label columns are
+dictionary-encoded (a label list plus int8/int16 codes), numeric columns
+are int16 or float64, and every array travels as base64 so the browser
+can view it as a typed array without parsing numbers. The JSON payload
+is gzip-compressed once at startup and served with long-lived cache
+headers.
+"""
+import base64
+import gzip
+import hashlib
+import json
+
+import numpy as np
+import pandas as pd
+
+# Import local modules (works both as script and module)
+try:
+    from . import data_processing, spec_templates
+except ImportError:
+    import data_processing
+    import spec_templates
+
+SNAPSHOT_COLUMNS = (
+    list(data_processing.FILTER_COLUMNS.values())
+    + ['Age']
+    + [v for v in data_processing.OUTCOME_VARS if v not in data_processing.FILTER_COLUMNS.values()]
+    + ['Food_security'] + data_processing.BEHAVIOR_VARS
+)
+
+INT16_MISSING = np.iinfo(np.int16).min
+
+
+def _b64(values):
+    return base64.b64encode(np.ascontiguousarray(values).astype(values.dtype.newbyteorder('<')).tobytes()).decode('ascii')
+
+
+def encode_column(series):
+    """Dictionary-encode a label column, or pack a numeric one as int16 / float64"""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        labels = series.cat.categories.tolist()
+        codes = series.cat.codes.to_numpy()
+    elif not pd.api.types.is_numeric_dtype(series.dtype):
+        codes, uniques = pd.factorize(series, sort=True)
+        labels = uniques.tolist()
+    else:
+        values = series.to_numpy(dtype=float, na_value=np.nan)
+        finite = values[np.isfinite(values)]
+        fits_int16 = (
+            len(finite) == 0
+            or (np.all(finite == np.round(finite)) and finite.min() > INT16_MISSING and finite.max() <= np.iinfo(np.int16).max)
+        )
+        if fits_int16:
+            packed = np.where(np.isfinite(values), values, INT16_MISSING).astype(np.int16)
+            return {'dtype': 'int16', 'missing': int(INT16_MISSING), 'data': _b64(packed)}
+        return {'dtype': 'float64', 'data': _b64(values)}
+
+    code_dtype = np.int8 if len(labels) < np.iinfo(np.int8).max else np.int16
+    return {'dtype': np.dtype(code_dtype).name, 'labels': labels, 'data': _b64(codes.astype(code_dtype))}
+
+
+def build_snapshot(df):
+    """The snapshot document: encoded columns plus what the clientside callbacks need to render"""
+    return {
+        'rows': int(len(df)),
+        'columns': {column: encode_column(df[column]) for column in SNAPSHOT_COLUMNS if column in df.columns},
+        'filter_columns': data_processing.FILTER_COLUMNS,
+        'age_groups': {group: list(bounds) for group, bounds in data_processing.AGE_GROUPS.items()},
+        'mental_scores': data_processing.MENTAL_HEALTH_SCORES,
+        'templates': spec_templates.all_templates(),
+        'default_behavior': spec_templates.DEFAULT_BEHAVIOR,
+    }
+
+
+def snapshot_payload(df):
+    """``(gzipped JSON bytes, version)``; the version is a content hash usable as an ETag"""
+    body = json.dumps(build_snapshot(df), separators=(',', ':')).encode('utf-8')
+    version = hashlib.sha256(body).hexdigest()[:16]
+    return gzip.compress(body, compresslevel=6), version
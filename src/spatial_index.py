@@ -0,0 +1,154 @@
+"""2D grid index behind brushing on Chart 2.
+
+Brushing a rectangle on the behaviour x Health_utility_index scatter
+restricts Charts 1 and 3 to the respondents inside it. Scanning two
+float columns of the whole frame per brush move is linear in the rows;
+a ``GridIndex`` answers the same rectangle query from a precomputed grid
+instead:
+
+- the plane is cut into ``bins x bins`` cells at quantiles of each axis
+  (so cells hold similar numbers of rows however skewed the variable);
+- row positions are stored sorted by cell, so the rows of a run of
+  cells along one column of the grid are one contiguous slice;
+- a query takes the slices of cells lying fully inside the rectangle as
+  they are and checks coordinates only for rows of the cells the
+  rectangle's border crosses.
+
+A query costs O(bins + rows returned + rows in border cells) rather than
+O(rows); a rectangle covering most of the data falls back to a plain
+scan, which is faster there. ``BrushIndex`` holds one grid per behaviour variable; the app
+builds them all at startup (``build``), before gunicorn forks its workers.
+"""
+import threading
+
+import numpy as np
+
+# Import local modules (works both as script and module)
+try:
+    from . import data_processing
+except ImportError:
+    import data_processing
+
+OUTCOME = 'Health_utility_index'
+DEFAULT_BINS = 64
+# Queries touching more than 1 / SCAN_FRACTION of the rows scan the columns instead
+SCAN_FRACTION = 4
+
+
+def _edges(values, bins):
+    """Quantile cell edges over the finite ``values`` (ties collapse cells; at least one cell)"""
+    if not len(values):
+        return np.array([0.0, 1.0])
+    edges = np.unique(np.quantile(values, np.linspace(0, 1, bins + 1)))
+    return edges if len(edges) > 1 else np.array([edges[0], edges[0]])
+
+
+def _cell(values, edges):
+    """Cell of each value along one axis; the last cell includes its upper edge"""
+    return np.clip(np.searchsorted(edges, values, side='right') - 1, 0, len(edges) - 2)
+
+
+def _spans(edges, low, high):
+    """``(first, last, inner_first, inner_last)`` cells overlapping ``[low, high]`` and lying fully inside it"""
+    n = len(edges) - 1
+    first = min(max(int(np.searchsorted(edges, low, side='right')) - 1, 0), n - 1)
+    last = min(int(np.searchsorted(edges, high, side='right')) - 1, n - 1)
+    inner_first = int(np.searchsorted(edges, low, side='left'))
+    inner_last = int(np.searchsorted(edges, high, side='right')) - 2
+    return first, last, inner_first, inner_last
+
+
+class GridIndex:
+    """Row positions of one (x, y) pair bucketed into a quantile grid"""
+
+    def __init__(self, x, y, bins=DEFAULT_BINS):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        valid = np.flatnonzero(np.isfinite(self.x) & np.isfinite(self.y))
+        self.x_edges = _edges(self.x[valid], bins)
+        self.y_edges = _edges(self.y[valid], bins)
+
+        self.n_y = len(self.y_edges) - 1
+        n_cells = (len(self.x_edges) - 1) * self.n_y
+        cells = _cell(self.x[valid], self.x_edges) * self.n_y + _cell(self.y[valid], self.y_edges)
+        # Stable, so rows stay in frame order within each cell
+        order = np.argsort(cells, kind='stable')
+        dtype = np.int32 if len(self.x) < np.iinfo(np.int32).max else np.int64
+        self.rows = valid[order].astype(dtype)
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(cells, minlength=n_cells))])
+
+    @property
+    def nbytes(self):
+        return self.rows.nbytes + self.offsets.nbytes
+
+    def query(self, x_range, y_range):
+        """Sorted row positions with x in ``x_range`` and y in ``y_range`` (both inclusive)"""
+        x_low, x_high = sorted(map(float, x_range))
+        y_low, y_high = sorted(map(float, y_range))
+        if x_high < self.x_edges[0] or x_low > self.x_edges[-1] or y_high < self.y_edges[0] or y_low > self.y_edges[-1]:
+            return self.rows[:0].copy()
+
+        x_first, x_last, x_inner_first, x_inner_last = _spans(self.x_edges, x_low, x_high)
+        y_first, y_last, y_inner_first, y_inner_last = _spans(self.y_edges, y_low, y_high)
+
+        certain, border = [], []
+        for ix in range(x_first, x_last + 1):
+            base = ix * self.n_y
+            start, stop = self.offsets[base + y_first], self.offsets[base + y_last + 1]
+            if x_inner_first <= ix <= x_inner_last and y_inner_first <= y_inner_last:
+                inner_start = self.offsets[base + max(y_inner_first, y_first)]
+                inner_stop = self.offsets[base + min(y_inner_last, y_last) + 1]
+                certain.append((inner_start, inner_stop))
+                border += [(start, inner_start), (inner_stop, stop)]
+            else:
+                border.append((start, stop))
+
+        x, y = self.x, self.y
+        if sum(stop - start for start, stop in certain + border) * SCAN_FRACTION > len(x):
+            # Most rows are in: gathering them costs more than one sequential scan
+            return np.flatnonzero((x >= x_low) & (x <= x_high) & (y >= y_low) & (y <= y_high)).astype(self.rows.dtype)
+
+        candidates = np.concatenate([self.rows[start:stop] for start, stop in border] or [self.rows[:0]])
+        x, y = x[candidates], y[candidates]
+        inside = candidates[(x >= x_low) & (x <= x_high) & (y >= y_low) & (y <= y_high)]
+        return np.sort(np.concatenate([self.rows[start:stop] for start, stop in certain] + [inside]))
+
+
+class BrushIndex:
+    """One ``GridIndex`` per behaviour variable against Health_utility_index, built by ``build`` or on first use"""
+
+    def __init__(self, df, bins=DEFAULT_BINS):
+        self.df = df
+        self.bins = bins
+        self._grids = {}
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        return sum(grid.nbytes for grid in self._grids.values())
+
+    def build(self):
+        """Build the grid of every behaviour variable in the frame; returns ``self``"""
+        for behavior_var in data_processing.BEHAVIOR_VARS:
+            if behavior_var in self.df.columns and OUTCOME in self.df.columns:
+                self.grid(behavior_var)
+        return self
+
+    def grid(self, behavior_var):
+        with self._lock:
+            grid = self._grids.get(behavior_var)
+            if grid is None:
+                grid = self._grids[behavior_var] = GridIndex(
+                    self.df[behavior_var].to_numpy(dtype=float, na_value=np.nan),
+                    self.df[OUTCOME].to_numpy(dtype=float, na_value=np.nan), self.bins)
+                # Built before gunicorn forks; read-only keeps them shared copy-on-write
+                for array in (grid.x, grid.y, grid.rows, grid.offsets):
+                    array.flags.writeable = False
+            return grid
+
+    def positions(self, brush):
+        """Row positions inside ``brush = (behavior_var, x_low, x_high, y_low, y_high)``"""
+        behavior_var, x_low, x_high, y_low, y_high = brush
+        if behavior_var not in data_processing.BEHAVIOR_VARS:
+            raise KeyError(f"Unknown behaviour variable {behavior_var!r}")
+        return self.grid(behavior_var).query((x_low, x_high), (y_low, y_high))
@@ -0,0 +1,146 @@
+"""Vega-Lite skeletons for the dashboard charts.
+
+Each template is the ``to_dict()`` of the chart built in ``plots.py`` over
+named data (``{"name": "table"}``) instead of a DataFrame. Templates are
+built once; a request only puts its aggregated rows into
+``datasets["table"]`` and swaps the subtitle, so Altair chart
+construction, schema validation and full-spec serialisation stay off
+the request path. Altair itself is only imported when the first template
+is built, keeping it off the app's startup path.
+"""
+import functools
+
+# Import local modules (works both as script and module)
+try:
+    from . import data_processing, metrics
+except ImportError:
+    import data_processing
+    import metrics
+
+TABLE = "table"
+# Chart 2's behaviour variable until the dropdown changes it
+DEFAULT_BEHAVIOR = "Total_physical_act_time"
+
+
+def _plots():
+    """The ``plots`` module (and Altair with it), imported on first use"""
+    try:
+        from . import plots
+    except ImportError:
+        import plots
+    return plots
+
+
+def _table():
+    import altair as alt
+    return alt.Data(name=TABLE)
+
+
+@functools.lru_cache(maxsize=None)
+def chart1_template(outcome_var, intervals=True):
+    return _plots().outcome_income_bars(_table(), outcome_var, intervals).to_dict()
+
+
+@functools.lru_cache(maxsize=None)
+def chart2_template(behavior_var=DEFAULT_BEHAVIOR, brushing=False):
+    return _plots().behavior_outcome_scatter(_table(), behavior_var, brush=brushing).to_dict()
+
+
+@functools.lru_cache(maxsize=None)
+def chart2_density_template(behavior_var=DEFAULT_BEHAVIOR, brushing=False):
+    return _plots().behavior_outcome_density(_table(), (0, 1), (0, 1), 0, behavior_var, brush=brushing).to_dict()
+
+
+@functools.lru_cache(maxsize=None)
+def chart3_template(intervals=True):
+    plots = _plots()
+    return plots.food_security_mental_health_bars(_table(), subtitle="", food_sort=plots.FOOD_ORDER,
+                                                  intervals=intervals).to_dict()
+
+
+def all_templates():
+    """Every chart skeleton, keyed the way the clientside callbacks look them up (they compute no intervals)"""
+    return {
+        "chart1": {outcome_var: chart1_template(outcome_var, False) for outcome_var in data_processing.OUTCOME_VARS},
+        "chart2": {behavior_var: chart2_template(behavior_var) for behavior_var in data_processing.BEHAVIOR_VARS},
+        "chart3": chart3_template(False),
+    }
+
+
+def warm(brushing=False, intervals=True):
+    """Build every template up front so the first request does not pay for Altair"""
+    all_templates()
+    if intervals:
+        for outcome_var in data_processing.OUTCOME_VARS:
+            chart1_template(outcome_var, True)
+        chart3_template(True)
+    chart2_density_template()
+    if brushing:
+        chart2_template(DEFAULT_BEHAVIOR, True)
+        chart2_density_template(DEFAULT_BEHAVIOR, True)
+
+
+def records(df):
+    """Rows of an aggregated frame as JSON-ready records, sanitised the way Altair does it"""
+    import altair as alt
+    return alt.utils.sanitize_dataframe(df).to_dict(orient="records")
+
+
+def fill(template, values, subtitle=None):
+    """Copy of ``template`` with ``values`` as its table (and a new subtitle); the template is never mutated"""
+    spec = dict(template)
+    spec["datasets"] = dict(template.get("datasets", {}), **{TABLE: values})
+    if subtitle is not None:
+        spec["title"] = dict(template["title"], subtitle=subtitle)
+    return spec
+
+
+@metrics.stage("chart1_spec")
+def chart1_spec(chart_data, outcome_var, intervals=True):
+    return fill(chart1_template(outcome_var, intervals), records(chart_data))
+
+
+def with_brush(spec, brush):
+    """Copy of ``spec`` whose ``brush`` selection starts at ``brush = (behavior_var, x_low, x_high, y_low, y_high)``"""
+    if brush is None:
+        return spec
+    _, x_low, x_high, y_low, y_high = brush
+    spec["params"] = [
+        dict(param, value={"x": [x_low, x_high], "y": [y_low, y_high]}) if param["name"] == "brush" else param
+        for param in spec["params"]
+    ]
+    return spec
+
+
+@metrics.stage("chart2_spec")
+def chart2_spec(plot_df, behavior_var=DEFAULT_BEHAVIOR, brushing=False, brush=None):
+    return with_brush(fill(chart2_template(behavior_var, brushing), records(plot_df)), brush)
+
+
+@metrics.stage("chart2_density_spec")
+def chart2_density_spec(cells, x_domain, y_domain, n_respondents, behavior_var=DEFAULT_BEHAVIOR, brushing=False,
+                        brush=None):
+    template = chart2_density_template(behavior_var, brushing)
+    spec = fill(template, records(cells),
+                subtitle=f"{n_respondents:,} respondents binned by income level · zoom to refine")
+    encoding = dict(template["encoding"])
+    for channel, domain in (("x", x_domain), ("y", y_domain)):
+        encoding[channel] = dict(encoding[channel], scale=dict(encoding[channel]["scale"], domain=list(domain)))
+    spec["encoding"] = encoding
+    return with_brush(spec, brush)
+
+
+def provisional(spec, note):
+    """Mark ``spec`` as an estimate the exact answer will replace: ``usermeta.approximate`` and ``note`` in its title"""
+    spec["usermeta"] = dict(spec.get("usermeta", {}), approximate=True)
+    title = spec.get("title")
+    if isinstance(title, dict):
+        spec["title"] = dict(title, subtitle=f"{title['subtitle']} · {note}" if title.get("subtitle") else note)
+    else:
+        spec["title"] = {"text": note, "fontSize": 12, "fontWeight": "normal", "color": "#6b7280", "anchor": "start"}
+    return spec
+
+
+@metrics.stage("chart3_spec")
+def chart3_spec(grouped, subtitle, intervals=True):
+    return fill(chart3_template(intervals), records(grouped), subtitle=subtitle)
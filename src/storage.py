@@ -0,0 +1,271 @@
+"""Binary column store for processed survey frames.
+
+A table is a directory holding one ``.npy`` file per column plus a
+``manifest.json``. Label columns are stored as integer codes with their
+categories in the manifest, so every file can be memory-mapped.
+
+Tables written in chunks by ``TableWriter`` hold headerless ``.bin``
+column files instead, with their numpy dtype in the manifest
+(``'storage'``); both read the same way.
+"""
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+
+FORMAT_VERSION = 1
+MANIFEST_NAME = 'manifest.json'
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """Return the sha256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _code_dtype(n_categories):
+    """Smallest signed integer dtype that can hold the codes plus -1 for missing"""
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_categories < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def _encode_column(series, order=None):
+    """Split a column into an array to save and its manifest entry.
+
+    ``order`` is an optional ``(categories, ordered)`` pair fixing the code
+    order of a label column, so it can be read back as that categorical
+    without recoding.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        categories = series.cat.categories.tolist()
+        codes = series.cat.codes.to_numpy()
+        entry = {'kind': 'categorical', 'dtype': 'category',
+                 'categories': categories, 'ordered': bool(series.cat.ordered)}
+        return codes.astype(_code_dtype(len(categories))), entry
+
+    if pd.api.types.is_numeric_dtype(series.dtype) or pd.api.types.is_bool_dtype(series.dtype):
+        values = series.to_numpy()
+        if values.dtype == object:
+            # Nullable extension types: store as float so missing stays NaN
+            values = series.astype('float64').to_numpy()
+        return values, {'kind': 'numeric', 'dtype': str(values.dtype)}
+
+    codes, uniques = pd.factorize(series)
+    categories = uniques.tolist()
+    if not all(isinstance(c, str) for c in categories):
+        raise TypeError(f"Column {series.name!r} mixes labels and non-string values")
+    entry = {'kind': 'labels', 'dtype': str(series.dtype), 'categories': categories}
+    if order is not None:
+        ordered_categories, ordered = order
+        # Labels outside the given order are kept, after it
+        known = set(ordered_categories)
+        categories = list(ordered_categories) + [c for c in categories if c not in known]
+        codes = pd.Categorical(series, categories=categories).codes
+        entry.update(categories=categories, ordered=bool(ordered))
+    return codes.astype(_code_dtype(len(categories))), entry
+
+
+def _decode_column(values, entry, labels_as_categorical=False):
+    """Rebuild a pandas column from its stored array and manifest entry"""
+    if entry['kind'] == 'numeric':
+        return values
+    categorical = pd.Categorical.from_codes(
+        values, categories=entry['categories'], ordered=entry.get('ordered', False)
+    )
+    if entry['kind'] == 'categorical' or labels_as_categorical:
+        return categorical
+    return pd.Series(categorical).astype(entry['dtype'])
+
+
+def write_table(df, path, metadata=None, label_orders=None):
+    """Write ``df`` to ``path`` atomically; returns False if another writer got there first.
+
+    ``label_orders`` maps column name to ``(categories, ordered)`` for label
+    columns whose codes should follow a fixed order.
+    """
+    label_orders = label_orders or {}
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    tmp_path = os.path.join(parent, f'.tmp-{uuid.uuid4().hex}')
+    os.makedirs(tmp_path)
+
+    try:
+        columns = []
+        for i, name in enumerate(df.columns):
+            values, entry = _encode_column(df[name], label_orders.get(name))
+            entry['name'] = name
+            entry['file'] = f'c{i:03d}.npy'
+            np.save(os.path.join(tmp_path, entry['file']), np.ascontiguousarray(values), allow_pickle=False)
+            columns.append(entry)
+
+        manifest = {
+            'format_version': FORMAT_VERSION,
+            'rows': int(len(df)),
+            'columns': columns,
+            'metadata': metadata or {},
+        }
+        with open(os.path.join(tmp_path, MANIFEST_NAME), 'w') as fh:
+            json.dump(manifest, fh)
+
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Directory already exists: a concurrent worker finished the same build
+            return False
+        return True
+    finally:
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def read_manifest(path):
+    """Return the manifest of a stored table, or None if it is missing or unreadable"""
+    try:
+        with open(os.path.join(path, MANIFEST_NAME)) as fh:
+            manifest = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('format_version') != FORMAT_VERSION:
+        return None
+    return manifest
+
+
+def update_metadata(path, **values):
+    """Merge ``values`` into the metadata of a stored table, replacing its manifest atomically"""
+    manifest = read_manifest(path)
+    if manifest is None:
+        raise FileNotFoundError(f"No readable table at {path}")
+    manifest['metadata'].update(values)
+    tmp_path = os.path.join(path, f'.tmp-{uuid.uuid4().hex}')
+    with open(tmp_path, 'w') as fh:
+        json.dump(manifest, fh)
+    os.replace(tmp_path, os.path.join(path, MANIFEST_NAME))
+
+
+def read_table(path, mmap_mode=None, labels_as_categorical=False):
+    """Load a stored table as a DataFrame; ``mmap_mode='r'`` maps the column files instead of reading them.
+
+    With ``labels_as_categorical`` label columns come back as ``pd.Categorical``
+    straight from their stored codes instead of being expanded to strings.
+    Together with ``mmap_mode='r'`` no column is copied: every array in the
+    frame is a read-only view of the page cache, shared by all processes
+    mapping the same table.
+    """
+    manifest = read_manifest(path)
+    if manifest is None:
+        raise FileNotFoundError(f"No readable table at {path}")
+
+    data = {}
+    for entry in manifest['columns']:
+        values = _load_values(path, entry, manifest['rows'], mmap_mode)
+        data[entry['name']] = _decode_column(values, entry, labels_as_categorical)
+
+    return pd.DataFrame(data, copy=False)
+
+
+def _load_values(path, entry, rows, mmap_mode=None):
+    """Stored array of one column, from a ``.npy`` file or a headerless ``.bin`` file"""
+    file_path = os.path.join(path, entry['file'])
+    if 'storage' not in entry:
+        return np.load(file_path, mmap_mode=mmap_mode, allow_pickle=False)
+    dtype = np.dtype(entry['storage'])
+    if mmap_mode is None or rows == 0:
+        return np.fromfile(file_path, dtype=dtype, count=rows)
+    return np.memmap(file_path, dtype=dtype, mode=mmap_mode, shape=(rows,))
+
+
+class TableWriter:
+    """Build a table chunk by chunk, e.g. while streaming a CSV that does not fit in memory.
+
+    ``schema`` lists one manifest entry per column (``name``, ``kind``,
+    ``dtype``, ``storage`` numpy dtype, plus ``categories``/``ordered``
+    for label columns, whose codes index the fixed categories). Columns
+    are appended to raw files in a temporary directory; ``close()`` writes
+    the manifest and moves the table into place atomically, like
+    ``write_table``.
+    """
+
+    def __init__(self, path, schema, metadata=None):
+        self.path = path
+        self.metadata = dict(metadata or {})
+        self.rows = 0
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        self._tmp_path = os.path.join(parent, f'.tmp-{uuid.uuid4().hex}')
+        os.makedirs(self._tmp_path)
+
+        self.columns = [
+            dict(entry, storage=np.dtype(entry['storage']).str, file=f'c{i:03d}.bin')
+            for i, entry in enumerate(schema)
+        ]
+        self._files = [open(os.path.join(self._tmp_path, entry['file']), 'wb') for entry in self.columns]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        elif not self.close():
+            raise FileExistsError(f"A table already exists at {self.path}")
+
+    def append(self, data):
+        """Append one chunk: equal-length arrays keyed by column name"""
+        lengths = {len(data[entry['name']]) for entry in self.columns}
+        if len(lengths) != 1:
+            raise ValueError(f"Chunk columns differ in length: {sorted(lengths)}")
+        for entry, fh in zip(self.columns, self._files):
+            np.ascontiguousarray(data[entry['name']], dtype=entry['storage']).tofile(fh)
+        self.rows += lengths.pop()
+
+    def append_table(self, path):
+        """Append every row of another stored table with the same schema, file by file"""
+        manifest = read_manifest(path)
+        if manifest is None:
+            raise FileNotFoundError(f"No readable table at {path}")
+        fields = ('name', 'kind', 'categories', 'ordered')
+        theirs = {entry['name']: entry for entry in manifest['columns']}
+        for entry, fh in zip(self.columns, self._files):
+            other = theirs.get(entry['name'])
+            if other is None or any(other.get(f) != entry.get(f) for f in fields):
+                raise ValueError(f"Column {entry['name']!r} of {path} does not match the table being written")
+            values = _load_values(path, other, manifest['rows'], mmap_mode='r')
+            np.ascontiguousarray(values, dtype=entry['storage']).tofile(fh)
+        self.rows += manifest['rows']
+
+    def close(self):
+        """Finish the table; returns False if another writer got there first"""
+        try:
+            for fh in self._files:
+                fh.close()
+            manifest = {
+                'format_version': FORMAT_VERSION,
+                'rows': self.rows,
+                'columns': self.columns,
+                'metadata': self.metadata,
+            }
+            with open(os.path.join(self._tmp_path, MANIFEST_NAME), 'w') as fh:
+                json.dump(manifest, fh)
+            try:
+                os.rename(self._tmp_path, self.path)
+            except OSError:
+                return False
+            return True
+        finally:
+            self.abort()
+
+    def abort(self):
+        """Drop everything written so far"""
+        for fh in self._files:
+            fh.close()
+        if os.path.exists(self._tmp_path):
+            shutil.rmtree(self._tmp_path, ignore_errors=True)
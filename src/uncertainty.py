@@ -0,0 +1,113 @@
+"""Bootstrap confidence intervals for the chart aggregates.
+
+Resampling the respondents of a group with replacement is the same as
+drawing its category counts from a multinomial with the observed shares,
+so a replicate costs O(categories) instead of O(respondents) and a whole
+batch of replicates for every group is a single ``Generator.multinomial``
+call. Batches run inline or on a process pool forked at startup
+(``start_pool``).
+
+Every interval rests on exactly ``replicates`` replicates drawn from
+fixed seeds, so the same counts always give the same interval, whatever
+the machine load and in every worker. That keeps intervals safe to cache
+per filter state, to share between workers and to prerender.
+"""
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+DEFAULT_REPLICATES = 1000
+BATCH_REPLICATES = 250
+ALPHA = 0.05
+SEED = 20240551
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def start_pool(workers):
+    """Start the process pool ``bootstrap`` spreads batches over, and fork its processes now; returns the pool.
+
+    Call it while the process runs no other thread (at startup, or in a
+    gunicorn worker right after the fork): a child forked while another
+    thread holds a lock (logging, the caches) inherits it held and can
+    deadlock.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+            # The first task forks every worker process before the pool starts its manager thread
+            _pool.submit(int).result()
+        return _pool
+
+
+def replicate_batch(counts, n_replicates, batch, values=None):
+    """``n_replicates`` bootstrap replicates of every group (row of ``counts``).
+
+    Returns group means of ``values`` (shape ``(n_replicates, groups)``)
+    when ``values`` is given, else category shares within each group
+    (shape ``(n_replicates, groups, categories)``).
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    totals = counts.sum(axis=1)
+    safe = np.maximum(totals, 1)
+    shares = counts / safe[:, None]
+    # Empty groups get any valid distribution; their draws are all zero
+    shares[totals == 0] = 1.0 / counts.shape[1]
+
+    rng = np.random.default_rng([SEED, batch])
+    draws = rng.multinomial(totals, shares, size=(n_replicates, len(counts)))
+    if values is not None:
+        return draws @ np.asarray(values, dtype=float) / safe
+    return draws / safe[:, None]
+
+
+def bootstrap(counts, values=None, replicates=DEFAULT_REPLICATES, workers=0):
+    """Stack ``replicates`` replicates from batches of ``BATCH_REPLICATES``, in batch order.
+
+    With ``workers > 1`` batches are spread over the pool of ``start_pool``;
+    they run inline while no pool has been started.
+    """
+    replicates = max(1, replicates)
+    sizes = [min(BATCH_REPLICATES, replicates - start) for start in range(0, replicates, BATCH_REPLICATES)]
+
+    if workers > 1 and len(sizes) > 1 and _pool is not None:
+        pool = _pool
+        futures = [pool.submit(replicate_batch, counts, size, i, values) for i, size in enumerate(sizes)]
+        results = [future.result() for future in futures]
+    else:
+        results = [replicate_batch(counts, size, i, values) for i, size in enumerate(sizes)]
+
+    return np.concatenate(results)
+
+
+def _interval(samples, alpha):
+    low, high = np.percentile(samples, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+    return low, high
+
+
+def mean_ci(counts, values, alpha=ALPHA, **kwargs):
+    """``(low, high, replicates)``: percentile interval of each group's mean of ``values``.
+
+    ``counts[g, k]`` is the number of respondents of group ``g`` whose
+    value is ``values[k]``. Empty groups get NaN.
+    """
+    counts = np.asarray(counts)
+    samples = bootstrap(counts, values=values, **kwargs)
+    low, high = _interval(samples, alpha)
+    empty = counts.sum(axis=1) == 0
+    low[empty] = high[empty] = np.nan
+    return low, high, len(samples)
+
+
+def proportion_ci(counts, alpha=ALPHA, **kwargs):
+    """``(low, high, replicates)``: percentile interval of each category's share within its group"""
+    counts = np.asarray(counts)
+    samples = bootstrap(counts, **kwargs)
+    low, high = _interval(samples, alpha)
+    empty = counts.sum(axis=1) == 0
+    low[empty] = high[empty] = np.nan
+    return low, high, len(samples)
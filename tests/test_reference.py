@@ -0,0 +1,484 @@
+"""The indexed paths against a plain pandas filter + groupby over the same synthetic frame.
+
+    python -m pytest tests
+"""
+import gzip
+import importlib
+import json
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+from dash.exceptions import PreventUpdate
+
+from benchmarks import synthetic
+from benchmarks.reference import apply_global_filters
+from src import coalesce, data_processing, export, http_cache, ingest, prefetch, sampling, storage
+from src.conditions import ConditionMatrix
+from src.cube import AggregateCube
+from src.filter_index import FilterIndex
+from src.partitions import PartitionedTable
+from src.segments import SegmentEngine
+from src.spatial_index import BrushIndex
+
+N_ROWS = 20_000
+
+# Broad to narrow, plus values that filter nothing (unknown age bucket, empty) or match nothing
+STATES = [
+    ('All', 'All', 'All', 'All', 'All', 'All'),
+    ('Ontario', 'All', 'All', 'All', 'All', 'All'),
+    ('All', '35-49', 'Female', 'All', 'All', 'All'),
+    ('Quebec', 'All', 'Male', '$40,000 to $59,999', 'All', 'All'),
+    ('British Columbia', '20-34', 'Female', 'All', 'Yes', 'No'),
+    ('Nunavut', '65+', 'Male', 'Less than $20,000', 'No', 'Yes'),
+    ('', '1-5', None, 'All', 'All', 'All'),
+    ('Nowhere', 'All', 'All', 'All', 'All', 'All'),
+]
+
+
+@pytest.fixture(scope='module', params=['labels', 'compact'])
+def df(request):
+    frame = data_processing.decode_raw(synthetic.generate(N_ROWS, seed=0)).reset_index(drop=True)
+    return data_processing.to_compact(frame) if request.param == 'compact' else frame
+
+
+@pytest.fixture(scope='module')
+def raw_csvs(tmp_path_factory):
+    """Two synthetic survey cycles as raw CSVs"""
+    root = tmp_path_factory.mktemp('raw')
+    return [synthetic.write_csv(str(root / f'cycle-{seed}.csv'), N_ROWS // 2, seed) for seed in (0, 1)]
+
+
+@pytest.fixture(scope='module')
+def ingested(raw_csvs, tmp_path_factory):
+    """``(table written by src.ingest, the same CSVs decoded in memory)``"""
+    path = str(tmp_path_factory.mktemp('ingest') / 'table')
+    ingest.ingest(raw_csvs, path)
+    decoded = data_processing.decode_raw(pd.concat([pd.read_csv(p) for p in raw_csvs], ignore_index=True))
+    return storage.read_table(path), decoded.reset_index(drop=True)
+
+
+@pytest.fixture(scope='module')
+def dashboard(raw_csvs, tmp_path_factory):
+    """``src.app`` serving an ingested synthetic table, with the HTTP cache on"""
+    path = str(tmp_path_factory.mktemp('dashboard') / 'table')
+    ingest.ingest(raw_csvs, path)
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(data_processing, 'TABLE_PATH', path)
+        patch.setenv('HEALTH_DASH_HTTP_CACHE_MB', '8')
+        app = importlib.import_module('src.app')
+    assert app.data_loaded, app.data_status
+    return app
+
+
+def _counts(series):
+    """``{key tuple: value}`` of a grouped series, labels as plain values"""
+    return {(key if isinstance(key, tuple) else (key,)): value for key, value in series.items()}
+
+
+@pytest.mark.parametrize('state', STATES)
+def test_filter_index_positions(df, state):
+    positions = FilterIndex(df).positions(*state)
+    expected = df.index.get_indexer(apply_global_filters(df, *state).index)
+    if positions is None:
+        assert len(expected) == len(df)
+    else:
+        np.testing.assert_array_equal(positions, expected)
+
+
+@pytest.mark.parametrize('state', STATES)
+@pytest.mark.parametrize('outcome_var', ['Gen_health_state', 'Mental_health_state'])
+def test_cube_chart1(df, state, outcome_var):
+    cells = AggregateCube.build(df).chart1(*state, outcome_var)
+    rows = apply_global_filters(df, *state).dropna(subset=[outcome_var, 'Total_income'])
+    expected = rows.groupby([outcome_var, 'Total_income'], observed=True).size()
+    assert _counts(cells.set_index([outcome_var, 'Total_income'])['count']) == _counts(expected)
+
+
+@pytest.mark.parametrize('state', STATES)
+def test_cube_chart3(df, state):
+    cells = AggregateCube.build(df).chart3(*state).set_index(['Food_security', 'Immigrant'])
+    rows = apply_global_filters(df, *state)
+    rows = rows.assign(score=rows['Mental_health_state'].map(data_processing.MENTAL_HEALTH_SCORES).astype(float))
+    rows = rows.dropna(subset=['Food_security', 'score', 'Immigrant'])
+    grouped = rows.groupby(['Food_security', 'Immigrant'], observed=True)['score']
+
+    assert _counts(cells['respondent_count']) == _counts(grouped.size())
+    means = _counts(grouped.mean())
+    assert _counts(cells['avg_score']) == pytest.approx(means)
+
+
+@pytest.mark.parametrize('behavior_var', data_processing.BEHAVIOR_VARS)
+def test_grid_index_query(df, behavior_var):
+    brush_index = BrushIndex(df).build()
+    x = df[behavior_var].to_numpy(dtype=float, na_value=np.nan)
+    y = df['Health_utility_index'].to_numpy(dtype=float, na_value=np.nan)
+
+    rng = np.random.default_rng(1)
+    quantiles = [(0.4, 0.45), (0.25, 0.75), (0.0, 1.0), (0.9, 0.1)] + [tuple(rng.random(2)) for _ in range(20)]
+    for low, high in quantiles:
+        x_range, y_range = np.nanquantile(x, [low, high]), np.nanquantile(y, [low, high])
+        x_low, x_high = sorted(x_range)
+        y_low, y_high = sorted(y_range)
+        expected = np.flatnonzero((x >= x_low) & (x <= x_high) & (y >= y_low) & (y <= y_high))
+        positions = brush_index.positions((behavior_var, *x_range, *y_range))
+        np.testing.assert_array_equal(positions, expected)
+
+    # Outside the data
+    assert not len(brush_index.positions((behavior_var, -2.0, -1.0, -2.0, -1.0)))
+
+
+@pytest.mark.parametrize('states, group_by', [
+    ([{'province': '*', 'gender': ['Male', 'Female']}], ['Total_income']),
+    ([{'province': '*'}], ['Age_group', 'Gen_health_state']),
+    ([{'province': 'Ontario'}, {}, {'province': 'Nowhere'}], ['Total_income']),
+    ([{'province': 'Nowhere', 'gender': ['Male', 'Female']}], ['Total_income', 'Age_group']),
+    ([{'province': 'Ontario', 'age_group': '35-49'}, {'gender': 'Female'}, {'province': 'Nowhere'}], []),
+    ([{'income': '*', 'aboriginal': 'Yes'}], []),
+])
+def test_export_batch(df, states, group_by):
+    values = ['Health_utility_index']
+    batch = export.Batch(df, states, group_by, values, index=FilterIndex(df))
+    frame = batch.frame()
+    assert len(frame) == sum(len(batch.table(state)) for state in batch.states)
+
+    for state in batch.states:
+        table = batch.table(state)
+        rows = apply_global_filters(df, *state)
+        if 'Age_group' in group_by:
+            rows = rows.assign(Age_group=data_processing.age_group_labels(rows['Age']))
+        rows = rows.dropna(subset=group_by)
+        if group_by and len(rows):
+            grouped = rows.groupby(group_by, observed=True)
+            expected = pd.DataFrame({'count': grouped.size(), 'mean': grouped[values[0]].mean(),
+                                     'n': grouped[values[0]].count()}).reset_index()
+            # Groups come out sorted, as the groupby sorts them
+            assert table[group_by].equals(data_processing.materialize_labels(expected[group_by]))
+        else:
+            # One total row, also when nothing matches (then with missing group_by values)
+            expected = pd.DataFrame({'count': [len(rows)], 'mean': [rows[values[0]].mean()],
+                                     'n': [rows[values[0]].count()]})
+            assert table[group_by].isna().all(axis=None)
+
+        assert (table[list(export.FILTER_NAMES)].to_numpy() == np.array(state, dtype=object)).all()
+        np.testing.assert_array_equal(table['count'], expected['count'])
+        np.testing.assert_array_equal(table[f'{values[0]}_n'], expected['n'])
+        np.testing.assert_allclose(table[f'{values[0]}_mean'], expected['mean'])
+
+
+@pytest.mark.parametrize('by', [['Province'], ['Province', 'Cycle'], ['Cycle', 'Province'], ['Cycle']])
+def test_partition_pruner(raw_csvs, tmp_path, by):
+    path = str(tmp_path / 'partitioned')
+    ingest.ingest(raw_csvs, path, cycles=['2017', '2019'], partition_by=by)
+    table = PartitionedTable(path)
+    df, pruner = table.load()
+    assert len(df) == table.rows
+    if 'Province' not in by:
+        # The app filters with the FilterIndex instead
+        assert pruner is None
+        assert table.cache_dir('Ontario') == path
+        return
+
+    for state in STATES:
+        positions = pruner.positions(*state)
+        expected = apply_global_filters(df, *state)
+        if positions is None:
+            assert state[0] in ('All', '')
+        else:
+            np.testing.assert_array_equal(positions, df.index.get_indexer(expected.index))
+
+    ontario, _ = table.load('Ontario')
+    assert (ontario['Province'] == 'Ontario').all()
+    assert len(ontario) == (df['Province'] == 'Ontario').sum()
+
+
+def _segment_rows(df, state):
+    """Rows in a segment (known age group, province and gender) matching ``state``, with their Age_group"""
+    rows = apply_global_filters(df, *state)
+    rows = rows.assign(Age_group=data_processing.age_group_labels(rows['Age']))
+    return rows.dropna(subset=['Age_group', 'Province', 'Gender'])
+
+
+@pytest.mark.parametrize('state', STATES)
+def test_segment_engine(df, state):
+    engine = SegmentEngine.build(df)
+    stats = engine.prevalence(*state)
+    levels = [engine.levels[name] for name in ('age_group', 'province', 'gender')]
+
+    # Every segment is counted under the open filters; the segment filters only narrow the scope
+    rows = _segment_rows(df, ('All', 'All', 'All') + state[3:])
+    for measure, reported_only in (('answered', False), ('reported', True)):
+        expected = np.zeros(stats[measure].shape, dtype=np.int64)
+        for c, condition in enumerate(engine.conditions):
+            answers = rows[condition]
+            hits = rows[answers == 'Yes'] if reported_only else rows[answers.notna()]
+            counts = hits.groupby(['Age_group', 'Province', 'Gender'], observed=True).size()
+            for (age, province, gender), n in counts.items():
+                expected[levels[0].index(age), levels[1].index(province), levels[2].index(gender), c] = n
+        np.testing.assert_array_equal(stats[measure], expected)
+
+    scoped = _segment_rows(df, state)
+    answered = scoped[engine.conditions].notna().sum().to_numpy()
+    reported = (scoped[engine.conditions] == 'Yes').sum().to_numpy()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        np.testing.assert_allclose(stats['baseline'], reported / answered)
+
+    ranking = engine.rank(*state, k=5, min_support=30)
+    eligible = stats['in_scope'][..., None] & (stats['answered'] >= 30) & np.isfinite(stats['risk'])
+    np.testing.assert_allclose(ranking['risk'], np.sort(stats['risk'][eligible])[::-1][:5])
+
+
+def test_segment_engine_on_ingested_table(ingested):
+    table, decoded = ingested
+    assert set(data_processing.YES_NO_FIELDS) <= set(table.columns)
+    np.testing.assert_array_equal(SegmentEngine.build(table).counts, SegmentEngine.build(decoded).counts)
+    assert len(SegmentEngine.build(table).rank())
+
+    with pytest.raises(KeyError, match='High_BP'):
+        SegmentEngine.build(decoded.drop(columns='High_BP'))
+
+
+@pytest.mark.parametrize('state', STATES)
+def test_condition_matrix(df, state):
+    matrix = ConditionMatrix.build(df)
+    rows = FilterIndex(df).positions(*state)
+    selected = apply_global_filters(df, *state)
+    conditions = matrix.conditions
+    answered = selected[conditions].notna()
+    reported = (selected[conditions] == 'Yes').astype(int)
+
+    prevalence = matrix.prevalence('Total_income', rows).set_index(['Total_income', 'condition'])
+    grouped = selected.dropna(subset=['Total_income'])
+    by_income = {
+        'answered': answered.loc[grouped.index].groupby(grouped['Total_income'], observed=True).sum().stack(),
+        'reported': reported.loc[grouped.index].groupby(grouped['Total_income'], observed=True).sum().stack(),
+    }
+    for measure, expected in by_income.items():
+        # Groups without respondents are listed with zero counts
+        assert _counts(prevalence[measure][prevalence[measure] > 0]) == _counts(expected[expected > 0])
+
+    comorbidity = matrix.comorbidity(rows)
+    np.testing.assert_array_equal(comorbidity['both'].to_numpy(), reported.T.to_numpy() @ reported.to_numpy())
+    answered = answered.astype(int)
+    np.testing.assert_array_equal(comorbidity['answered'].to_numpy(), answered.T.to_numpy() @ answered.to_numpy())
+
+    expected = reported.sum(axis=1).value_counts().reindex(range(len(conditions) + 1), fill_value=0)
+    np.testing.assert_array_equal(matrix.condition_counts(rows).to_numpy(), expected.to_numpy())
+
+
+def test_condition_matrix_on_ingested_table(ingested):
+    table, decoded = ingested
+    matrix, expected = ConditionMatrix.build(table), ConditionMatrix.build(decoded)
+    np.testing.assert_array_equal(matrix.reported, expected.reported)
+    np.testing.assert_array_equal(matrix.answered, expected.answered)
+    assert matrix.condition_counts().iloc[1:].sum() > 0
+
+    with pytest.raises(KeyError, match='Diabetic'):
+        ConditionMatrix.build(decoded.drop(columns='Diabetic'))
+
+
+def _exact_shares(df, state, outcome_var):
+    """Share of each outcome within its income group among the rows matching ``state``"""
+    rows = apply_global_filters(df, *state).dropna(subset=[outcome_var, 'Total_income'])
+    shares = rows.groupby('Total_income', observed=True)[outcome_var].value_counts(normalize=True)
+    return shares[shares > 0]
+
+
+def _exact_means(df, state):
+    """Mean mental-health score per Chart 3 bar among the rows matching ``state``"""
+    rows = apply_global_filters(df, *state)
+    rows = rows.assign(score=rows['Mental_health_state'].map(data_processing.MENTAL_HEALTH_SCORES).astype(float))
+    rows = rows.dropna(subset=['Food_security', 'score', 'Immigrant'])
+    return rows.groupby(sampling.CHART3_GROUPS, observed=True)['score'].mean()
+
+
+@pytest.mark.parametrize('state', STATES)
+def test_full_sample_is_exact(df, state):
+    # Every respondent sampled: weights of 1 and no sampling error, so the estimates are the exact answers
+    level = sampling.StratifiedSample(df, fractions=(1.0,)).levels[0]
+    cells = level.chart1(state, 'Gen_health_state').set_index(['Total_income', 'Gen_health_state'])
+    assert _counts(cells['share'].astype(float)) == pytest.approx(_counts(_exact_shares(df, state, 'Gen_health_state')))
+    bars = level.chart3(state).set_index(sampling.CHART3_GROUPS)
+    assert _counts(bars['avg_score'].astype(float)) == pytest.approx(_counts(_exact_means(df, state)))
+    intervals = bars[['ci_low', 'ci_high']].astype(float).dropna()
+    np.testing.assert_allclose(intervals['ci_low'], intervals['ci_high'])
+
+
+def test_sample_intervals_cover_exact_answers(df):
+    """The exact answers the Refiner swaps in fall inside the intervals shown with the estimates, as a rule"""
+    level = sampling.StratifiedSample(df).levels[-1]
+    inside = []
+    for state in STATES:
+        for outcome_var in ('Gen_health_state', 'Mental_health_state'):
+            shares = _exact_shares(df, state, outcome_var)
+            for cell in level.chart1(state, outcome_var).dropna(subset=['share_low']).itertuples():
+                exact = shares.get((cell.Total_income, getattr(cell, outcome_var)), 0)
+                inside.append(cell.share_low <= exact <= cell.share_high)
+        means = _exact_means(df, state)
+        for bar in level.chart3(state).dropna(subset=['ci_low']).itertuples():
+            inside.append(bar.ci_low <= means[(bar.Food_security, bar.Immigrant)] <= bar.ci_high)
+    assert len(inside) > 100
+    assert np.mean(inside) >= 0.85
+
+
+CHART1_INPUTS = ['province-filter', 'age-filter', 'gender-filter', 'income-filter', 'immigrant-filter',
+                 'aboriginal-filter', 'outcome-var']
+
+
+def _chart1_request(state, outcome_var):
+    """Body of the Dash request updating Chart 1 for ``state``"""
+    inputs = [{'id': id_, 'property': 'value', 'value': value}
+              for id_, value in zip(CHART1_INPUTS, list(state) + [outcome_var])]
+    return {
+        'output': 'chart1.spec',
+        'outputs': {'id': 'chart1', 'property': 'spec'},
+        'inputs': inputs + [{'id': 'brush', 'property': 'data', 'value': None}],
+        'state': [{'id': 'session-id', 'property': 'data', 'value': 'test'}],
+        'changedPropIds': ['province-filter.value'],
+    }
+
+
+def test_http_cache(dashboard):
+    client = dashboard.server.test_client()
+    body = _chart1_request(('Ontario', 'All', 'All', 'All', 'All', 'All'), 'Gen_health_state')
+
+    first = client.post(http_cache.ROUTE, json=body, headers={'Accept-Encoding': 'gzip'})
+    assert first.status_code == 200
+    assert first.headers['Content-Encoding'] == 'gzip'
+    answer = json.loads(gzip.decompress(first.data))
+    assert answer['response']['chart1']['spec'] == dashboard.update_chart1(*[item['value'] for item in body['inputs']])
+
+    # Repeats come from the cache, in the encoding each client accepts
+    again = client.post(http_cache.ROUTE, json=body, headers={'Accept-Encoding': 'gzip'})
+    assert again.data == first.data and again.get_etag() == first.get_etag()
+    plain = client.post(http_cache.ROUTE, json=body)
+    assert 'Content-Encoding' not in plain.headers
+    assert json.loads(plain.data) == answer
+
+    # A client holding the ETag is told its copy is current, even for a session it was not fetched in
+    etag = first.get_etag()[0]
+    other_session = dict(body, state=[{'id': 'session-id', 'property': 'data', 'value': 'other'}])
+    not_modified = client.post(http_cache.ROUTE, json=other_session, headers={'If-None-Match': f'"{etag}"'})
+    assert not_modified.status_code == 304 and not not_modified.data
+
+    # Another state is another key
+    other = _chart1_request(('Quebec', 'All', 'All', 'All', 'All', 'All'), 'Gen_health_state')
+    response = client.post(http_cache.ROUTE, json=other, headers={'If-None-Match': f'"{etag}"'})
+    assert response.status_code == 200 and response.get_etag()[0] != etag
+
+
+@pytest.mark.parametrize('age_group', [None, '', '1-5'])
+def test_chart3_without_age_filter(dashboard, age_group):
+    # Filters nothing, so it renders (title included) as "All"
+    everyone = dashboard.update_chart3('Ontario', 'All', 'All', 'All', 'All', 'All')
+    assert dashboard.update_chart3('Ontario', age_group, 'All', 'All', 'All', 'All') == everyone
+
+
+def _scrape(client):
+    """``{series: value}`` from the /metrics page"""
+    lines = [line for line in client.get('/metrics').get_data(as_text=True).splitlines() if not line.startswith('#')]
+    return {series: float(value) for series, value in (line.rsplit(' ', 1) for line in lines)}
+
+
+def test_metrics(dashboard):
+    client = dashboard.server.test_client()
+    body = _chart1_request(('Alberta', 'All', 'Female', 'All', 'All', 'All'), 'Mental_health_state')
+    before = _scrape(client)
+    first = client.post(http_cache.ROUTE, json=body, headers={'Accept-Encoding': 'gzip'})
+    client.post(http_cache.ROUTE, json=body, headers={'Accept-Encoding': 'gzip'})
+    after = _scrape(client)
+
+    def added(series):
+        return after.get(series, 0) - before.get(series, 0)
+
+    assert added('health_dash_http_cache_requests_total{result="miss"}') == 1
+    assert added('health_dash_http_cache_requests_total{result="hit"}') == 1
+    # The callback ran once, the hit never reached it
+    assert added('health_dash_callback_duration_seconds_count{callback="update_chart1"}') == 1
+    assert added('health_dash_stage_duration_seconds_count{stage="chart1_intervals"}') == 1
+    # Both responses are counted at their uncompressed size
+    assert added('health_dash_response_bytes_count{output="chart1.spec"}') == 2
+    assert added('health_dash_response_bytes_sum{output="chart1.spec"}') == 2 * len(gzip.decompress(first.data))
+
+
+def test_coalescer():
+    coalescer = coalesce.Coalescer()
+    release = threading.Event()
+    calls, results = [], {}
+
+    def render(value):
+        calls.append(value)
+        release.wait(10)
+        coalesce.checkpoint()
+        return value * 2
+
+    wrapped = coalescer.wrap('render', render)
+
+    def request(value, tab):
+        try:
+            results[value, tab] = wrapped(value, tab)
+        except PreventUpdate:
+            results[value, tab] = None
+
+    def send(value, tab, requests_of_tab):
+        thread = threading.Thread(target=request, args=(value, tab))
+        thread.start()
+        # Wait for the request to register with its tab
+        deadline = time.monotonic() + 5
+        while getattr(coalescer._sessions.get((tab, 'render')), 'latest', 0) < requests_of_tab:
+            assert time.monotonic() < deadline
+            time.sleep(0.001)
+        return thread
+
+    # Two tabs asking for the same state while it renders share one rendering
+    threads = [send(1, 'a', 1), send(1, 'b', 1)]
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert calls == [1] and results == {(1, 'a'): 2, (1, 'b'): 2}
+
+    # A tab's newer requests supersede the one rendering and the ones waiting: only the newest renders
+    release.clear()
+    calls.clear()
+    threads = [send(2, 'a', 2), send(3, 'a', 3), send(4, 'a', 4)]
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert calls == [2, 4]
+    assert [results[value, 'a'] for value in (2, 3, 4)] == [None, None, 8]
+
+
+def test_prefetcher():
+    choices = {field: ['All', 'a', 'b', 'c'] for field in prefetch.FIELDS}
+    state = ('a',) + ('All',) * 6
+    states = prefetch.neighbours(state, choices)
+    # Every state one dropdown away, each once; back to "All" first
+    assert len(states) == len(set(states)) == 3 * len(prefetch.FIELDS)
+    assert all(sum(x != y for x, y in zip(candidate, state)) == 1 for candidate in states)
+    assert states[0] == ('All',) * 7
+
+    computed = []
+    prefetcher = prefetch.Prefetcher(lambda state, interrupted: computed.append(state) or True,
+                                     is_cached=lambda state: state == states[1])
+    prefetcher.begin_request()
+    prefetcher.start()
+    prefetcher.schedule(states[:4])
+    time.sleep(0.05)
+    # Nothing runs while a real request is in flight
+    assert not computed
+    prefetcher.end_request()
+
+    deadline = time.monotonic() + 5
+    while prefetcher.stats()['computed'] + prefetcher.stats()['already_cached'] < 4:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+    assert computed == [states[0], states[2], states[3]]
+
+    prefetcher.observe(states[2])
+    prefetcher.observe(state)
+    stats = prefetcher.stats()
+    assert (stats['hits'], stats['misses'], stats['already_cached']) == (1, 1, 1)
+    assert stats['useful_rate'] == pytest.approx(1 / 3)